@@ -0,0 +1,150 @@
+# coding=utf-8
+
+"""
+Convert many trade files of a portfolio in one go, e.g., after a holiday or
+an outage when trade files of several days have piled up.
+
+The trade files are parsed in parallel in a process pool, then applied in
+date order. The accumulate history is read once, from the accumulate trade
+file before the earliest date, and then carried forward in memory. So each
+day's accumulate trade file is written without reading or copying the
+previous day's file.
+"""
+from tradefile_11490.main import readDatenPositions, getPortfolioFromFund \
+								, writeTrusteeTradeFile, writePortfolioFiles \
+								, getAccumulateLines, getAccumulateFileName \
+								, getNearestAccumulateFile, toAccumulateRow
+from tradefile_11490.manifest import updateManifest, getDateFromFilename
+from tradefile_11490.utility import getLedgerEnabled, getStoreEnabled, getDedupeEnabled \
+									, getValidationEnabled
+from tradefile_11490.tradekeys import checkedPositions
+from tradefile_11490.validation import validatePositions
+from tradefile_11490 import store
+from concurrent.futures import ProcessPoolExecutor
+from toolz.itertoolz import groupby
+from os.path import basename
+import logging, os, locale
+logger = logging.getLogger(__name__)
+
+
+
+def parseTradeFile(file):
+	"""
+	[String] file => ( [String] date (yyyy-mm-dd)
+					 , [List] positions
+					 )
+
+	Runs in a worker process, so the positions are returned as a list.
+	"""
+	date, positions = readDatenPositions(file)
+	return (date, list(positions))
+
+
+
+def toBytes(lines):
+	"""
+	[Iterable] lines => [Bytes] the same bytes as writing the lines to a
+		file opened in text mode, as the accumulate trade file is appended.
+	"""
+	return ''.join(lines).replace('\n', os.linesep) \
+			.encode(locale.getpreferredencoding(False))
+
+
+
+def parseTradeFiles(files, processes=None):
+	"""
+	[List] files, [Int] processes (None means number of CPUs)
+		=> [List] (date, positions), sorted by date
+
+	Parse the trade files in a process pool. Raise ValueError if two trade
+	files are of the same date, before anything is written.
+	"""
+	with ProcessPoolExecutor(processes) as pool:
+		parsed = sorted(pool.map(parseTradeFile, files), key=lambda t: t[0])
+
+	duplicates = list(filter( lambda t: len(t[1]) > 1
+							, groupby(lambda t: t[0], parsed).items()))
+	if len(duplicates) > 0:
+		lognRaise('parseTradeFiles(): more than one trade file for {0}'.format(
+					', '.join(map(lambda t: t[0], duplicates))))
+
+	return parsed
+
+
+
+def backfill(files, portfolio, outputDir, processes=None):
+	"""
+	[List] files (trade files)
+	[String] portfolio
+	[String] outputDir
+	[Int] processes
+		=> [List] ( [String] date
+				  , [String] trustee trade file
+				  , [String] accumulate trade file
+				  )
+
+	Side effect: write the trustee trade file and the accumulate trade file of
+	each trade file, in date order.
+
+	In ledger mode, a daily accumulate write already costs only the day's
+	trades, so each day goes through the normal writers.
+	"""
+	logger.info('backfill(): {0} files for {1}'.format(len(files), portfolio))
+
+	days = list(map( lambda t: (t[0], list(filter( lambda p: getPortfolioFromFund(p['Fund']) == portfolio
+												 , t[1])))
+				   , parseTradeFiles(files, processes)))
+
+	if getValidationEnabled():	# all days, before any of them is written
+		days = list(map( lambda t: (t[0], validatePositions(outputDir, portfolio, *t))
+					   , days))
+
+	if len(days) == 0:
+		return []
+
+	if getLedgerEnabled():
+		return list(map( lambda t: (t[0],) + tuple(writePortfolioFiles(outputDir, portfolio, t))
+					   , days))
+
+	nearestFile = getNearestAccumulateFile(outputDir, portfolio, days[0][0])
+	with open(nearestFile, 'rb') as f:
+		history = bytearray(f.read())
+
+	baseDate = getDateFromFilename(basename(nearestFile))
+
+	results = []
+	for date, positions in days:
+		trusteeFile = writeTrusteeTradeFile(outputDir, portfolio, date, positions)
+
+		commitTradeKeys = lambda: None
+		if getDedupeEnabled():
+			positions, commitTradeKeys = checkedPositions(
+				outputDir, portfolio, date, positions, toAccumulateRow
+			  , lambda: (nearestFile, baseDate))
+			positions = list(positions)
+
+		baseSize = len(history)
+		history.extend(toBytes(getAccumulateLines(positions)))
+		accumulateFile = getAccumulateFileName(outputDir, portfolio, date)
+		with open(accumulateFile, 'wb') as f:
+			f.write(history)
+
+		if getStoreEnabled():
+			if not store.hasPortfolio(portfolio):
+				store.storeLines(portfolio, baseDate, bytes(history[:baseSize]).splitlines(keepends=True))
+
+			store.storeLines( portfolio, date, bytes(history[baseSize:]).splitlines(keepends=True)
+							, list(map(lambda p: p['ISIN'], positions)))
+
+		commitTradeKeys()
+		updateManifest(outputDir, portfolio, date, accumulateFile, baseSize)
+		logger.debug('backfill(): {0} done'.format(date))
+		results.append((date, trusteeFile, accumulateFile))
+
+	return results
+
+
+
+def lognRaise(msg):
+	logger.error(msg)
+	raise ValueError
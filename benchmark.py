@@ -0,0 +1,354 @@
+# coding=utf-8
+
+"""
+Benchmark the conversion on synthetic data.
+
+1. generateTradeFile() writes a THRP trade file (xlsx) in the same layout as
+	the Bloomberg AIM report: a title line, a date line, the 'Trader Name'
+	header line, then N trades spread over the 11490, 11500 and 13006 funds.
+
+2. generateAccumulateHistory() writes M days of accumulate trade files
+	(Equities_*.csv) of a portfolio.
+
+3. runBenchmarks() times the startup check of main.py, then each stage
+	(parse, transform, write trustee trade file, write accumulate trade file,
+	find the nearest accumulate trade file) at several sizes, then appends the results to a json lines file and
+	compares them with the previous run, so that a regression is visible.
+
+The optional features (cache, store, ledger, etc.) are turned off while the
+stages are timed, whatever the config file says, so that the results of
+different machines and runs compare, and nothing is written outside the
+work directory (e.g., to the store database).
+
+To run, go to the parent directory of this package, then do
+
+	$python -m tradefile_11490.benchmark --sizes 100 1000 10000 --days 250
+"""
+from tradefile_11490.main import parseDatenPositions, writeTrusteeTradeFile \
+								, writeAccumulateTradeFile, getNearestAccumulateFile \
+								, getAccumulateFileName, getPortfolioFromFund
+from tradefile_11490.trade import derivedFields
+from tradefile_11490.utility import getCurrentDirectory, getConfig
+from contextlib import contextmanager
+from functools import partial
+from itertools import cycle, islice
+from datetime import datetime, timedelta
+from tempfile import TemporaryDirectory
+from os.path import join, exists, dirname
+import logging, random, time, json, subprocess, os, sys
+logger = logging.getLogger(__name__)
+
+
+
+tradeFileHeaders = \
+	[ 'Trader Name', 'Ticker and Exchange Code', 'ISIN Number', 'Short Name'
+	, 'Buy/Sell', 'Yield', 'As of Date', 'Settlement Date', 'Amount (Pennies)'
+	, 'Trade price', 'Transaction Cost 1 Amount', 'Transaction Cost 2 Amount'
+	, 'Transaction Cost 3 Amount', 'Transaction Cost 4 Amount'
+	, 'Transaction Cost 5 Amount', 'Currency', 'Firm Account Long Name'
+	, 'Accrued Interest', 'Settlement Total in Settlemen', 'Level 1 Tag Name'
+	]
+
+funds = ['11490-B', '11490-D', '11500', '13006']
+
+securities = \
+	[ ('700 HK', 'KYG875721634', 'TENCENT', 'HKD', 540.015)
+	, ('MU US', 'US5951121038', 'MICRON TECH', 'USD', 76.8836)
+	, ('IWM US', 'US4642876555', 'ISHARES RUSSELL', 'USD', 221.2967)
+	, ('5 HK', 'GB0005405286', 'HSBC HOLDINGS', 'HKD', 38.55)
+	, ('941 HK', 'HK0941009539', 'CHINA MOBILE', 'HKD', 52.3)
+	]
+
+brokers = ['CLSA LIMITED', 'MORGAN STANLEY', 'JP MORGAN', 'UBS SEC']
+
+excelEpoch = datetime(1899, 12, 30)
+
+
+
+def generateTrades(date, n, seed=0):
+	"""
+	[String] date (yyyy-mm-dd), [Int] n, [Int] seed
+		=> [Iterator] lines (trades) in the trade file layout
+	"""
+	rand = random.Random(seed)
+	tradeDate = datetime.strptime(date, '%Y-%m-%d')
+	ordinal = float((tradeDate - excelEpoch).days)
+
+	def toLine(fund):
+		ticker, isin, name, currency, price = rand.choice(securities)
+		amount = float(rand.randint(1, 500) * 100)
+		cost = round(amount * price * 0.0003, 2)
+		buySell = rand.choice(['B', 'S'])
+		return [ fund, ticker, isin, name, buySell, ''
+			   , ordinal, ordinal + 2, amount, price, cost, '', 1.5, '', ''
+			   , currency, rand.choice(brokers), ''
+			   , round(amount * price + (cost + 1.5 if buySell == 'B' else -cost - 1.5), 2)
+			   , rand.choice(['AFS', 'Trading'])
+			   ]
+
+	return map(toLine, islice(cycle(funds), n))
+
+
+
+def generateTradeFile(file, date, n, seed=0):
+	"""
+	[String] file (xlsx), [String] date (yyyy-mm-dd), [Int] n, [Int] seed
+		=> [String] file
+
+	Side effect: write a synthetic THRP trade file with n trades.
+	"""
+	from openpyxl import Workbook
+	wb = Workbook(write_only=True)
+	ws = wb.create_sheet()
+	ws.append(['China Life Franklin '])
+	ws.append(['Fundcode (THRS #22) ON ' + datetime.strftime(datetime.strptime(date, '%Y-%m-%d'), '%d/%m/%y')])
+	ws.append(tradeFileHeaders)
+	for line in generateTrades(date, n, seed):
+		ws.append(line)
+
+	wb.save(file)
+	return file
+
+
+
+def generateAccumulateHistory(outputDir, portfolio, lastDate, days, rowsPerDay, seed=0):
+	"""
+	[String] outputDir, [String] portfolio, [String] lastDate (yyyy-mm-dd)
+	[Int] days, [Int] rowsPerDay, [Int] seed
+		=> [List] accumulate trade files
+
+	Side effect: write accumulate trade files of the portfolio, one for each
+	of the 'days' week days up to the last date, each one holding all the
+	rows of the previous day plus 'rowsPerDay' new rows.
+	"""
+	rand = random.Random(seed)
+	header = 'FUND,,Security Code,Name of Security,Quantity (Share),Buy/Sell,Broker,Trade Date,Settlement Date,Avg. Dealing Price\n'
+
+	dates, d = [], datetime.strptime(lastDate, '%Y-%m-%d')
+	while len(dates) < days:
+		if d.weekday() < 5:
+			dates.insert(0, datetime.strftime(d, '%Y-%m-%d'))
+		d = d - timedelta(days=1)
+
+	def toRow(date):
+		ticker, _, name, _, price = rand.choice(securities)
+		return ','.join([ 'Fund ' + portfolio, '', ticker, name
+						, str(rand.randint(1, 500) * 100), rand.choice(['Buy', 'Sell'])
+						, rand.choice(brokers), date, date, str(price)]) + '\n'
+
+	files, content = [], header
+	for date in dates:
+		content = content + ''.join(map(lambda _: toRow(date), range(rowsPerDay)))
+		file = getAccumulateFileName(outputDir, portfolio, date)
+		with open(file, 'w') as f:
+			f.write(content)
+		files.append(file)
+
+	return files
+
+
+
+def timeIt(f, repeat=3):
+	"""
+	[Function] f, [Int] repeat => ([Float] best time in seconds, [Object] result)
+	"""
+	best, result = None, None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = f()
+		elapsed = time.perf_counter() - start
+		best = elapsed if best == None else min(best, elapsed)
+
+	return (best, result)
+
+
+
+"""
+	Sections of the config file with an "enabled" switch, all turned off for
+	the benchmark.
+"""
+featureSections = [ 'cache', 'store', 'ledger', 'dedupe', 'intraday', 'validation'
+				  , 'metrics', 'profile']
+
+
+
+@contextmanager
+def featuresOff():
+	"""
+	=> context manager turning the optional features off in the loaded config
+		inside it, restored afterwards.
+	"""
+	config = getConfig()
+	saved = dict(map( lambda s: (s, config[s]['enabled'])
+					, filter(lambda s: s in config, featureSections)))
+	for s in saved:
+		config[s]['enabled'] = 'false'
+
+	try:
+		yield
+	finally:
+		for s, value in saved.items():
+			config[s]['enabled'] = value
+
+
+
+def benchmarkSize(workDir, n, days, repeat=3):
+	"""
+	[String] workDir, [Int] n (trades), [Int] days (of history), [Int] repeat
+		=> [List] results, each one a dictionary
+
+	Time each stage for a trade file of n trades, with 'days' days of
+	accumulate history of portfolio 11490. The optional features are turned
+	off (see featuresOff()), and the trade file is parsed every time, not
+	read from the cache.
+	"""
+	with featuresOff():
+		return _benchmarkSize(workDir, n, days, repeat)
+
+
+
+def _benchmarkSize(workDir, n, days, repeat):
+	date, portfolio = '2021-07-09', '11490'
+	tradeFile = generateTradeFile(join(workDir, '{0}_1.xlsx'.format(n)), date, n)
+	generateAccumulateHistory(workDir, portfolio, '2021-07-08', days, 20)
+
+	parseTime, (_, positions) = timeIt(
+		lambda: (lambda t: (t[0], list(t[1])))(parseDatenPositions(tradeFile)), repeat)
+
+	positions = list(filter(lambda p: getPortfolioFromFund(p['Fund']) == portfolio, positions))
+
+	transformTime, _ = timeIt(
+		lambda: list(map(lambda p: list(map(lambda k: p[k], derivedFields)), positions)), repeat)
+
+	trusteeTime, _ = timeIt(
+		lambda: writeTrusteeTradeFile(workDir, portfolio, date, positions), repeat)
+
+	accumulateTime, _ = timeIt(
+		lambda: writeAccumulateTradeFile(workDir, portfolio, date, positions), repeat)
+
+	lookupTime, _ = timeIt(
+		lambda: getNearestAccumulateFile(workDir, portfolio, date), repeat)
+
+	toResult = lambda stage, seconds: \
+		{'stage': stage, 'trades': n, 'days': days, 'seconds': seconds}
+
+	return [ toResult('parse', parseTime)
+		   , toResult('transform', transformTime)
+		   , toResult('write trustee', trusteeTime)
+		   , toResult('write accumulate', accumulateTime)
+		   , toResult('nearest lookup', lookupTime)
+		   ]
+
+
+
+heavyModules = ['toolz', 'openpyxl', 'xlrd', 'clamc_datafeed', 'utils']
+
+
+
+def timeStartup(directory, repeat=3):
+	"""
+	[String] directory (without trade files), [Int] repeat
+		=> ( [Float] best time in seconds
+		   , [List] heavy modules loaded
+		   )
+
+	Time a fresh interpreter doing the quick check of main.py (see startup.py)
+	on a directory with nothing to convert. The check should not load any of
+	the heavy modules.
+	"""
+	code = '; '.join([ 'import sys'
+					 , 'from tradefile_11490.startup import hasInput'
+					 , 'hasInput(["--all"], sys.argv[1])'
+					 , 'print(",".join(filter(lambda m: m in sys.modules, {0})))'.format(repr(heavyModules))
+					 ])
+	env = dict(os.environ)
+	env['PYTHONPATH'] = os.pathsep.join(filter( lambda p: p != ''
+											  , [dirname(getCurrentDirectory()), env.get('PYTHONPATH', '')]))
+
+	best, output = timeIt(
+		lambda: subprocess.run( [sys.executable, '-c', code, directory], env=env
+							  , capture_output=True, text=True, check=True).stdout
+	  , repeat)
+
+	return (best, list(filter(lambda m: m != '', output.strip().split(','))))
+
+
+
+def loadPreviousResults(resultFile):
+	"""
+	[String] resultFile => [Dictionary] (stage, trades, days) => seconds of
+		the last run in the file
+	"""
+	if not exists(resultFile):
+		return {}
+
+	with open(resultFile) as f:
+		runs = list(map(json.loads, filter(lambda line: line.strip() != '', f)))
+
+	return {} if len(runs) == 0 else \
+		dict(map( lambda r: ((r['stage'], r['trades'], r['days']), r['seconds'])
+				, runs[-1]['results']))
+
+
+
+def getRevision():
+	try:
+		return subprocess.run( ['git', 'rev-parse', '--short', 'HEAD']
+							 , capture_output=True, text=True).stdout.strip()
+	except OSError:
+		return ''
+
+
+
+def runBenchmarks(sizes, days, resultFile, repeat=3):
+	"""
+	[List] sizes (number of trades), [Int] days, [String] resultFile
+	[Int] repeat
+		=> [List] results
+
+	Side effect: append this run to the result file (json lines), print the
+	results together with the change from the previous run.
+	"""
+	previous = loadPreviousResults(resultFile)
+
+	with TemporaryDirectory() as workDir:
+		startupTime, loaded = timeStartup(workDir, repeat)
+
+	if len(loaded) > 0:
+		print('warning: startup check loads {0}'.format(', '.join(loaded)))
+
+	results = [{'stage': 'startup', 'trades': 0, 'days': 0, 'seconds': startupTime}]
+	for n in sizes:
+		with TemporaryDirectory() as workDir:
+			results.extend(benchmarkSize(workDir, n, days, repeat))
+
+	with open(resultFile, 'a') as f:
+		f.write(json.dumps({ 'time': datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M:%S')
+						   , 'revision': getRevision()
+						   , 'results': results
+						   }) + '\n')
+
+	for r in results:
+		before = previous.get((r['stage'], r['trades'], r['days']))
+		print('{0:<18}{1:>8} trades {2:>10.4f}s {3}'.format(
+			r['stage'], r['trades'], r['seconds']
+		  , '' if before == None or before == 0 else '({0:+.0%})'.format(r['seconds'] / before - 1)))
+
+	return results
+
+
+
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Benchmark the CL trustee trade conversion')
+	parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000]
+					   , help='numbers of trades in the trade file')
+	parser.add_argument('--days', type=int, default=250
+					   , help='days of accumulate history')
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--output', type=str, default='benchmark_results.jsonl'
+					   , help='file to keep the results')
+
+	args = parser.parse_args()
+	runBenchmarks(args.sizes, args.days, args.output, args.repeat)
@@ -0,0 +1,149 @@
+# coding=utf-8
+
+"""
+Cache the date and positions parsed from a trade file, keyed by a hash of
+the file content, so that converting the same trade file again (e.g., a
+rerun after moving the file or sending the notification failed) does not
+parse the workbook again.
+
+A cache entry is a gzip file of pickled records: first (date, layout), then
+the line of each position. It is written as the positions stream through,
+so the positions are never held in memory as a whole, and only becomes
+visible once all positions have been read.
+
+Entries older than the maximum age are removed, then the oldest entries are
+removed until the cache fits in the maximum size. A cache hit counts as a
+use, so the least recently used entries go first.
+"""
+from tradefile_11490.trade import Position
+from tradefile_11490.utility import getCacheDirectory, getCacheMaxSize, getCacheMaxAge
+from functools import partial
+from os.path import join, exists
+import logging, hashlib, gzip, pickle, os, time
+logger = logging.getLogger(__name__)
+
+
+
+def getFileHash(file):
+	"""
+	[String] file => [String] sha256 of the file content
+	"""
+	h = hashlib.sha256()
+	with open(file, 'rb') as f:
+		for block in iter(partial(f.read, 1024*1024), b''):
+			h.update(block)
+
+	return h.hexdigest()
+
+
+
+getCacheFile = lambda key: join(getCacheDirectory(), key + '.pickle.gz')
+
+
+
+def loadEntry(key):
+	"""
+	[String] key => ( [String] date
+					, [Iterator] positions
+					), None if not in the cache
+	"""
+	file = getCacheFile(key)
+	if not exists(file):
+		return None
+
+	os.utime(file)	# mark as recently used
+	f = gzip.open(file, 'rb')
+	try:
+		date, layout = pickle.load(f)
+	except Exception:
+		f.close()
+		logger.warning('loadEntry(): bad cache entry {0}'.format(file))
+		os.remove(file)
+		return None
+
+
+	def positions():
+		with f:
+			while True:
+				try:
+					yield Position(layout, pickle.load(f))
+				except EOFError:
+					return
+
+	return (date, positions())
+
+
+
+def saveEntry(key, date, positions):
+	"""
+	[String] key, [String] date, [Iterable] positions => [Iterator] positions
+
+	Pass the positions through, writing them to a new cache entry on the way.
+	The entry is kept only if all positions are read.
+	"""
+	os.makedirs(getCacheDirectory(), exist_ok=True)
+	file = getCacheFile(key)
+	tempFile = file + '.{0}.tmp'.format(os.getpid())
+	complete = False
+	layout = None
+	try:
+		with gzip.open(tempFile, 'wb') as f:
+			for position in positions:
+				if layout == None:
+					layout = position.layout
+					pickle.dump((date, layout), f, pickle.HIGHEST_PROTOCOL)
+
+				pickle.dump(position.line, f, pickle.HIGHEST_PROTOCOL)
+				yield position
+
+			if layout == None:
+				pickle.dump((date, {}), f, pickle.HIGHEST_PROTOCOL)
+
+		complete = True
+		os.replace(tempFile, file)
+		evict()
+
+	finally:
+		if not complete and exists(tempFile):
+			os.remove(tempFile)
+
+
+
+def evict():
+	"""
+	Side effect: remove entries older than the maximum age, then the least
+	recently used entries until the cache fits in the maximum size.
+	"""
+	cacheDir = getCacheDirectory()
+	entries = sorted(map( lambda fn: (os.stat(join(cacheDir, fn)), join(cacheDir, fn))
+						, filter(lambda fn: fn.endswith('.pickle.gz'), os.listdir(cacheDir)))
+					, key=lambda t: t[0].st_mtime, reverse=True)
+
+	now, total = time.time(), 0
+	for stat, file in entries:
+		total = total + stat.st_size
+		if now - stat.st_mtime > getCacheMaxAge() or total > getCacheMaxSize():
+			logger.debug('evict(): {0}'.format(file))
+			os.remove(file)
+
+
+
+def cachedDatenPositions(readDatenPositions, file):
+	"""
+	[Function] readDatenPositions ([String] file => (date, positions))
+	[String] file
+		=> ( [String] date (yyyy-mm-dd)
+		   , [Iterator] positions
+		   )
+
+	Read date and positions from the cache if the same file content has been
+	parsed before, otherwise parse the file and cache the result.
+	"""
+	key = getFileHash(file)
+	entry = loadEntry(key)
+	if entry != None:
+		logger.debug('cachedDatenPositions(): cache hit {0}'.format(file))
+		return entry
+
+	date, positions = readDatenPositions(file)
+	return (date, saveEntry(key, date, positions))
@@ -0,0 +1,90 @@
+# coding=utf-8
+
+"""
+Intraday mode: the THRP report is downloaded several times a day while the
+traders keep booking, each download holding all trades of the day so far.
+
+The trades already added to the accumulate trade file of the day are those
+whose keys were added on the day in the portfolio's trade keys, the same
+keys used to skip duplicate trades (see tradekeys.py). The first download of
+the day is written as usual, a later download only appends the trades whose
+keys are new, so its cost is proportional to the new trades, not to the day
+or the history.
+"""
+from tradefile_11490.main import writeAccumulateTradeFile, getAccumulateLines \
+								, getAccumulateFileName, toAccumulateRow \
+								, getNearestAccumulateFileAndDate
+from tradefile_11490.tradekeys import checkedPositions, hasDayKeys
+from tradefile_11490.manifest import updateManifest
+from tradefile_11490.ledger import writeSegment
+from tradefile_11490.utility import getLedgerEnabled, getStoreEnabled, getDedupeEnabled
+from tradefile_11490 import metrics, store
+from os.path import exists, getsize
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def writeIntradayAccumulateFile(outputDir, portfolio, date, positions):
+	"""
+	[String] outputDir
+	[String] portfolio
+	[String] date (yyyy-mm-dd)
+	[Iterable] positions (all positions of the day so far)
+		=> [String] accumulate trade file
+
+	Intraday version of writeAccumulateTradeFile(): if the trades of the day
+	have been added before, only the new trades are appended to the
+	accumulate trade file of the day.
+	"""
+	outputFile = getAccumulateFileName(outputDir, portfolio, date)
+	if exists(outputFile) and hasDayKeys(outputDir, portfolio, date):
+		return appendAccumulateFile(outputDir, portfolio, date, outputFile, positions)
+	else:
+		return writeAccumulateTradeFile(outputDir, portfolio, date, positions)
+
+
+
+def appendAccumulateFile(outputDir, portfolio, date, outputFile, positions):
+	"""
+	[String] outputDir
+	[String] portfolio
+	[String] date (yyyy-mm-dd)
+	[String] outputFile (accumulate trade file of the date)
+	[Iterable] positions (all positions of the day so far)
+		=> [String] outputFile
+
+	Side effect: append the positions not added before to the accumulate
+	trade file of the day, and to the ledger segment and store of the day if
+	they are enabled.
+	"""
+	positions, commitTradeKeys = checkedPositions(
+		outputDir, portfolio, date, positions, toAccumulateRow
+	  , lambda: getNearestAccumulateFileAndDate(outputDir, portfolio, date)
+	  , append=True, skipDuplicates=getDedupeEnabled())
+	positions = list(positions)
+	logger.info('appendAccumulateFile(): {0} new trades for {1}'.format(len(positions), portfolio))
+
+	if len(positions) == 0:
+		commitTradeKeys()
+		return outputFile
+
+	lines = list(getAccumulateLines(positions))
+	baseSize = getsize(outputFile)
+	if getLedgerEnabled():
+		writeSegment(outputDir, portfolio, date, lines, append=True)
+
+	with open(outputFile, 'a') as f:
+		f.writelines(lines)
+
+	metrics.add('write accumulate', 'bytesWritten', getsize(outputFile) - baseSize)
+
+	if getStoreEnabled():
+		with open(outputFile, 'rb') as f:
+			f.seek(baseSize)
+			store.storeLines( portfolio, date, f.read().splitlines(keepends=True)
+							, list(map(lambda p: p['ISIN'], positions)), append=True)
+
+	commitTradeKeys()
+	updateManifest(outputDir, portfolio, date, outputFile, baseSize)
+	return outputFile
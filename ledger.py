@@ -0,0 +1,174 @@
+# coding=utf-8
+
+"""
+Keep the accumulated trade history of a portfolio as append-only segments,
+so that a daily run only writes the trades of the day instead of copying the
+whole history.
+
+The ledger of a portfolio lives in <outputDir>/ledger/<portfolio>, one
+segment per day, named yyyymmdd.csv. The first (base) segment is a copy of
+the accumulate trade file the ledger was seeded from, each of the others holds
+the rows added on that day. Therefore the accumulate trade file of a day is
+the concatenation of all segments up to and including that day.
+
+The dated accumulate trade files (Equities_*.csv) become views of the ledger:
+
+1) The latest view is rolled forward, i.e., renamed to the new date then
+	the new segment is appended, which costs nothing more than the day's
+	trades. So the view of the previous day is gone, unless views are kept
+	([ledger] keep=true in the config file), in which case each day's view is
+	written in full;
+2) Any other view can be materialized on demand by concatenating segments,
+	e.g., "python main.py 11490 --materialize 2021-07-08".
+"""
+from tradefile_11490.utility import reformatDate
+from toolz.functoolz import compose
+from functools import partial
+from os.path import join, exists, getsize
+import logging, os, shutil
+logger = logging.getLogger(__name__)
+
+
+
+getLedgerDirectory = lambda outputDir, portfolio: \
+	join(outputDir, 'ledger', portfolio)
+
+
+
+"""
+	[String] date (yyyy-mm-dd) => [String] segment file name (yyyymmdd.csv)
+"""
+toSegmentName = lambda date: \
+	reformatDate(date, '%Y%m%d', '%Y-%m-%d') + '.csv'
+
+
+
+"""
+	[String] fn (yyyymmdd.csv) => [String] date (yyyy-mm-dd)
+"""
+toSegmentDate = lambda fn: \
+	reformatDate(fn.split('.')[0], '%Y-%m-%d', '%Y%m%d')
+
+
+
+def getSegments(outputDir, portfolio):
+	"""
+	[String] outputDir, [String] portfolio
+		=> [List] ([String] date (yyyy-mm-dd), [String] file), sorted by date
+
+	Return all segments of the portfolio's ledger, empty if the ledger does
+	not exist yet.
+	"""
+	ledgerDir = getLedgerDirectory(outputDir, portfolio)
+	if not exists(ledgerDir):
+		return []
+
+	return compose(
+		sorted
+	  , partial(map, lambda fn: (toSegmentDate(fn), join(ledgerDir, fn)))
+	  , partial(filter, lambda fn: fn.endswith('.csv'))
+	  , os.listdir
+	)(ledgerDir)
+
+
+
+def seedLedger(outputDir, portfolio, file, date):
+	"""
+	[String] outputDir, [String] portfolio, [String] file, [String] date
+		=> [String] base segment file
+
+	Side effect: copy an existing accumulate trade file into the ledger as
+	its base segment. This is the only time the full history is copied.
+	"""
+	logger.info('seedLedger(): {0} from {1}'.format(portfolio, file))
+	ledgerDir = getLedgerDirectory(outputDir, portfolio)
+	os.makedirs(ledgerDir, exist_ok=True)
+	segment = join(ledgerDir, toSegmentName(date))
+	shutil.copyfile(file, segment)
+	return segment
+
+
+
+def writeSegment(outputDir, portfolio, date, lines, append=False):
+	"""
+	[String] outputDir, [String] portfolio, [String] date (yyyy-mm-dd)
+	[Iterable] lines (to be added on the day)
+	[Bool] append (add to the day's segment instead of replacing it)
+		=> [String] segment file
+
+	Side effect: write the day's segment. The file is opened in text mode,
+	the same way as the rows were appended to a copied accumulate trade file,
+	so the bytes written are identical.
+	"""
+	ledgerDir = getLedgerDirectory(outputDir, portfolio)
+	os.makedirs(ledgerDir, exist_ok=True)
+	segment = join(ledgerDir, toSegmentName(date))
+	with open(segment, 'a' if append else 'w') as f:
+		f.writelines(lines)
+
+	return segment
+
+
+
+def materializeAccumulateFile(outputDir, portfolio, date, outputFile):
+	"""
+	[String] outputDir, [String] portfolio, [String] date (yyyy-mm-dd)
+	[String] outputFile
+		=> [String] outputFile
+
+	Side effect: write the accumulate trade file of the date by concatenating
+	all segments up to and including that date.
+	"""
+	segments = list(filter(lambda t: t[0] <= date, getSegments(outputDir, portfolio)))
+	if len(segments) == 0:
+		lognRaise('materializeAccumulateFile(): no segment for {0} on or before {1}'.format(portfolio, date))
+
+	with open(outputFile, 'wb') as out:
+		for _, segment in segments:
+			with open(segment, 'rb') as f:
+				shutil.copyfileobj(f, out)
+
+	return outputFile
+
+
+
+def writeAccumulateView(outputDir, portfolio, date, outputFile, previousFile, keep=False):
+	"""
+	[String] outputDir, [String] portfolio, [String] date (yyyy-mm-dd)
+	[String] outputFile (accumulate trade file of the date)
+	[String] previousFile (the latest accumulate trade file before the date,
+		None if not known)
+	[Bool] keep (keep the previous accumulate trade file)
+		=> [String] outputFile
+
+	Side effect: write the accumulate trade file of the date, assuming the
+	segment of the date has been written.
+
+	If the previous accumulate trade file holds exactly the segments before
+	the date and need not be kept, it is renamed to the output file and the
+	day's segment is appended to it. Otherwise the view is materialized from
+	the segments.
+	"""
+	segments = getSegments(outputDir, portfolio)
+	before = list(filter(lambda t: t[0] < date, segments))
+	current = list(filter(lambda t: t[0] == date, segments))
+
+	if not keep and previousFile != None and previousFile != outputFile and exists(previousFile) \
+		and len(before) > 0 and len(current) == 1 \
+		and getsize(previousFile) == sum(map(lambda t: getsize(t[1]), before)):
+
+		logger.debug('writeAccumulateView(): roll forward {0}'.format(previousFile))
+		os.replace(previousFile, outputFile)
+		with open(outputFile, 'ab') as out, open(current[0][1], 'rb') as f:
+			shutil.copyfileobj(f, out)
+
+		return outputFile
+
+	logger.debug('writeAccumulateView(): materialize {0}'.format(outputFile))
+	return materializeAccumulateFile(outputDir, portfolio, date, outputFile)
+
+
+
+def lognRaise(msg):
+	logger.error(msg)
+	raise ValueError
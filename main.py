@@ -14,19 +14,38 @@ Check the 'samples' directory for samples of the input and two output files.
 3) Settlement's own records: Equities_15052020.xlsx
 """
 
-from tradefile_11490.trade import getDatenPositions
-from tradefile_11490.utility import getDataDirectory, getMailSender, getMailServer \
-									, getMailRecipients, getMailTimeout
-from clamc_datafeed.feeder import fileToLines, mergeDictionary
+if __name__ == '__main__':
+	# most scheduled runs have nothing to do, find out before loading the rest
+	from tradefile_11490.startup import exitIfNoInput
+	exitIfNoInput()
+
+from tradefile_11490.startup import getPortfolioFromTradeFile
+from tradefile_11490.registry import getPortfolios, getSettings, getPortfolioFromFund
+from tradefile_11490.trade import getDatenPositions, numberColumns, sourceColumns
+from tradefile_11490.reader import streamLines
+from tradefile_11490.cache import cachedDatenPositions
+from tradefile_11490.utility import getDataDirectory, getLedgerEnabled, getCacheEnabled \
+									, getStoreEnabled, getIntradayEnabled, getDedupeEnabled \
+									, getValidationEnabled, getLedgerKeep \
+									, getWatchMode, getWatchSettleTime, getWatchInterval \
+									, fanOut, excelOrdinalToString, reformatDate
+from tradefile_11490.manifest import getNearestAccumulateEntry, updateManifest \
+									, getDateFromFilename, buildManifest
+from tradefile_11490.notifier import notify
+from tradefile_11490.tradekeys import checkedPositions
+from tradefile_11490.validation import validatePositions
+from tradefile_11490 import metrics, store
+from tradefile_11490.ledger import getSegments, seedLedger, writeSegment \
+									, writeAccumulateView, materializeAccumulateFile
 from utils.iter import pop
 from utils.file import getFiles
-from utils.utility import fromExcelOrdinal, writeCsv
-from utils.mail import sendMail
+from utils.utility import writeCsv
 from toolz.functoolz import compose
+from toolz.itertoolz import groupby
 from functools import partial
 from itertools import chain, count, takewhile
 from datetime import datetime
-from os.path import join, dirname, abspath
+from os.path import join, dirname, abspath, basename, getsize
 import logging, csv, shutil, sys
 logger = logging.getLogger(__name__)
 
@@ -37,15 +56,31 @@ logger = logging.getLogger(__name__)
 					 , [Iterator] positions
 					 )
 
-	Read a 11490 trade file, get its date and positions
+	Parse a 11490 trade file, get its date and positions. The positions are
+	read lazily from the file.
 """
-readDatenPositions = compose(
+parseDatenPositions = compose(
 	getDatenPositions
-  , fileToLines
+  , partial(streamLines, numberColumns=numberColumns, columns=sourceColumns)
 )
 
 
 
+def readDatenPositions(file):
+	"""
+	[String] file => ( [String] date (yyyy-mm-dd)
+					 , [Iterator] positions
+					 )
+
+	Read a 11490 trade file, get its date and positions. If the cache is
+	enabled, a trade file with the same content as one parsed before is not
+	parsed again.
+	"""
+	return cachedDatenPositions(parseDatenPositions, file) \
+			if getCacheEnabled() else parseDatenPositions(file)
+
+
+
 def writeTradenAccumulateFiles(inputFile, portfolio, dataDirectory):
 	"""
 	[String] inputFile (AIM trade file)
@@ -61,14 +96,65 @@ def writeTradenAccumulateFiles(inputFile, portfolio, dataDirectory):
 	"""
 	logger.debug('writeTradenAccumulateFiles(): {0}'.format(inputFile))
 
-	return \
-	compose(
-		lambda t: ( writeTrusteeTradeFile(dataDirectory, portfolio, t[0], t[1])
-				  , writeAccumulateTradeFile(dataDirectory, portfolio, t[0], t[1])
-				  )
-	  , lambda t: (t[0], list(t[1]))
-	  , readDatenPositions
-	)(join(dataDirectory, inputFile))
+	file = join(dataDirectory, inputFile)
+	with metrics.stage('read'):
+		date, positions = readDatenPositions(file)
+
+	metrics.add('read', 'bytesRead', getsize(file))
+
+	return writePortfolioFiles(
+		dataDirectory
+	  , portfolio
+	  , ( date
+	  	, filter( lambda p: getPortfolioFromFund(p['Fund']) == portfolio
+	  			, metrics.timedIterator('read', positions))
+	  	)
+	)
+
+
+
+def writePortfolioFiles(outputDir, portfolio, datenPositions):
+	"""
+	[String] outputDir
+	[String] portfolio
+	( [String] date (yyyy-mm-dd)
+	, [Iterable] positions (of the portfolio)
+	)
+		=> ( [String] output trade file
+		   , [String] accumulate trade file
+		   )
+
+	Write the trustee trade file and the accumulate trade file of a portfolio.
+	The positions are consumed once as a stream and fed to both writers at
+	the same time, so memory stays bounded however large the trade file is.
+
+	In intraday mode, only trades not added before on the same day go to the
+	accumulate trade file (see intraday.py).
+
+	If validation is enabled, all positions are checked before anything is
+	written (see validation.py), so they are read into memory first.
+	"""
+	date, positions = datenPositions
+
+	if getValidationEnabled():
+		positions = validatePositions(outputDir, portfolio, date, positions)
+
+	if getIntradayEnabled():
+		from tradefile_11490.intraday import writeIntradayAccumulateFile
+		accumulateWriter = writeIntradayAccumulateFile
+	else:
+		accumulateWriter = writeAccumulateTradeFile
+
+	# [String] stageName, [Function] writer => [Function] consumer of positions
+	toConsumer = lambda stageName, writer: compose(
+		metrics.timedFunction(stageName, partial(writer, outputDir, portfolio, date))
+	  , partial(metrics.countedIterator, stageName)
+	)
+
+	return fanOut( positions
+				 , toConsumer('write trustee', writeTrusteeTradeFile)
+				 , toConsumer('write accumulate', accumulateWriter)
+				 )
 
 
 
@@ -77,57 +163,50 @@ def writeTrusteeTradeFile(outputDir, portfolio, date, positions):
 	[String] outputDir (the directory to write the csv file)
 	[String] portfolio
 	[String] date (yyyy-mm-dd)
-	[Iterator] positions (the positions from the trade file) 
+	[Iterable] positions (the portfolio's positions from the trade file) 
 		=> [String] csv file
 
 	From the date and positions of the Bloomberg AIM trade file, write the CL 
 	trustee trade file.
 	"""
-	updatePosition = lambda p: \
-		mergeDictionary(p, {'Broker Long Name': p['FACC Long Name']})
-
 	headers = [ 'Fund', 'Ticker & Exc', 'ISIN',	'Shrt Name', 'B/S',	'Yield'
 			  ,	'As of Dt',	'Stl Date',	'Amount Pennies', 'Price', 'Bkr Comm'
 			  ,	'Stamp Duty', 'Exch Fee', 'Trans. Levy', 'Misc Fee', 'Crcy'
 			  ,	'Broker Long Name',	'Accr Int', 'Settle Amount', 'L1 Tag Nm'
 			  ]
 
-	positionToValues = lambda position: map(lambda key: position[key], headers)
+	positionToValues = metrics.timedFunction(
+		'transform'
+	  , lambda position: list(map(lambda key: position[key], headers))
+	  , True
+	)
 
 
 	def getOutputFileName(portfolio, date, outputDir):
-		prefix = 'Order Record of A-HK Equity ' if portfolio == '11490' \
-					else 'Order Record of A-HK Equity_BOC ' if portfolio == '11500' \
-					else 'Order Record of A-MC-P Equity' # 13006
-		
 		return join( outputDir
-				   , prefix	+ datetime.strftime(datetime.strptime(date, '%Y-%m-%d'), '%y%m%d') + '.csv'
+				   , getSettings(portfolio)['trusteePrefix'] \
+				   		+ reformatDate(date, '%y%m%d', '%Y-%m-%d') + '.csv'
 				   )
 
 
 	getOutputRows = lambda portfolio, date, positions: \
-		chain( [ ['China Life Franklin - CLT-CLI HK BR (CLASS A-HK) TRUST FUND' \
-					if portfolio == '11490' else \
-					'China Life Franklin - CLT-CLI HK BR (CLASS A-HK) TRUST FUND_BOC' \
-					if portfolio == '11500' else \
-					'CLT-CLI Macau BR (Class A-MC) Trust Fund-Par' #13006
-				 ]
+		chain( [ [getSettings(portfolio)['trusteeTitle']]
 			   , ['{0} Equity FOR {0} ON '.format(portfolio) \
-			   		+ datetime.strftime(datetime.strptime(date, '%Y-%m-%d'), '%m/%d/%y')
+			   		+ reformatDate(date, '%m/%d/%y', '%Y-%m-%d')
 			   	 ]
 			   , ['']	# an empty row
 			   , headers
 			   ]
-			 , map( positionToValues
-			 	  , map( updatePosition
-			 	  	   , filter(lambda p: p['Fund'].startswith(portfolio), positions)))
+			 , map(positionToValues, positions)
 			 )
 
 
-	return writeCsv( getOutputFileName(portfolio, date, outputDir)
-				   , getOutputRows(portfolio, date, positions)
-				   , delimiter=','
-				   )
+	outputFile = writeCsv( getOutputFileName(portfolio, date, outputDir)
+						 , getOutputRows(portfolio, date, positions)
+						 , delimiter=','
+						 )
+	metrics.add('write trustee', 'bytesWritten', getsize(getOutputFileName(portfolio, date, outputDir)))
+	return outputFile
 
 
 
@@ -136,7 +215,7 @@ def writeAccumulateTradeFile(outputDir, portfolio, date, positions):
 	[String] outputDir (the directory to write the csv file)
 	[String] portfolio
 	[String] date (yyyy-mm-dd)
-	[Iterator] positions (the positions from the trade file) 
+	[Iterable] positions (the portfolio's positions from the trade file) 
 		=> [String] csv file
 
 	From the date and positions of the Bloomberg AIM trade file, write the
@@ -145,51 +224,128 @@ def writeAccumulateTradeFile(outputDir, portfolio, date, positions):
 	Here we assume that accumulated trade files of previous days are also located
 	on the outputDir.
 	"""
-	prefix = 'Equities_' if portfolio == '11490' \
-				else 'Equities_BOC_' if portfolio == '11500' \
-				else 'Equities_A-MC-P_' # 13006
+	outputFile = getAccumulateFileName(outputDir, portfolio, date)
 
-	outputFile = join( outputDir
-					 , prefix + datetime.strftime(datetime.strptime(date, '%Y-%m-%d'), '%d%m%Y') + '.csv'
-					 )
+	commitTradeKeys = lambda: None
+	if getDedupeEnabled() or getIntradayEnabled():	# intraday mode needs the day's keys
+		positions, commitTradeKeys = checkedPositions(
+			outputDir, portfolio, date, positions, toAccumulateRow
+		  , lambda: getNearestAccumulateFileAndDate(outputDir, portfolio, date)
+		  , skipDuplicates=getDedupeEnabled())
 
-	shutil.copyfile( getNearestAccumulateFile(outputDir, portfolio, date)
-				   , outputFile
-				   )
+	if getStoreEnabled():
+		# the history date is needed before writing, because in ledger mode
+		# the previous accumulate trade file may be renamed to this one.
+		baseDate = None if store.hasPortfolio(portfolio) else \
+					getNearestAccumulateFileAndDate(outputDir, portfolio, date)[1]
+		isins = []
+		positions = map(lambda p: isins.append(p['ISIN']) or p, positions)
 
 
-	toNewPostion = lambda position: mergeDictionary( 
-		position
-	  , { 'FundName': 'CLT-CLI HK BR (CLASS A-HK) Trust Fund' if position['Fund'].startswith('11490') \
-	  					else 'CLT-CLI HK BR (CLASS A-HK) Trust Fund_BOC' if position['Fund'].startswith('11500') \
-	  					else 'CLT-CLI Macau BR (Class A-MC) Trust Fund-Par' if position['Fund'].startswith('13006') \
-	  					else lognRaise('toNewPostion(): invalid fund name {0}'.format(position['Fund']))
-		, '': ''
-		, 'BuySell': 'Buy' if position['B/S'] == 'B' else 'Sell'
-		}
-	)
+	if getLedgerEnabled():
+		baseSize = writeLedgerAccumulateFile( outputDir, portfolio, date, outputFile
+											, getAccumulateLines(positions))
 
+		metrics.add('write accumulate', 'bytesWritten', getsize(outputFile) - baseSize)
 
-	headers = [ 'FundName', '', 'Ticker & Exc', 'Shrt Name', 'Amount Pennies'
-			  , 'BuySell', 'FACC Long Name', 'As of Dt', 'Stl Date', 'Price']
+	else:
+		shutil.copyfile( getNearestAccumulateFile(outputDir, portfolio, date)
+					   , outputFile
+					   )
+		baseSize = getsize(outputFile)
 
-	positionToValues = lambda position: map(lambda key: position[key], headers)
+		with open(outputFile, 'a') as newFile:
+			newFile.writelines(getAccumulateLines(positions))
 
+		metrics.add('write accumulate', 'bytesRead', baseSize)
+		metrics.add('write accumulate', 'bytesWritten', getsize(outputFile))
 
-	# [Iterator] positions => [String] output string to be written to the file
-	toOutputString = compose(
-		lambda rows: '\n'.join(rows) + '\n'
-	  , partial(map, lambda values: ','.join(values))
-	  , partial(map, lambda values: map(str, values))
-	  , partial(map, positionToValues)
-	  , partial(map, toNewPostion)
-	  , partial(filter, lambda p: p['Fund'].startswith(portfolio))
-	)
+	if getStoreEnabled():
+		store.storeAccumulateFile(portfolio, date, outputFile, baseSize, baseDate, isins)
+
+	commitTradeKeys()
+	updateManifest(outputDir, portfolio, date, outputFile, baseSize)
+	return outputFile
+
+
+
+accumulateHeaders = [ 'FundName', '', 'Ticker & Exc', 'Shrt Name', 'Amount Pennies'
+					, 'BuySell', 'FACC Long Name', 'As of Dt', 'Stl Date', 'Price']
+
+
+
+"""
+	[Position] position => [String] row of the accumulate trade file (without
+		the line break)
+"""
+toAccumulateRow = lambda position: \
+	','.join(map(lambda key: str(position[key]), accumulateHeaders))
+
+
+
+def getAccumulateLines(positions):
+	"""
+	[Iterable] positions => [Iterator] lines to be added to the accumulate
+		trade file
+
+	Same as '\n'.join(rows) + '\n', i.e., an empty line if there are no
+	positions, but produced one line at a time.
+	"""
+	empty = True
+	for row in map(metrics.timedFunction('transform', toAccumulateRow, True), positions):
+		empty = False
+		yield row + '\n'
+
+	if empty:
+		yield '\n'
+
+
+
+def writeLedgerAccumulateFile(outputDir, portfolio, date, outputFile, lines):
+	"""
+	[String] outputDir
+	[String] portfolio
+	[String] date (yyyy-mm-dd)
+	[String] outputFile (accumulate trade file of the date)
+	[Iterable] lines (to be added on the day)
+		=> [Int] size of the history (bytes) before the day's rows in outputFile
+
+	Ledger mode version of writing the accumulate trade file: only the day's
+	rows are written as a new segment, then the accumulate trade file is
+	produced as a view of the ledger. The output is byte identical to copying
+	the previous accumulate trade file and appending the rows.
+
+	The first run in ledger mode seeds the ledger from the nearest accumulate
+	trade file in the output directory.
+	"""
+	if len(getSegments(outputDir, portfolio)) == 0:
+		nearestFile = getNearestAccumulateFile(outputDir, portfolio, date)
+		seedLedger( outputDir, portfolio, nearestFile
+				  , getDateFromFilename(basename(nearestFile)))
 
+	previousDates = list(filter( lambda d: d < date
+							   , map(lambda t: t[0], getSegments(outputDir, portfolio))))
 
-	with open(outputFile, 'a') as newFile:
-		newFile.write(toOutputString(positions))
-		return 0
+	segment = writeSegment(outputDir, portfolio, date, lines)
+	writeAccumulateView( outputDir, portfolio, date, outputFile
+					   , getAccumulateFileName(outputDir, portfolio, previousDates[-1]) \
+					   		if len(previousDates) > 0 else None
+					   , getLedgerKeep()
+					   )
+
+	return getsize(outputFile) - getsize(segment)
+
+
+
+def getAccumulateFileName(outputDir, portfolio, date):
+	"""
+	[String] outputDir, [String] portfolio, [String] date (yyyy-mm-dd)
+		=> [String] accumulate trade file of the date, with full path
+	"""
+	return join( outputDir
+			   , getSettings(portfolio)['accumulatePrefix'] \
+			   		+ reformatDate(date, '%d%m%Y', '%Y-%m-%d') + '.csv'
+			   )
 
 
 
@@ -200,39 +356,36 @@ def getNearestAccumulateFile(outputDir, portfolio, date):
 	[String] date (yyyy-mm-dd)
 		=> [String] file
 
-	Search for all files in the output dir, then:
+	Find the accumulate trade file of the portfolio with the latest date
+	before the date, return the file name with full path.
 
-	1) Find all the accumulate trade files for the portfolio; 
-	2) Find those whose date is less than the date;
-	3) Find the file with the latest date.
-	4) Return the file name with full path.
+	The lookup is a bisect on the portfolio's manifest (see manifest.py)
+	instead of a scan of the output directory. The manifest is rebuilt from
+	the directory if it is missing or out of sync.
 	"""
 	logger.debug('getNearestAccumulateFile(): start')
 
-	# [String] fn => [String] date (yyyy-mm-dd)
-	getDateFromFilename = compose(
-		lambda s: datetime.strftime(datetime.strptime(s, '%d%m%Y'), '%Y-%m-%d')
-	  , lambda s: s.split('_')[-1].strip()
-	  , lambda fn: fn.split('.')[0]
-	)
-
-	isAccumulateTradeFile = lambda fn: \
-		fn.startswith('Equities_BOC_') if portfolio == '11500' \
-		else fn.startswith('Equities_') and not fn.startswith('Equities_BOC_') if portfolio == '11490' \
-		else fn.startswith('Equities_A-MC-P_') # 13006
-
-	fileOfLatestDate = lambda filesWithDate: max(filesWithDate, key=lambda t: t[0])[1]
-
-
 	return compose(
 		lambda fn: join(outputDir, fn)
 	  , lambda fn: lognContinue('getNearestAccumulateFile(): {0}'.format(fn), fn)
-	  , fileOfLatestDate
-	  , partial(filter, lambda t: t[0] < date)
-	  , partial(map, lambda fn: (getDateFromFilename(fn), fn))
-	  , partial(filter, isAccumulateTradeFile)
-	  , lambda outputDir, _: getFiles(outputDir)
-	)(outputDir, date)
+	  , lambda entry: lognRaise('getNearestAccumulateFile(): no accumulate file for {0} before {1}'.format(portfolio, date)) \
+	  					if entry == None else entry[1]
+	  , getNearestAccumulateEntry
+	)(outputDir, portfolio, date)
+
+
+
+"""
+	[String] outputDir, [String] portfolio, [String] date (yyyy-mm-dd)
+		=> ( [String] nearest accumulate trade file before the date
+		   , [String] its date (yyyy-mm-dd)
+		   )
+"""
+getNearestAccumulateFileAndDate = lambda outputDir, portfolio, date: \
+compose(
+	lambda file: (file, getDateFromFilename(basename(file)))
+  , getNearestAccumulateFile
+)(outputDir, portfolio, date)
 
 
 
@@ -249,73 +402,154 @@ def convertAccumulateExcelToCSV(file):
 
 	This is an utility function that needs to run only once, to convert the 
 	excel version accmulate trade file into csv format. After that, we just
-	need to add daily trades to that csv file.
-	"""
-	getOutputFileName = lambda fn: \
-		fn[0:-4] + 'csv' if fn.endswith('.xlsx') else \
-		fn[0:-3] + 'csv' if fn.endswith('.xls') else \
-		lognRaise('convertAccumulateExcelToCSV(): invalid input file {0}'.format(fn))
-	
-
-	"""
-		[List] line => [List] headers
-		Note the second header is an empty string, but we need to keep it. All
-		other empty strings in the list are ignored
+	need to add daily trades to that csv file. To convert a whole directory
+	of them, see migrate.py.
 	"""
-	getHeaders = compose(
-		list
-	  , partial(map, lambda t: t[1])
-	  , partial(takewhile, lambda t: t[0] < 2 or t[1] != '')
-	  , lambda line: zip(count(), line)
-	)
-
-
-	def toDatetimeString(value):
-		if isinstance(value, float):
-			return datetime.strftime(fromExcelOrdinal(value), '%Y-%m-%d')
-		else:
-			try:
-				return datetime.strftime(datetime.strptime(value, '%m/%d/%Y'), '%Y-%m-%d')
-			except ValueError:
-				return datetime.strftime(datetime.strptime(value, '%d/%m/%Y'), '%Y-%m-%d')
-
-
-	getLineItems = lambda headers, line: compose(
-		partial( map
-			   , lambda t: toDatetimeString(t[1]) \
-			   		if t[0] in ['Trade Date', 'Settlement Date'] else t[1]
-			   )
-	  , lambda headers, line: zip(headers, line)
-	)(headers, line)
-
-
 	return compose(
-		lambda rows: writeCsv( getOutputFileName(file)
+		lambda rows: writeCsv( getAccumulateCsvFileName(file)
 							 , rows
 							 , delimiter=','
 							 )
 	  , lambda t: chain( [t[0]]
-	  				   , map(partial(getLineItems, t[0]), t[1])
+	  				   , map(partial(getAccumulateLineItems, t[0]), t[1])
 	  				   )
-	  , lambda lines: (getHeaders(pop(lines)), lines)
-	  , fileToLines
+	  , lambda lines: (getAccumulateExcelHeaders(pop(lines)), lines)
+	  , streamLines
 	)(file)
 
 
 
+"""
+	[String] fn (accumulate trade excel file) => [String] csv file name
+"""
+getAccumulateCsvFileName = lambda fn: \
+	fn[0:-4] + 'csv' if fn.endswith('.xlsx') else \
+	fn[0:-3] + 'csv' if fn.endswith('.xls') else \
+	lognRaise('convertAccumulateExcelToCSV(): invalid input file {0}'.format(fn))
+
+
+
+"""
+	[List] line => [List] headers
+	Note the second header is an empty string, but we need to keep it. All
+	other empty strings in the list are ignored
+"""
+getAccumulateExcelHeaders = compose(
+	list
+  , partial(map, lambda t: t[1])
+  , partial(takewhile, lambda t: t[0] < 2 or t[1] != '')
+  , lambda line: zip(count(), line)
+)
+
+
+
+accumulateDateHeaders = ['Trade Date', 'Settlement Date']
+
+
+
+"""
+	[Float or String] value (Excel ordinal, or date string in one of the
+		formats of the old accumulate trade files)
+		=> [String] date (yyyy-mm-dd)
+"""
+toAccumulateDateString = lambda value: \
+	excelOrdinalToString(value) if isinstance(value, float) else \
+	reformatDate(value, '%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y')
+
+
+
+"""
+	[List] headers, [List] line => [Iterator] items of the line in the csv
+		file, with the dates as yyyy-mm-dd
+"""
+getAccumulateLineItems = lambda headers, line: compose(
+	partial( map
+		   , lambda t: toAccumulateDateString(t[1]) \
+		   		if t[0] in accumulateDateHeaders else t[1]
+		   )
+  , lambda headers, line: zip(headers, line)
+)(headers, line)
+
+
+
 """
 	[String] inputDir, [String] portfolio 
 		=> [String] trade files for the portfolio
 """
 getTradeFilesFromDirectory = lambda inputDir, portfolio: \
+	getAllTradeFilesFromDirectory(inputDir).get(portfolio, [])
+
+
+
+"""
+	[String] inputDir => [Dictionary] portfolio => [List] trade files
+
+	List the input directory once and find the trade files of all portfolios.
+"""
+getAllTradeFilesFromDirectory = lambda inputDir: \
 compose(
-	list
-  , partial(filter, lambda fn: fn in [portfolio+'_1.xls', portfolio+'_1.xlsx'])
+	partial(groupby, getPortfolioFromTradeFile)
+  , partial(filter, lambda fn: getPortfolioFromTradeFile(fn) != None)
   , getFiles
 )(inputDir)
 
 
 
+def runConversion(inputFile, portfolio, dataDirectory):
+	"""
+	[String] inputFile, [String] portfolio, [String] dataDirectory
+		=> [Bool] whether the conversion is successful
+
+	Convert one trade file, move it to the 'processed files' folder and send
+	notification of the result. Metrics of each stage are recorded if enabled.
+	"""
+	metrics.startRun(portfolio)
+	try:
+		writeTradenAccumulateFiles(inputFile, portfolio, dataDirectory)
+		with metrics.stage('move'):
+			moveTradeFile(inputFile, dataDirectory)
+		with metrics.stage('notify'):
+			sendNotification('Successfully performed CL trustee {0} trade conversion'.format(portfolio))
+
+		metrics.endRun(True)
+		return True
+
+	except:
+		logger.exception('runConversion(): {0}'.format(portfolio))
+		with metrics.stage('notify'):
+			sendNotification('Error occurred in performing CL trustee {0} trade conversion'.format(portfolio))
+
+		metrics.endRun(False)
+		return False
+
+
+
+def runAllConversions(dataDirectory):
+	"""
+	[String] dataDirectory => [Dictionary] portfolio => [Bool] result
+
+	Convert the trade files of all portfolios in one go. The input directory
+	is listed once, each trade file is parsed once, and the result of each
+	portfolio is reported separately. A portfolio without a trade file is
+	skipped, a portfolio with more than one trade file fails.
+	"""
+	allFiles = getAllTradeFilesFromDirectory(dataDirectory)
+
+	def runPortfolio(portfolio):
+		files = allFiles.get(portfolio, [])
+		if len(files) > 1:
+			logger.error('{0} files found for {1}'.format(len(files), portfolio))
+			sendNotification('Error occurred in performing CL trustee {0} trade conversion'.format(portfolio))
+			return False
+
+		return runConversion(files[0], portfolio, dataDirectory)
+
+
+	return dict(map( lambda p: (p, runPortfolio(p))
+				   , filter(lambda p: p in allFiles, getPortfolios())))
+
+
+
 def moveTradeFile(file, inputDir):
 	"""
 	[String] file, [String] inputDir 
@@ -349,11 +583,11 @@ def sendNotification(subject):
 	input: [String] result (file name)
 	
 	side effect: send notification email to recipients about the results.
+	The email is queued and sent in the background (see notifier.py), so
+	this function returns at once.
 	"""
 	try:
-		sendMail( '', subject, getMailSender(), getMailRecipients()
-				, getMailServer(), getMailTimeout()
-				)
+		notify(subject)
 
 	except:
 		logger.exception('sendNotification()')
@@ -379,8 +613,26 @@ if __name__ == '__main__':
 
 	import argparse
 	parser = argparse.ArgumentParser(description='Process CL Trustee THRP File')
-	parser.add_argument( 'portfolio', metavar='portfolio', type=str
+	parser.add_argument( 'portfolio', metavar='portfolio', type=str, nargs='?'
 					   , help='for which portfolio')
+	parser.add_argument( '--all', action='store_true'
+					   , help='convert trade files of all portfolios')
+	parser.add_argument( '--async', dest='overlap', action='store_true'
+					   , help='with --all, convert the portfolios at the same time')
+	parser.add_argument( '--watch', action='store_true'
+					   , help='keep running, convert trade files as they arrive')
+	parser.add_argument( '--backfill', metavar='file', type=str, nargs='+'
+					   , help='convert many trade files of the portfolio, in date order')
+	parser.add_argument( '--serve', action='store_true'
+					   , help='keep running, convert trade files submitted to the local service')
+	parser.add_argument( '--export', metavar='date', type=str
+					   , help='write the accumulate trade file of the date (yyyy-mm-dd) from the store')
+	parser.add_argument( '--materialize', metavar='date', type=str
+					   , help='write the accumulate trade file of the date (yyyy-mm-dd) from the ledger')
+	parser.add_argument( '--rebuild-manifest', action='store_true'
+					   , help='rebuild the manifest of accumulate trade files from the directory')
+	parser.add_argument( '--profile', action='store_true'
+					   , help='profile time and memory of the conversion (see profiler.py)')
 
 	"""
 		Convert a trade file, do
@@ -390,16 +642,122 @@ if __name__ == '__main__':
 		E.g., convert 11490 trade file, do
 
 		$python main.py 11490
+
+		Convert trade files of all portfolios (11490, 11500, 13006), do
+
+		$python main.py --all
+
+		Or, with the portfolios converted at the same time (see pipeline.py)
+
+		$python main.py --all --async
+
+		Keep running and convert trade files of all portfolios as soon as
+		they arrive, do
+
+		$python main.py --watch
+
+		Convert trade files of several days of a portfolio, e.g., after a
+		holiday, do
+
+		$python main.py 11490 --backfill <trade file> <trade file> ...
+
+		Keep running as a service, converting trade files submitted to it
+		(see service.py), do
+
+		$python main.py --serve
+
+		Write the accumulate trade file of a day from the store again, do
+
+		$python main.py 11490 --export 2021-07-09
+
+		In ledger mode, write the accumulate trade file of an earlier day
+		again from the ledger, do
+
+		$python main.py 11490 --materialize 2021-07-08
+
+		Rebuild the manifest of a portfolio's accumulate trade files (see
+		manifest.py), e.g., after adding one by hand, do
+
+		$python main.py 11490 --rebuild-manifest
+
+		Profile the conversion of a trade file (or of --all, --backfill), the
+		profiles go to the profiles directory (see profiler.py), do
+
+		$python main.py 11490 --profile
 	"""
-	portfolio = parser.parse_args().portfolio
-	files = getTradeFilesFromDirectory(getDataDirectory(), portfolio)
+	args = parser.parse_args()
 
 	import sys
-	if not portfolio in ('11490', '11500', '13006'):
+	from tradefile_11490.profiler import profiled
+	profile = True if args.profile else None	# None: as in the config file
+
+	if args.watch:
+		from tradefile_11490.watcher import watch
+		watch( getDataDirectory(), getPortfolioFromTradeFile
+			 , lambda fn, portfolio: runConversion(fn, portfolio, getDataDirectory())
+			 , getWatchSettleTime(), getWatchInterval(), getWatchMode()
+			 )
+
+	if args.serve:
+		from tradefile_11490.service import serve
+		serve()
+		sys.exit(0)
+
+	if args.all:
+		with profiled('all', profile):
+			if args.overlap:
+				from tradefile_11490.pipeline import runAllConversionsAsync
+				results = runAllConversionsAsync(getDataDirectory())
+			else:
+				results = runAllConversions(getDataDirectory())
+
+		if len(results) == 0:
+			logger.debug('no input file found')
+
+		sys.exit(0 if all(results.values()) else 1)
+
+
+	portfolio = args.portfolio
+	if not portfolio in getPortfolios():
 		logger.error('invalid portfolio code: {0}'.format(portfolio))
 		sys.exit(1)
 
-	elif len(files) == 0:
+	if args.export != None:
+		try:
+			print(store.exportAccumulateFile( portfolio, args.export
+											, getAccumulateFileName(getDataDirectory(), portfolio, args.export)))
+			sys.exit(0)
+		except ValueError:
+			sys.exit(1)		# already logged, the existing file is untouched
+
+	if args.rebuild_manifest:
+		print(len(buildManifest(getDataDirectory(), portfolio)))
+		sys.exit(0)
+
+	if args.materialize != None:
+		print(materializeAccumulateFile( getDataDirectory(), portfolio, args.materialize
+									   , getAccumulateFileName(getDataDirectory(), portfolio, args.materialize)))
+		sys.exit(0)
+
+	if args.backfill != None:
+		from tradefile_11490.backfill import backfill
+		try:
+			with profiled(portfolio + '_backfill', profile):
+				results = backfill(args.backfill, portfolio, getDataDirectory())
+			sendNotification('Successfully performed CL trustee {0} trade backfill, {1} days'.format(portfolio, len(results)))
+			sys.exit(0)
+
+		except SystemExit:
+			raise
+
+		except:
+			logger.exception('backfill')
+			sendNotification('Error occurred in performing CL trustee {0} trade backfill'.format(portfolio))
+			sys.exit(1)
+
+
+	files = getTradeFilesFromDirectory(getDataDirectory(), portfolio)
+	if len(files) == 0:
 		logger.debug('no input file found for {0}'.format(portfolio))
 		sys.exit(0)
 
@@ -411,11 +769,5 @@ if __name__ == '__main__':
 		inputFile = files[0]
 
 
-	try:
-		writeTradenAccumulateFiles(inputFile, portfolio, getDataDirectory())
-		moveTradeFile(inputFile, getDataDirectory())
-		sendNotification('Successfully performed CL trustee {0} trade conversion'.format(portfolio))
-
-	except:
-		logger.exception('__main__')
-		sendNotification('Error occurred in performing CL trustee {0} trade conversion'.format(portfolio))
\ No newline at end of file
+	with profiled(portfolio, profile):
+		runConversion(inputFile, portfolio, getDataDirectory())
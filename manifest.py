@@ -0,0 +1,280 @@
+# coding=utf-8
+
+"""
+A small manifest of the accumulate trade files in the output directory, so
+that finding the nearest accumulate trade file does not need to list and
+parse the whole directory.
+
+The manifest of a portfolio is stored as <outputDir>/manifest/<portfolio>.csv,
+one line per accumulate trade file:
+
+	date (yyyy-mm-dd), filename, rows, size (bytes), checksum (crc32)
+
+sorted by date. It is updated whenever an accumulate trade file is written,
+and rebuilt from a directory scan when it is missing, or when a lookup finds
+it out of sync: the entry found or the one after it no longer matches its
+file, or an accumulate trade file has been added for a day between the entry
+found and the date looked up (e.g., copied in by hand). Only those files are
+checked, so a normal run never lists the directory.
+
+A file added under a name other than the program's own is not noticed that
+way, to pick it up, rebuild the manifest:
+
+	$python main.py 11490 --rebuild-manifest
+"""
+from tradefile_11490.utility import reformatDate
+from tradefile_11490.registry import getAccumulatePrefixes, getSettings
+from utils.iter import firstOf
+from utils.file import getFiles
+from toolz.functoolz import compose
+from functools import partial
+from bisect import bisect_left
+from os.path import join, exists, getsize
+from datetime import datetime, timedelta
+import logging, csv, os, zlib
+logger = logging.getLogger(__name__)
+
+
+
+manifestHeaders = ['date', 'filename', 'rows', 'size', 'checksum']
+
+
+
+getManifestFile = lambda outputDir, portfolio: \
+	join(outputDir, 'manifest', portfolio + '.csv')
+
+
+
+"""
+	[String] fn => [String] portfolio, None if fn is not an accumulate trade
+					file name
+"""
+getPortfolioFromFilename = lambda fn: \
+	None if not fn.endswith('.csv') else \
+	firstOf(lambda t: fn.startswith(t[0]), getAccumulatePrefixes() + [(fn, None)])[1]
+
+
+
+def getDateFromFilename(fn):
+	"""
+	[String] fn (accumulate trade file name)
+		=> [String] date (yyyy-mm-dd), None if the file name has no valid date
+	"""
+	try:
+		return reformatDate(fn.split('.')[0].split('_')[-1].strip(), '%Y-%m-%d', '%d%m%Y')
+	except ValueError:
+		return None
+
+
+
+def getFileStats(file, offset=0, rows=0, checksum=0):
+	"""
+	[String] file, [Int] offset, [Int] rows, [Int] checksum
+		=> ([Int] rows, [Int] size, [Int] checksum)
+
+	Count the lines and compute the crc32 checksum of a file. If the first
+	'offset' bytes of the file are already known to have 'rows' lines and
+	checksum 'checksum', only the rest of the file is read.
+	"""
+	with open(file, 'rb') as f:
+		f.seek(offset)
+		for block in iter(partial(f.read, 1024*1024), b''):
+			rows = rows + block.count(b'\n')
+			checksum = zlib.crc32(block, checksum)
+
+	return (rows, getsize(file), checksum)
+
+
+
+def loadManifest(outputDir, portfolio):
+	"""
+	[String] outputDir, [String] portfolio
+		=> [List] entries (sorted by date), None if the manifest does not exist
+
+	An entry is a tuple (date, filename, rows, size, checksum), where rows and
+	checksum are None if unknown.
+	"""
+	file = getManifestFile(outputDir, portfolio)
+	if not exists(file):
+		return None
+
+	toEntry = lambda d: \
+		( d['date'], d['filename']
+		, int(d['rows']) if d['rows'] != '' else None
+		, int(d['size'])
+		, int(d['checksum']) if d['checksum'] != '' else None
+		)
+
+	with open(file, newline='') as f:
+		return sorted(map(toEntry, csv.DictReader(f)))
+
+
+
+def saveManifest(outputDir, portfolio, entries):
+	"""
+	[String] outputDir, [String] portfolio, [List] entries
+		=> [String] manifest file
+
+	Side effect: write the manifest to a temporary file then replace the old
+	one, so that a reader never sees a half written manifest.
+	"""
+	file = getManifestFile(outputDir, portfolio)
+	os.makedirs(join(outputDir, 'manifest'), exist_ok=True)
+
+	toRow = lambda e: map(lambda x: '' if x == None else x, e)
+
+	with open(file + '.tmp', 'w', newline='') as f:
+		writer = csv.writer(f)
+		writer.writerow(manifestHeaders)
+		writer.writerows(map(toRow, sorted(entries)))
+
+	os.replace(file + '.tmp', file)
+	return file
+
+
+
+def buildManifest(outputDir, portfolio, known=[]):
+	"""
+	[String] outputDir, [String] portfolio
+	[List] known (entries from the old manifest, if any)
+		=> [List] entries
+
+	Side effect: scan the output directory, rebuild and save the manifest of
+	the portfolio.
+
+	A file in the known entries with the same size keeps its entry. Only the
+	latest accumulate trade file is read to get its rows and checksum (if not
+	known), because the next accumulate trade file is built on top of it.
+	Others just get their size.
+	"""
+	logger.info('buildManifest(): {0}'.format(portfolio))
+	knownEntries = dict(map(lambda e: ((e[1], e[3]), e), known))
+
+	# [Tuple] (date, fn) => [Tuple] entry
+	toEntry = lambda t: compose(
+		lambda size: knownEntries.get((t[1], size), (t[0], t[1], None, size, None))
+	  , getsize
+	)(join(outputDir, t[1]))
+
+	entries = compose(
+		sorted
+	  , partial(map, toEntry)
+	  , partial(filter, lambda t: t[0] != None)
+	  , partial(map, lambda fn: (getDateFromFilename(fn), fn))
+	  , partial(filter, lambda fn: getPortfolioFromFilename(fn) == portfolio)
+	  , getFiles
+	)(outputDir)
+
+	if len(entries) > 0 and (entries[-1][2] == None or entries[-1][4] == None):
+		date, fn, _, _, _ = entries[-1]
+		rows, size, checksum = getFileStats(join(outputDir, fn))
+		entries[-1] = (date, fn, rows, size, checksum)
+
+	saveManifest(outputDir, portfolio, entries)
+	return entries
+
+
+
+def findNearestEntry(entries, date):
+	"""
+	[List] entries (sorted by date), [String] date (yyyy-mm-dd)
+		=> [Tuple] the entry with the latest date before the date, None if
+			there is no such entry
+	"""
+	i = bisect_left(entries, (date,))
+	return entries[i-1] if i > 0 else None
+
+
+
+def isInSync(outputDir, entry):
+	"""
+	[String] outputDir, [Tuple] entry => [Bool] whether the file of the entry
+		still exists with the same size.
+	"""
+	file = join(outputDir, entry[1])
+	return exists(file) and getsize(file) == entry[3]
+
+
+
+def getAddedFiles(outputDir, portfolio, entry, date):
+	"""
+	[String] outputDir, [String] portfolio, [Tuple] entry, [String] date
+		=> [List] accumulate trade files of the portfolio, named as the
+			program names them, for the days after the entry's date and
+			before the date (up to today), that exist. They are not in the
+			manifest.
+	"""
+	toDate = lambda s: datetime.strptime(s, '%Y-%m-%d')
+	days = (min(toDate(date), datetime.now() + timedelta(days=1)) - toDate(entry[0])).days
+
+	return list(filter(
+		lambda fn: exists(join(outputDir, fn))
+	  , map( lambda n: getSettings(portfolio)['accumulatePrefix'] \
+	  				+ datetime.strftime(toDate(entry[0]) + timedelta(days=n), '%d%m%Y') + '.csv'
+		   , range(1, days))))
+
+
+
+def getNearestAccumulateEntry(outputDir, portfolio, date):
+	"""
+	[String] outputDir, [String] portfolio, [String] date (yyyy-mm-dd)
+		=> [Tuple] entry of the nearest accumulate trade file before the date,
+			None if not found
+
+	Look up the manifest. Rebuild it (keeping what is known of unchanged
+	files) if it does not exist, if the entry found or the one after it is
+	out of sync with its file, or if a file was added in between.
+	"""
+	entries = loadManifest(outputDir, portfolio)
+	if entries == None:
+		entries = buildManifest(outputDir, portfolio)
+
+	i = bisect_left(entries, (date,))
+	entry = entries[i-1] if i > 0 else None
+
+	if entry == None or not isInSync(outputDir, entry) \
+		or (i < len(entries) and not isInSync(outputDir, entries[i])) \
+		or len(getAddedFiles(outputDir, portfolio, entry, date)) > 0:
+		entry = findNearestEntry(buildManifest(outputDir, portfolio, entries), date)
+
+	return entry
+
+
+
+def updateManifest(outputDir, portfolio, date, file, baseSize):
+	"""
+	[String] outputDir, [String] portfolio, [String] date (yyyy-mm-dd)
+	[String] file (the accumulate trade file just written)
+	[Int] baseSize (number of bytes at the beginning of the file that come
+		from the previous accumulate trade file)
+		=> [Tuple] the new entry
+
+	Side effect: add (or replace) the entry of the file in the manifest.
+
+	When the previous accumulate trade file is in the manifest with the same
+	size, its rows and checksum are extended with the appended bytes only,
+	otherwise the whole file is read. The entry of the previous file is
+	dropped if that file no longer exists (e.g., rolled forward in ledger mode).
+	"""
+	entries = loadManifest(outputDir, portfolio)
+	if entries == None:
+		entries = buildManifest(outputDir, portfolio)
+
+	# the file may be this day's file with rows added (intraday mode)
+	current = firstOf(lambda e: e[0] == date and e[3] == baseSize, entries)
+	base = current if current != None else findNearestEntry(entries, date)
+	rows, size, checksum = \
+		getFileStats(file, baseSize, base[2], base[4]) \
+		if base != None and base[3] == baseSize and base[2] != None and base[4] != None \
+		else getFileStats(file)
+
+	fn = os.path.basename(file)
+	entry = (date, fn, rows, size, checksum)
+	entries = sorted(
+		[entry] + list(filter( lambda e: e[0] != date and \
+										not (base != None and e == base and not exists(join(outputDir, e[1])))
+							 , entries))
+	)
+
+	saveManifest(outputDir, portfolio, entries)
+	return entry
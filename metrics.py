@@ -0,0 +1,339 @@
+# coding=utf-8
+
+"""
+Record how long each stage of a conversion takes, so that a slow run can be
+explained: read, transform, write trustee, write accumulate, move, notify.
+
+For each stage we record the wall time, rows processed, bytes read and
+written and the peak memory while the stage runs. Time is exclusive, i.e.,
+the time spent reading positions while the trustee trade file is being
+written counts as 'read', not 'write trustee'.
+
+The peak memory of a stage is the peak traced by tracemalloc during the
+stage, so it is recorded only while tracemalloc is tracing, e.g., when the
+conversion is profiled (see profiler.py); tracing all the time would slow
+down every conversion. Stages running at the same time in other threads
+share the peak. The peak of the whole traced run is still kept, see
+getTracedPeak(). The peak resident memory of the whole process is recorded
+for the run.
+
+When a run ends, the metrics are written as one json log line and as a
+Prometheus textfile (for the node exporter textfile collector).
+
+Metrics are recorded only between startRun() and endRun(), and only if they
+are enabled in the config file. Otherwise every helper here hands back what
+it is given unchanged, so the cost is a check per call, not per row.
+"""
+from tradefile_11490.utility import getMetricsEnabled, getMetricsDirectory
+from contextlib import contextmanager, nullcontext
+from os.path import join
+import logging, threading, time, json, os, tracemalloc
+logger = logging.getLogger(__name__)
+
+try:
+	import resource
+except ImportError:
+	resource = None	# not available on Windows
+
+
+
+_run = None
+_lock = threading.Lock()
+_tracedPeak = 0		# the highest tracemalloc peak seen before a stage reset it
+_local = threading.local()
+
+stages = ['read', 'transform', 'write trustee', 'write accumulate', 'move', 'notify']
+
+
+
+def getPeakMemory():
+	"""
+	=> [Int] peak resident memory of the whole process (bytes), None if
+		unknown
+	"""
+	if resource == None:
+		return None
+
+	# ru_maxrss is in kilobytes on Linux
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+
+def startRun(portfolio):
+	"""
+	[String] portfolio => None
+
+	Start recording the metrics of a conversion, if metrics are enabled.
+	"""
+	global _run
+	_run = None if not getMetricsEnabled() else \
+		{ 'portfolio': portfolio
+		, 'start': time.time()
+		, 'stages': dict(map( lambda s: (s, { 'seconds': 0.0, 'rows': 0
+											, 'bytesRead': 0, 'bytesWritten': 0
+											, 'peakMemory': None})
+							, stages))
+		}
+
+
+
+def add(stageName, key, value):
+	"""
+	[String] stageName, [String] key, [Number] value => None
+
+	Add to a counter (seconds, rows, bytesRead, bytesWritten) of a stage.
+	"""
+	if _run != None:
+		with _lock:
+			_run['stages'][stageName][key] = _run['stages'][stageName][key] + value
+
+
+
+@contextmanager
+def _timedStage(stageName):
+	"""
+	[String] stageName => context manager recording the exclusive time of
+		the code inside it. If stageName is None, the time is not recorded
+		anywhere, e.g., waiting for another thread.
+	"""
+	stack = getattr(_local, 'stack', None)
+	if stack == None:
+		stack = _local.stack = []
+
+	tracing = tracemalloc.is_tracing()
+	if tracing:		# keep the peak so far, for the enclosing stage and the run, then reset
+		peak = tracemalloc.get_traced_memory()[1]
+		foldTracedPeak(peak)
+		foldPeak(stack, peak)
+		tracemalloc.reset_peak()
+
+	frame = [time.perf_counter(), 0.0, 0]	# start, time spent in nested stages, peak memory
+	stack.append(frame)
+	try:
+		yield
+	finally:
+		stack.pop()
+		elapsed = time.perf_counter() - frame[0]
+		if len(stack) > 0:
+			stack[-1][1] = stack[-1][1] + elapsed
+
+		if tracing and tracemalloc.is_tracing():
+			foldPeak([frame])
+			foldPeak(stack, frame[2])
+
+		if stageName != None:
+			add(stageName, 'seconds', elapsed - frame[1])
+			if tracing and _run != None:
+				with _lock:
+					_run['stages'][stageName]['peakMemory'] = \
+						max(_run['stages'][stageName]['peakMemory'] or 0, frame[2])
+
+
+
+def foldTracedPeak(peak):
+	"""
+	[Int] peak => None
+
+	Side effect: raise the highest peak seen to the peak.
+	"""
+	global _tracedPeak
+	with _lock:
+		_tracedPeak = max(_tracedPeak, peak)
+
+
+
+def getTracedPeak():
+	"""
+	=> [Int] peak traced memory (bytes) since tracing started or
+		resetTracedPeak(), though stages reset the peak of tracemalloc
+	"""
+	return max(_tracedPeak, tracemalloc.get_traced_memory()[1])
+
+
+
+def resetTracedPeak():
+	"""
+	=> None, start a new peak of traced memory
+	"""
+	global _tracedPeak
+	with _lock:
+		_tracedPeak = 0
+
+	tracemalloc.reset_peak()
+
+
+
+def foldPeak(stack, peak=None):
+	"""
+	[List] stack (of stage frames), [Int] peak (None means the peak traced
+		so far)
+		=> None
+
+	Side effect: raise the peak memory of the innermost frame to the peak.
+	"""
+	if len(stack) > 0:
+		peak = tracemalloc.get_traced_memory()[1] if peak == None else peak
+		stack[-1][2] = max(stack[-1][2], peak)
+
+
+
+def stage(stageName):
+	"""
+	[String] stageName => context manager timing the code inside it
+	"""
+	return nullcontext() if _run == None else _timedStage(stageName)
+
+
+
+def timedIterator(stageName, iterable):
+	"""
+	[String] stageName, [Iterable] iterable => [Iterable]
+
+	Time spent producing each item goes to the stage, each item counts as a
+	row of the stage.
+	"""
+	if _run == None:
+		return iterable
+
+	def timed(it):
+		while True:
+			with _timedStage(stageName):
+				try:
+					item = next(it)
+				except StopIteration:
+					return
+
+			add(stageName, 'rows', 1)
+			yield item
+
+	return timed(iter(iterable))
+
+
+
+def timedFunction(stageName, f, countRows=False):
+	"""
+	[String] stageName, [Function] f, [Bool] countRows => [Function]
+
+	Time spent in f goes to the stage. If countRows is True, each call counts
+	as a row of the stage.
+	"""
+	if _run == None:
+		return f
+
+	def timed(*args, **kwargs):
+		with _timedStage(stageName):
+			result = f(*args, **kwargs)
+
+		if countRows:
+			add(stageName, 'rows', 1)
+
+		return result
+
+	return timed
+
+
+
+def countedIterator(stageName, iterable):
+	"""
+	[String] stageName, [Iterable] iterable => [Iterable]
+
+	Each item counts as a row of the stage. The time spent waiting for an item
+	does not count to the stage that consumes them, only the time of the
+	stages producing the item (if timed) is recorded.
+	"""
+	if _run == None:
+		return iterable
+
+	def counted(it):
+		while True:
+			with _timedStage(None):
+				try:
+					item = next(it)
+				except StopIteration:
+					return
+
+			add(stageName, 'rows', 1)
+			yield item
+
+	return counted(iter(iterable))
+
+
+
+def endRun(success):
+	"""
+	[Bool] success => [Dictionary] metrics of the run, None if not recording
+
+	Side effect: write the metrics as a json log line and a Prometheus
+	textfile, then stop recording.
+	"""
+	global _run
+	if _run == None:
+		return None
+
+	run, _run = _run, None
+	run['success'] = success
+	run['seconds'] = time.time() - run['start']
+	run['peakMemory'] = getPeakMemory()
+
+	logger.info('metrics ' + json.dumps(run, sort_keys=True))
+	try:
+		writeTextfile(run)
+	except OSError:
+		logger.exception('endRun()')
+
+	return run
+
+
+
+def toPrometheus(run):
+	"""
+	[Dictionary] run => [String] metrics in Prometheus text format
+	"""
+	label = lambda s: '{{portfolio="{0}",stage="{1}"}}'.format(run['portfolio'], s)
+	runLabel = '{{portfolio="{0}"}}'.format(run['portfolio'])
+
+	def stageMetric(name, key, help):
+		return [ '# HELP tradefile_{0} {1}'.format(name, help)
+			   , '# TYPE tradefile_{0} gauge'.format(name)
+			   ] + list(map( lambda s: 'tradefile_{0}{1} {2}'.format(name, label(s), run['stages'][s][key])
+			   			   , filter(lambda s: run['stages'][s][key] != None, stages)))
+
+	return '\n'.join(
+		stageMetric('stage_seconds', 'seconds', 'Wall time of the stage in the last conversion') \
+	  + stageMetric('stage_rows', 'rows', 'Rows processed by the stage in the last conversion') \
+	  + stageMetric('stage_bytes_read', 'bytesRead', 'Bytes read by the stage in the last conversion') \
+	  + stageMetric('stage_bytes_written', 'bytesWritten', 'Bytes written by the stage in the last conversion') \
+	  + stageMetric('stage_peak_memory_bytes', 'peakMemory', 'Peak traced memory while the stage runs, in the last conversion') \
+	  + [ '# HELP tradefile_last_run_timestamp_seconds Start time of the last conversion'
+		, '# TYPE tradefile_last_run_timestamp_seconds gauge'
+		, 'tradefile_last_run_timestamp_seconds{0} {1}'.format(runLabel, run['start'])
+		, '# HELP tradefile_last_run_success Whether the last conversion succeeded'
+		, '# TYPE tradefile_last_run_success gauge'
+		, 'tradefile_last_run_success{0} {1}'.format(runLabel, 1 if run['success'] else 0)
+		, '# HELP tradefile_last_run_seconds Wall time of the last conversion'
+		, '# TYPE tradefile_last_run_seconds gauge'
+		, 'tradefile_last_run_seconds{0} {1}'.format(runLabel, run['seconds'])
+		] \
+	  + ([] if run['peakMemory'] == None else \
+		[ '# HELP tradefile_last_run_peak_memory_bytes Peak resident memory of the process in the last conversion'
+		, '# TYPE tradefile_last_run_peak_memory_bytes gauge'
+		, 'tradefile_last_run_peak_memory_bytes{0} {1}'.format(runLabel, run['peakMemory'])
+		])
+	) + '\n'
+
+
+
+def writeTextfile(run):
+	"""
+	[Dictionary] run => [String] textfile
+
+	Side effect: write the Prometheus textfile of the portfolio, through a
+	temporary file so that the collector never reads a half written file.
+	"""
+	os.makedirs(getMetricsDirectory(), exist_ok=True)
+	file = join(getMetricsDirectory(), 'tradefile_{0}.prom'.format(run['portfolio']))
+	with open(file + '.tmp', 'w') as f:
+		f.write(toPrometheus(run))
+
+	os.replace(file + '.tmp', file)
+	return file
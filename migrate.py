@@ -0,0 +1,170 @@
+# coding=utf-8
+
+"""
+Convert a directory of legacy accumulate trade files (.xls, .xlsx) to csv in
+one go, when onboarding a portfolio with years of Excel history.
+
+The files are converted in a process pool, each one streamed row by row
+the same way as convertAccumulateExcelToCSV(). The date columns (Trade Date,
+Settlement Date) of every row are validated: a date must be an Excel date or
+a date string in one of the known formats, and within a sensible range. A
+file with an invalid date is not written, its errors are reported instead.
+
+The result of each file (output, rows, seconds, errors) is written to a
+manifest, migration.csv in the directory.
+
+To migrate, do
+
+	$python migrate.py <directory>
+"""
+from tradefile_11490.main import getAccumulateCsvFileName, getAccumulateExcelHeaders \
+								, getAccumulateLineItems, accumulateDateHeaders \
+								, toAccumulateDateString
+from tradefile_11490.reader import streamLines
+from utils.utility import writeCsv
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from os.path import join
+import logging, csv, os, time
+logger = logging.getLogger(__name__)
+
+
+
+manifestHeaders = ['file', 'output', 'rows', 'seconds', 'errors']
+
+earliestDate, latestDate = '1990-01-01', '2099-12-31'
+
+maxErrors = 20	# errors reported per file
+
+
+
+def validateDates(headers, line):
+	"""
+	[List] headers, [List] line => [List] errors of the date columns, empty
+		if the dates are valid
+	"""
+	def validate(header, value):
+		try:
+			date = toAccumulateDateString(value)
+		except (ValueError, TypeError):
+			return ['{0} {1} is not a date'.format(header, repr(value))]
+
+		return [] if earliestDate <= date <= latestDate else \
+				['{0} {1} out of range'.format(header, date)]
+
+
+	return list(chain.from_iterable(
+		map( lambda t: validate(*t)
+		   , filter(lambda t: t[0] in accumulateDateHeaders, zip(headers, line)))))
+
+
+
+def migrateFile(file):
+	"""
+	[String] file (accumulate trade excel file) => [Dictionary] result
+
+	Runs in a worker process, a file that can't be read is reported instead
+	of stopping the whole migration.
+	"""
+	start = time.perf_counter()
+	try:
+		return convertFile(file, start)
+	except Exception as e:
+		return { 'file': file, 'output': '', 'rows': 0
+			   , 'seconds': round(time.perf_counter() - start, 3)
+			   , 'errors': '{0}: {1}'.format(type(e).__name__, e)
+			   }
+
+
+
+def convertFile(file, start):
+	"""
+	[String] file (accumulate trade excel file), [Float] start (time)
+		=> [Dictionary] result
+
+	Convert the file to csv, or report the errors in its date columns.
+	"""
+	outputFile = getAccumulateCsvFileName(file)
+	tempFile = outputFile + '.tmp'
+	lines = streamLines(file)
+	headers = getAccumulateExcelHeaders(next(lines))
+	missing = list(filter(lambda h: not h in headers, accumulateDateHeaders))
+	errors = list(map(lambda h: 'no {0} column'.format(h), missing))
+	rows = 0
+
+	def getRows():
+		nonlocal rows
+		yield headers
+		for n, line in enumerate(lines, 2):
+			if all(map(lambda x: x == '', line)):
+				continue	# a blank row
+
+			lineErrors = validateDates(headers, line)
+			if len(lineErrors) > 0:
+				errors.extend(map(lambda e: 'row {0}: {1}'.format(n, e), lineErrors))
+				continue
+
+			rows = rows + 1
+			yield getAccumulateLineItems(headers, line)
+
+
+	if len(errors) == 0:
+		writeCsv(tempFile, getRows(), delimiter=',')
+
+	if len(errors) == 0:	# no invalid date found while writing
+		os.replace(tempFile, outputFile)
+	elif os.path.exists(tempFile):
+		os.remove(tempFile)
+
+	return { 'file': file
+		   , 'output': outputFile if len(errors) == 0 else ''
+		   , 'rows': rows
+		   , 'seconds': round(time.perf_counter() - start, 3)
+		   , 'errors': '; '.join(errors[:maxErrors]) \
+		   				+ ('' if len(errors) <= maxErrors else \
+		   					'; and {0} more'.format(len(errors) - maxErrors))
+		   }
+
+
+
+def migrateDirectory(directory, processes=None):
+	"""
+	[String] directory, [Int] processes (None means number of CPUs)
+		=> [List] results, one for each .xls/.xlsx file in the directory
+
+	Side effect: convert the files to csv, write the results to migration.csv
+	in the directory.
+	"""
+	files = sorted(map( lambda fn: join(directory, fn)
+					  , filter( lambda fn: fn.endswith('.xls') or fn.endswith('.xlsx')
+							  , os.listdir(directory))))
+	logger.info('migrateDirectory(): {0} files in {1}'.format(len(files), directory))
+
+	with ProcessPoolExecutor(processes) as pool:
+		results = list(pool.map(migrateFile, files))
+
+	with open(join(directory, 'migration.csv'), 'w', newline='') as f:
+		writer = csv.DictWriter(f, manifestHeaders)
+		writer.writeheader()
+		writer.writerows(results)
+
+	for r in filter(lambda r: r['errors'] != '', results):
+		logger.error('migrateDirectory(): {0}: {1}'.format(r['file'], r['errors']))
+
+	return results
+
+
+
+
+if __name__ == '__main__':
+	import logging.config
+	logging.config.fileConfig('logging.config', disable_existing_loggers=False)
+
+	import argparse, sys
+	parser = argparse.ArgumentParser(description='Convert legacy accumulate trade files to csv')
+	parser.add_argument('directory', type=str)
+	parser.add_argument('--processes', type=int, default=None)
+
+	args = parser.parse_args()
+	results = migrateDirectory(args.directory, args.processes)
+	sys.exit(0 if all(map(lambda r: r['errors'] == '', results)) else 1)
@@ -0,0 +1,234 @@
+# coding=utf-8
+
+"""
+Send notification emails from a background worker, so that a slow mail relay
+never holds up a conversion.
+
+Notifications are put in a queue and the worker sends them one by one over a
+single SMTP connection, which is kept open and reused by all portfolios and
+runs of the same process (closed after being idle for a while). A failed send
+is retried with exponential backoff. If the relay is still down after all the
+retries, the message is saved to the spool directory, and sent again the next
+time the worker starts. When the program ends, what is not sent within about
+one mail timeout is spooled as well.
+"""
+from tradefile_11490.utility import getMailSender, getMailRecipients, getMailServer \
+									, getMailTimeout, getNotificationRetries \
+									, getNotificationBackoff, getNotificationIdle \
+									, getNotificationSpool
+from email.message import EmailMessage
+from email import message_from_bytes, policy
+from datetime import datetime
+from os.path import join, exists
+import logging, smtplib, threading, queue, time, os, atexit
+logger = logging.getLogger(__name__)
+
+
+
+_queue = queue.Queue()
+_lock = threading.Lock()
+_worker = None
+_connection = None
+_current = None		# (message, spool file) being delivered
+_spoolCount = 0
+
+
+
+def toMessage(subject, body=''):
+	"""
+	[String] subject, [String] body => [EmailMessage] message
+	"""
+	msg = EmailMessage()
+	msg['Subject'] = subject
+	msg['From'] = getMailSender()
+	msg['To'] = getMailRecipients()
+	msg.set_content(body)
+	return msg
+
+
+
+def notify(subject, body=''):
+	"""
+	[String] subject, [String] body => None
+
+	Put a notification in the queue and return at once.
+	"""
+	startWorker()
+	_queue.put((toMessage(subject, body), None))
+
+
+
+def flush(timeout=None):
+	"""
+	[Float] timeout => [Bool] whether all notifications in the queue have been
+		handled (sent or spooled) before the timeout (seconds).
+	"""
+	deadline = None if timeout == None else time.monotonic() + timeout
+	while _queue.unfinished_tasks > 0:
+		if deadline != None and time.monotonic() > deadline:
+			return False
+		time.sleep(0.05)
+
+	return True
+
+
+
+def startWorker():
+	"""
+	Start the worker thread if not yet started, queue the spooled messages.
+	"""
+	global _worker
+	with _lock:
+		if _worker != None and _worker.is_alive():
+			return
+
+		for file in getSpooledFiles():
+			with open(file, 'rb') as f:
+				_queue.put((message_from_bytes(f.read(), policy=policy.default), file))
+
+		_worker = threading.Thread(target=work, name='notifier', daemon=True)
+		_worker.start()
+
+
+
+def work():
+	"""
+	The worker loop: send queued messages, close the connection when idle.
+	"""
+	while True:
+		global _current
+		try:
+			_current = _queue.get(timeout=getNotificationIdle())
+		except queue.Empty:
+			closeConnection()
+			continue
+
+		try:
+			deliver(*_current)
+		except:
+			logger.exception('work()')
+		finally:
+			_current = None
+			_queue.task_done()
+
+
+
+def deliver(msg, spoolFile):
+	"""
+	[EmailMessage] msg, [String] spoolFile (None if the message was not
+		spooled before)
+		=> [Bool] whether the message is sent
+
+	Send the message, retry with exponential backoff. If all retries fail,
+	save the message to the spool directory (unless it's there already).
+	"""
+	retries, backoff = getNotificationRetries(), getNotificationBackoff()
+	sent = False
+	for attempt in range(retries + 1):
+		try:
+			getConnection().send_message(msg)
+			sent = True
+			break
+
+		except (smtplib.SMTPException, OSError):
+			logger.warning('deliver(): attempt {0} failed'.format(attempt + 1), exc_info=True)
+			closeConnection()
+			if attempt < retries:
+				time.sleep(backoff * 2**attempt)
+
+	if sent and spoolFile != None:
+		try:
+			os.remove(spoolFile)
+		except FileNotFoundError:
+			pass	# sent again by another process, nothing to remove
+
+	elif not sent and spoolFile == None:
+		spool(msg)
+
+	return sent
+
+
+
+def getConnection():
+	"""
+	=> [SMTP] the open connection to the mail server, connect if necessary.
+	"""
+	global _connection
+	if _connection == None:
+		host, _, port = getMailServer().partition(':')
+		_connection = smtplib.SMTP(host, int(port) if port != '' else 0, timeout=getMailTimeout())
+
+	return _connection
+
+
+
+def closeConnection():
+	global _connection
+	if _connection != None:
+		try:
+			_connection.quit()
+		except (smtplib.SMTPException, OSError):
+			_connection.close()
+
+		_connection = None
+
+
+
+def spool(msg):
+	"""
+	[EmailMessage] msg => [String] spool file
+
+	Side effect: save the message to the spool directory.
+	"""
+	global _spoolCount
+	_spoolCount = _spoolCount + 1
+
+	os.makedirs(getNotificationSpool(), exist_ok=True)
+	file = join( getNotificationSpool()
+			   , datetime.strftime(datetime.now(), '%Y%m%d_%H%M%S_')
+			   		+ '{0}_{1}.eml'.format(os.getpid(), _spoolCount)
+			   )
+	with open(file, 'wb') as f:
+		f.write(msg.as_bytes())
+
+	logger.error('spool(): mail server not available, saved to {0}'.format(file))
+	return file
+
+
+
+def getSpooledFiles():
+	"""
+	=> [List] spooled message files, oldest first
+	"""
+	spoolDir = getNotificationSpool()
+	if not exists(spoolDir):
+		return []
+
+	return sorted(map( lambda fn: join(spoolDir, fn)
+					 , filter(lambda fn: fn.endswith('.eml'), os.listdir(spoolDir))))
+
+
+
+@atexit.register
+def _flushAtExit():
+	"""
+	Don't lose queued notifications when the program ends. Give the worker
+	about one mail timeout to send them, then spool what is left, so that an
+	unresponsive relay does not hold up the exit (and the next portfolio's
+	run) for all the retries. A message sent twice is better than one lost.
+	"""
+	if _worker == None or not _worker.is_alive():
+		return
+
+	if not flush(getMailTimeout()):
+		left = [_current]
+		while True:
+			try:
+				left.append(_queue.get_nowait())
+			except queue.Empty:
+				break
+
+		for msg, spoolFile in filter(lambda t: t != None and t[1] == None, left):
+			spool(msg)
+
+	closeConnection()
@@ -0,0 +1,120 @@
+# coding=utf-8
+
+"""
+Convert the trade files of several portfolios at the same time.
+
+Each step of a conversion mostly waits on the network share or the mail
+server, so the steps of different portfolios are overlapped with asyncio,
+every blocking step running in a bounded thread pool. Within a portfolio the
+order still holds:
+
+1. write the trustee and accumulate trade files (the two writes overlap
+	already, see writePortfolioFiles());
+2. flush both output files to disk, in parallel;
+3. only then move the trade file to the 'processed files' folder, so a
+	trade file is never moved away while its outputs may be lost;
+4. send the notification (queued, see notifier.py).
+
+If a step fails, the trade file stays where it is and the error is notified,
+the same as runConversion().
+
+Metrics (see metrics.py) record one conversion at a time, so when they are
+enabled the portfolios are converted one after another.
+"""
+from tradefile_11490.main import writeTradenAccumulateFiles, moveTradeFile \
+								, sendNotification, getAllTradeFilesFromDirectory
+from tradefile_11490.registry import getPortfolios
+from tradefile_11490.utility import getMetricsEnabled
+from tradefile_11490 import metrics
+from concurrent.futures import ThreadPoolExecutor
+import logging, asyncio, os
+logger = logging.getLogger(__name__)
+
+
+
+def makeDurable(file):
+	"""
+	[String] file => [String] file
+
+	Side effect: flush the file to disk.
+	"""
+	with open(file, 'rb+') as f:
+		os.fsync(f.fileno())
+
+	return file
+
+
+
+async def convertPortfolio(inputFile, portfolio, dataDirectory, executor, limit):
+	"""
+	[String] inputFile, [String] portfolio, [String] dataDirectory
+	[Executor] executor (for blocking steps)
+	[Semaphore] limit (conversions running at the same time)
+		=> [Bool] whether the conversion is successful
+	"""
+	loop = asyncio.get_running_loop()
+	inThread = lambda f, *args: loop.run_in_executor(executor, f, *args)
+
+	async with limit:
+		metrics.startRun(portfolio)
+		try:
+			outputFiles = await inThread(writeTradenAccumulateFiles, inputFile, portfolio, dataDirectory)
+			await asyncio.gather(*map(lambda f: inThread(makeDurable, f), outputFiles))
+			with metrics.stage('move'):
+				await inThread(moveTradeFile, inputFile, dataDirectory)
+			with metrics.stage('notify'):
+				sendNotification('Successfully performed CL trustee {0} trade conversion'.format(portfolio))
+
+			metrics.endRun(True)
+			return True
+
+		except Exception:
+			logger.exception('convertPortfolio(): {0}'.format(portfolio))
+			with metrics.stage('notify'):
+				sendNotification('Error occurred in performing CL trustee {0} trade conversion'.format(portfolio))
+
+			metrics.endRun(False)
+			return False
+
+
+
+async def convertAll(dataDirectory, workers):
+	"""
+	[String] dataDirectory, [Int] workers => [Dictionary] portfolio => [Bool]
+	"""
+	allFiles = getAllTradeFilesFromDirectory(dataDirectory)
+	limit = asyncio.Semaphore(1 if getMetricsEnabled() else len(getPortfolios()))
+
+	def checkFiles(portfolio):
+		if len(allFiles[portfolio]) > 1:
+			logger.error('{0} files found for {1}'.format(len(allFiles[portfolio]), portfolio))
+			sendNotification('Error occurred in performing CL trustee {0} trade conversion'.format(portfolio))
+			return False
+
+		return True
+
+
+	async def noConversion():
+		return False
+
+
+	with ThreadPoolExecutor(workers, thread_name_prefix='pipeline') as executor:
+		portfolios = list(filter(lambda p: p in allFiles, getPortfolios()))
+		results = await asyncio.gather(*map(
+			lambda p: convertPortfolio(allFiles[p][0], p, dataDirectory, executor, limit) \
+						if checkFiles(p) else noConversion()
+		  , portfolios))
+
+	return dict(zip(portfolios, results))
+
+
+
+def runAllConversionsAsync(dataDirectory, workers=4):
+	"""
+	[String] dataDirectory, [Int] workers (threads for blocking steps)
+		=> [Dictionary] portfolio => [Bool] result
+
+	Same as runAllConversions(), with the portfolios converted at the same
+	time.
+	"""
+	return asyncio.run(convertAll(dataDirectory, workers))
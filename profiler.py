@@ -0,0 +1,179 @@
+# coding=utf-8
+
+"""
+Profile a conversion, to find out why a particular trade file is slow or
+takes a lot of memory.
+
+While profiling, the time spent in each function is recorded by cProfile and
+every memory allocation is traced by tracemalloc. When the conversion ends,
+two files are written to the profiles directory (see [profile] in the config
+file), named after the run and the time:
+
+1. <name>_<yyyymmdd_HHMMSS>.prof: the cProfile stats, to be opened with
+	pstats or a viewer like snakeviz;
+2. <name>_<yyyymmdd_HHMMSS>.txt: a report of the functions taking the most
+	time (cumulative and own) and the lines allocating the most memory.
+
+Only the latest runs are kept, older profiles are deleted.
+
+Threads started during the profile (e.g., the writers of fanOut()) are
+profiled as well and their stats merged, where the Python version allows
+one profiler per thread.
+
+To profile a conversion, do
+
+	$python main.py 11490 --profile
+
+or set "enabled=true" under [profile] in the config file.
+"""
+from tradefile_11490.utility import getProfileEnabled, getProfileDirectory \
+									, getProfileKeep, getProfileTop
+from tradefile_11490 import metrics
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from os.path import join, splitext
+import logging, cProfile, pstats, tracemalloc, threading, io, os, sys
+logger = logging.getLogger(__name__)
+
+
+
+tracebackFrames = 10	# frames kept by tracemalloc for each allocation
+
+
+
+def profiled(name, enabled=None):
+	"""
+	[String] name (of the run, e.g., portfolio)
+	[Bool] enabled (None means as in the config file)
+		=> context manager profiling the code inside it
+	"""
+	enabled = getProfileEnabled() if enabled == None else enabled
+	return _profiled(name) if enabled else nullcontext()
+
+
+
+@contextmanager
+def _profiled(name):
+	profiles = [cProfile.Profile()]
+	lock = threading.Lock()
+
+	def startThreadProfile(*args):
+		"""
+		Called once in each new thread, replaced by the profile of the thread.
+		"""
+		profile = cProfile.Profile()
+		try:
+			profile.enable()
+		except ValueError:		# one profiler per interpreter (Python 3.12+)
+			sys.setprofile(None)
+			return
+
+		with lock:
+			profiles.append(profile)
+
+
+	startedTracing = not tracemalloc.is_tracing()
+	if startedTracing:
+		tracemalloc.start(tracebackFrames)
+		metrics.resetTracedPeak()
+
+	threading.setprofile(startThreadProfile)
+	profiles[0].enable()
+	try:
+		yield
+	finally:
+		profiles[0].disable()
+		threading.setprofile(None)
+		with lock:
+			for profile in profiles[1:]:
+				profile.disable()
+
+		snapshot = tracemalloc.take_snapshot()
+		peak = metrics.getTracedPeak()	# metrics resets the tracemalloc peak per stage
+		if startedTracing:
+			tracemalloc.stop()
+
+		writeProfile(name, profiles, snapshot, peak)
+
+
+
+def writeProfile(name, profiles, snapshot, peak):
+	"""
+	[String] name, [List] profiles (cProfile), [Snapshot] snapshot (tracemalloc)
+	[Int] peak (traced memory, bytes)
+		=> [String] report file
+
+	Side effect: write the stats and the report to the profiles directory,
+	delete old profiles.
+	"""
+	directory = getProfileDirectory()
+	os.makedirs(directory, exist_ok=True)
+	stem = join(directory, '{0}_{1}'.format(name, datetime.now().strftime('%Y%m%d_%H%M%S')))
+
+	stats = pstats.Stats(*profiles)
+	stats.dump_stats(stem + '.prof')
+	with open(stem + '.txt', 'w') as f:
+		f.write(getReport(stats, snapshot, peak, getProfileTop()))
+
+	logger.info('writeProfile(): {0}'.format(stem + '.txt'))
+	rotateProfiles(directory, getProfileKeep())
+	return stem + '.txt'
+
+
+
+def getReport(stats, snapshot, peak, top):
+	"""
+	[Stats] stats, [Snapshot] snapshot, [Int] peak, [Int] top
+		=> [String] report
+	"""
+	def printStats(sortKey):
+		output = io.StringIO()
+		stats.stream = output
+		stats.sort_stats(sortKey).print_stats(top)
+		return output.getvalue()
+
+
+	snapshot = snapshot.filter_traces([
+		tracemalloc.Filter(False, tracemalloc.__file__)
+	  , tracemalloc.Filter(False, '<frozen importlib._bootstrap>')
+	  , tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>')
+	])
+
+	return '\n'.join(
+		[ '==== functions by cumulative time ===='
+		, printStats('cumulative')
+		, '==== functions by own time ===='
+		, printStats('tottime')
+		, '==== memory ===='
+		, 'peak traced memory: {0:.1f} KiB'.format(peak / 1024)
+		, ''
+		, 'allocated and not yet freed, by line:'
+		] \
+	  + list(map(str, snapshot.statistics('lineno')[:top])) \
+	  + ['', 'allocated and not yet freed, by call stack:'] \
+	  + list(map( lambda s: '{0}\n{1}'.format(s, '\n'.join(s.traceback.format()))
+	  			, snapshot.statistics('traceback')[:min(top, 5)])) \
+	  + ['']
+	)
+
+
+
+def rotateProfiles(directory, keep):
+	"""
+	[String] directory, [Int] keep => [List] files deleted
+
+	Keep the profiles of the latest runs only.
+	"""
+	stems = sorted(
+		set(map( lambda fn: splitext(fn)[0]
+			   , filter( lambda fn: fn.endswith('.prof') or fn.endswith('.txt')
+			   		   , os.listdir(directory))))
+	  , key=lambda stem: stem[-15:]	# yyyymmdd_HHMMSS
+	  , reverse=True)
+
+	toDelete = list(filter( lambda fn: splitext(fn)[0] in stems[keep:]
+						  , os.listdir(directory)))
+	for fn in toDelete:
+		os.remove(join(directory, fn))
+
+	return toDelete
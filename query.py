@@ -0,0 +1,135 @@
+# coding=utf-8
+
+"""
+Query the accumulated trade history of a portfolio, e.g., all trades of a
+ticker in a date range, without opening the multi-year accumulate trade file.
+
+The query runs on the store (see store.py), whose indexes on trade date,
+ticker and broker make a selective query read only the matching rows. A
+portfolio not in the store yet, or stored up to a day before its latest
+accumulate trade file, is indexed first from that file.
+
+Filters are on the accumulate trade file columns: trade date (As of Dt)
+range, ticker (Ticker & Exc), broker (FACC Long Name) and fund (FundName).
+The result is csv, the accumulate trade file header followed by the matching
+lines exactly as they are in the accumulate trade file, written as they are
+read.
+
+To query, do
+
+	$python query.py 11490 --from 2021-01-01 --to 2021-06-30 --ticker "700 HK"
+"""
+from tradefile_11490.manifest import getNearestAccumulateEntry
+from tradefile_11490 import store
+from os.path import join
+import logging, sys
+logger = logging.getLogger(__name__)
+
+
+
+def indexPortfolio(outputDir, portfolio):
+	"""
+	[String] outputDir, [String] portfolio => [Bool] whether the portfolio
+		is indexed
+
+	Side effect: if the latest accumulate trade file is newer than the last
+	day in the store (e.g., the store is not enabled for the daily runs),
+	bring the store up to date with it first.
+	"""
+	entry = getNearestAccumulateEntry(outputDir, portfolio, '9999-12-31')
+	if entry == None:
+		logger.warning('indexPortfolio(): no accumulate file for {0}'.format(portfolio))
+		return store.hasPortfolio(portfolio)
+
+	lastDay = store.getLastDay(portfolio)
+	if lastDay != None and lastDay >= entry[0]:
+		return True
+
+	logger.info('indexPortfolio(): index {0}'.format(entry[1]))
+	store.syncAccumulateFile(portfolio, entry[0], join(outputDir, entry[1]))
+	return True
+
+
+
+def getConditions(fromDate=None, toDate=None, ticker=None, broker=None, fund=None):
+	"""
+	[String] fromDate, toDate (yyyy-mm-dd, inclusive), [String] ticker
+	[String] broker, [String] fund
+		=> ( [List] sql conditions
+		   , [List] parameters
+		   )
+
+	Only filters that are not None are used.
+	"""
+	filters = [ ('trade_date >= ?', fromDate), ('trade_date <= ?', toDate)
+			  , ('ticker = ?', ticker), ('broker = ?', broker), ('fund = ?', fund)
+			  ]
+	used = list(filter(lambda t: t[1] != None, filters))
+	return (list(map(lambda t: t[0], used)), list(map(lambda t: t[1], used)))
+
+
+
+def queryTrades(portfolio, **filters):
+	"""
+	[String] portfolio, filters (see getConditions)
+		=> [Iterator] lines (bytes), the header first, then the matching
+			trades in the order of the accumulate trade file
+	"""
+	conditions, parameters = getConditions(**filters)
+	with store.connect() as conn:
+		header = conn.execute( 'SELECT line FROM trades WHERE portfolio = ? ORDER BY day, seq LIMIT 1'
+							 , (portfolio,)).fetchone()
+		if header == None:
+			return
+
+		yield header[0]
+		for (line,) in conn.execute(
+			'SELECT line FROM trades WHERE portfolio = ? AND quantity IS NOT NULL{0} ORDER BY day, seq' \
+				.format(''.join(map(lambda c: ' AND ' + c, conditions)))
+		  , [portfolio] + parameters):
+			yield line
+
+
+
+def writeLines(lines, output):
+	"""
+	[Iterable] lines (bytes), [File] output (binary) => [Int] number of lines
+	"""
+	n = 0
+	for line in lines:
+		output.write(line)
+		n = n + 1
+
+	return n
+
+
+
+
+if __name__ == '__main__':
+	from tradefile_11490.utility import getDataDirectory
+	import logging.config
+	logging.config.fileConfig('logging.config', disable_existing_loggers=False)
+
+	import argparse
+	parser = argparse.ArgumentParser(description='Query the CL trustee accumulated trades')
+	parser.add_argument('portfolio', metavar='portfolio', type=str)
+	parser.add_argument('--from', dest='fromDate', metavar='date', type=str
+					   , help='earliest trade date (yyyy-mm-dd)')
+	parser.add_argument('--to', dest='toDate', metavar='date', type=str
+					   , help='latest trade date (yyyy-mm-dd)')
+	parser.add_argument('--ticker', type=str, help='Ticker & Exc, e.g., "700 HK"')
+	parser.add_argument('--broker', type=str, help='FACC Long Name, e.g., "CLSA LIMITED"')
+	parser.add_argument('--fund', type=str, help='FundName')
+	parser.add_argument('--output', type=str, help='csv file to write, default is stdout')
+
+	args = parser.parse_args()
+	if not indexPortfolio(getDataDirectory(), args.portfolio):
+		sys.exit(1)
+
+	lines = queryTrades( args.portfolio, fromDate=args.fromDate, toDate=args.toDate
+					   , ticker=args.ticker, broker=args.broker, fund=args.fund)
+	if args.output == None:
+		writeLines(lines, sys.stdout.buffer)
+	else:
+		with open(args.output, 'wb') as f:
+			logger.info('{0} trades written to {1}'.format(writeLines(lines, f) - 1, args.output))
@@ -0,0 +1,172 @@
+# coding=utf-8
+
+"""
+Read the lines (rows) of a Bloomberg AIM trade file lazily, so that a large
+THRP report is never held in memory as a whole.
+
+The lines produced are the same as clamc_datafeed.feeder.fileToLines, i.e.,
+an empty cell is an empty string, a number is a float and a date is an Excel
+ordinal (float), so that getDatenPositions() works the same on either of them.
+
+A THRP report exported as delimited text (csv, tsv) is read with the csv
+module, much faster than unzipping and parsing a workbook. The cells stay
+text, except in the number columns given (after the header row), where a
+number becomes a float as in a workbook. So a text cell like '0700' is kept
+as it is, and a date stays text (see toTradeDateString() in trade.py).
+
+Given the columns needed (e.g., sourceColumns in trade.py), the lines after
+the header row hold only those columns, so the other cells of a row are
+never converted.
+"""
+from datetime import datetime, date
+import logging, csv, re
+logger = logging.getLogger(__name__)
+
+
+
+excelEpoch = datetime(1899, 12, 30)
+
+
+
+def toCellValue(value):
+	"""
+	[Object] value (from openpyxl) => [Object] value (as fileToLines gives)
+	"""
+	if value is None:
+		return ''
+	elif isinstance(value, bool):
+		return value
+	elif isinstance(value, int):
+		return float(value)
+	elif isinstance(value, datetime):
+		return (value - excelEpoch).total_seconds() / 86400
+	elif isinstance(value, date):
+		return float((value - excelEpoch.date()).days)
+	else:
+		return value
+
+
+
+numberPattern = re.compile(r'-?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$')
+
+
+
+"""
+	[String] s (text cell) => [Object] value (as fileToLines gives)
+"""
+toTextCellValue = lambda s: \
+	float(s) if numberPattern.match(s) else s
+
+
+
+headerStart = 'Trader Name'	# first cell of the header row of a THRP report
+
+
+
+def getColumnIndexes(header, columns):
+	"""
+	[List] header (row), [Iterable] columns => [List] indexes of the columns
+
+	Raise ValueError if a column is missing from the header.
+	"""
+	columnIndex = dict(map(reversed, enumerate(header)))
+	missing = list(filter(lambda c: not c in columnIndex, columns))
+	if len(missing) > 0:
+		logger.error('getColumnIndexes(): missing columns in trade file: {0}'.format(', '.join(missing)))
+		raise ValueError('missing columns in trade file: {0}'.format(', '.join(missing)))
+
+	return list(map(columnIndex.get, columns))
+
+
+
+"""
+	[List] row, [List] indexes => [List] cells at the indexes, '' for those
+		beyond the end of the row (e.g., a blank line of a csv file)
+"""
+pick = lambda row, indexes: \
+	list(map(lambda i: row[i] if i < len(row) else '', indexes))
+
+
+
+def textToLines(file, delimiter, numberColumns=(), columns=None):
+	"""
+	[String] file (csv or tsv), [String] delimiter
+	[Iterable] numberColumns (headers of the columns holding numbers)
+	[List] columns (headers of the columns to keep, None means all)
+		=> [Iterator] lines
+
+	Iterate the rows of a delimited text file, only one row is in memory at
+	a time. If columns are given, the header row and the rows after it hold
+	only those columns, in that order.
+	"""
+	indexes, numberIndexes = None, []
+	with open(file, newline='', encoding='utf-8-sig') as f:
+		for row in csv.reader(f, delimiter=delimiter):
+			if len(row) > 0 and row[0] == headerStart:
+				if columns != None:
+					indexes = getColumnIndexes(row, columns)
+					row = list(columns)
+
+				numberIndexes = list(filter( lambda i: row[i] in numberColumns
+										   , range(len(row))))
+			else:
+				if indexes != None:
+					row = pick(row, indexes)
+				for i in filter(lambda i: i < len(row), numberIndexes):
+					row[i] = toTextCellValue(row[i])
+
+			yield row
+
+
+
+def xlsxToLines(file, columns=None):
+	"""
+	[String] file (xlsx), [List] columns (headers of the columns to keep,
+		None means all)
+		=> [Iterator] lines
+
+	Iterate the rows of the first worksheet in read only mode, only one row
+	is in memory at a time. The workbook is closed when the iteration ends.
+	If columns are given, the header row and the rows after it hold only
+	those columns, in that order, and only their cells are converted.
+	"""
+	from openpyxl import load_workbook
+	wb = load_workbook(file, read_only=True, data_only=True)
+	try:
+		indexes = None
+		for row in wb.worksheets[0].iter_rows(values_only=True):
+			if indexes != None:
+				yield list(map(toCellValue, pick(row, indexes)))
+			elif columns != None and len(row) > 0 and row[0] == headerStart:
+				indexes = getColumnIndexes(row, columns)
+				yield list(columns)
+			else:
+				yield list(map(toCellValue, row))
+	finally:
+		wb.close()
+
+
+
+def streamLines(file, numberColumns=(), columns=None):
+	"""
+	[String] file, [Iterable] numberColumns (of a csv or tsv file)
+	[List] columns (headers of the columns to keep, None means all)
+		=> [Iterator] lines
+
+	Stream a csv or tsv file as text, a xlsx file through openpyxl, fall back
+	to fileToLines for other formats or if openpyxl is not installed. The
+	columns are not picked by fileToLines, its lines are complete.
+	"""
+	if file.endswith('.csv'):
+		return textToLines(file, ',', numberColumns, columns)
+	elif file.endswith('.tsv'):
+		return textToLines(file, '\t', numberColumns, columns)
+	elif file.endswith('.xlsx'):
+		try:
+			import openpyxl
+			return xlsxToLines(file, columns)
+		except ImportError:
+			logger.warning('streamLines(): openpyxl not installed')
+
+	from clamc_datafeed.feeder import fileToLines
+	return fileToLines(file)
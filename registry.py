@@ -0,0 +1,95 @@
+# coding=utf-8
+
+"""
+The portfolios and what differs between them, loaded once from the
+[portfolio <code>] sections of the config file: names of the output files,
+title of the CL trustee trade file, fund name in the accumulate trade file
+and the funds whose AFS trades are reported as Trading.
+
+The lookups used for every row (fund name, AFS rule) are built once into a
+dictionary or set. To add a portfolio, add a section to the config file.
+"""
+from tradefile_11490.utility import getConfig
+from functools import lru_cache
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+"""
+	[String] value => [String] value without the quotes around it, if any
+"""
+unquote = lambda value: \
+	value[1:-1] if len(value) > 1 and value[0] == value[-1] == '"' else value
+
+
+
+@lru_cache(maxsize=1)
+def getRegistry():
+	"""
+	=> [Dictionary] portfolio => [Dictionary] settings, in the order of the
+		config file
+	"""
+	toSettings = lambda section: \
+		{ 'trusteePrefix': unquote(section['trustee_prefix'])
+		, 'trusteeTitle': unquote(section['trustee_title'])
+		, 'accumulatePrefix': unquote(section['accumulate_prefix'])
+		, 'fundName': unquote(section['fund_name'])
+		, 'afsToTrading': frozenset(filter( lambda s: s != ''
+										  , map( lambda s: s.strip()
+											   , section.get('afs_to_trading', '').split(','))))
+		}
+
+	config = getConfig()
+	return dict(map( lambda name: (name.split()[1], toSettings(config[name]))
+				   , filter(lambda name: name.startswith('portfolio '), config.sections())))
+
+
+
+"""
+	=> [Tuple] portfolio codes
+"""
+getPortfolios = lambda: tuple(getRegistry().keys())
+
+
+
+"""
+	[String] portfolio => [Dictionary] settings of the portfolio
+"""
+getSettings = lambda portfolio: getRegistry()[portfolio]
+
+
+
+"""
+	[String] fund (e.g., 11490-B) => [String] portfolio (e.g., 11490)
+"""
+getPortfolioFromFund = lambda fund: fund.split('-')[0]
+
+
+
+@lru_cache(maxsize=1)
+def getFundNames():
+	"""
+	=> [Dictionary] portfolio => fund name in the accumulate trade file
+	"""
+	return dict(map(lambda t: (t[0], t[1]['fundName']), getRegistry().items()))
+
+
+
+@lru_cache(maxsize=1)
+def getAfsToTradingFunds():
+	"""
+	=> [Set] funds (trader names) whose AFS trades are reported as Trading
+	"""
+	return frozenset().union(*map(lambda s: s['afsToTrading'], getRegistry().values()))
+
+
+
+@lru_cache(maxsize=1)
+def getAccumulatePrefixes():
+	"""
+	=> [List] (prefix, portfolio) of accumulate trade file names, longest
+		prefix first, so that 'Equities_BOC_' is tried before 'Equities_'
+	"""
+	return sorted( map(lambda t: (t[1]['accumulatePrefix'], t[0]), getRegistry().items())
+				 , key=lambda t: len(t[0]), reverse=True)
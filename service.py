@@ -0,0 +1,235 @@
+# coding=utf-8
+
+"""
+A resident conversion service, so that a conversion does not pay for
+starting the interpreter, importing modules and reading the config file,
+and an operator can have a trade file converted right away.
+
+The service listens on a local HTTP address (see [service] in the config
+file). To convert a trade file, post a json job to /convert:
+
+	{"file": "11490_1.xlsx", "portfolio": "11490"}
+
+The file is relative to the data directory, unless "directory" is given in
+the job. The response is sent when the conversion is done:
+
+	{ "trusteeFile": ..., "accumulateFile": ...
+	, "seconds": 1.23, "waitSeconds": 0.0 }
+
+or {"error": ...} with status 400 (bad job), 503 (too many jobs waiting)
+or 500 (conversion failed). GET /health tells whether the service is up.
+
+Jobs run in a bounded pool of worker threads. Jobs of the same portfolio
+run one at a time, because each one builds on the accumulate trade file of
+the one before. Unlike main.py, the service does not move the trade file or
+send notifications, the caller gets the result directly.
+
+To start the service, do
+
+	$python main.py --serve
+
+To submit a job from the command line, do
+
+	$python service.py 11490_1.xlsx 11490
+"""
+from tradefile_11490.main import writeTradenAccumulateFiles
+from tradefile_11490.registry import getPortfolios
+from tradefile_11490.utility import getDataDirectory, getServiceAddress \
+									, getServiceWorkers, getServiceQueueSize
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import defaultdict
+from os.path import join, exists
+import logging, threading, json, time
+logger = logging.getLogger(__name__)
+
+
+
+class BadJob(ValueError):
+	pass
+
+
+
+class Busy(RuntimeError):
+	pass
+
+
+
+_locks = defaultdict(threading.Lock)	# portfolio => lock
+_locksLock = threading.Lock()
+
+
+
+def getPortfolioLock(portfolio):
+	with _locksLock:
+		return _locks[portfolio]
+
+
+
+def runJob(file, portfolio, directory, submitted):
+	"""
+	[String] file, [String] portfolio, [String] directory
+	[Float] submitted (time the job was submitted)
+		=> [Dictionary] result
+	"""
+	with getPortfolioLock(portfolio):
+		start = time.perf_counter()
+		logger.info('runJob(): {0} {1}'.format(portfolio, file))
+		trusteeFile, accumulateFile = writeTradenAccumulateFiles(file, portfolio, directory)
+		return { 'trusteeFile': trusteeFile
+			   , 'accumulateFile': accumulateFile
+			   , 'seconds': round(time.perf_counter() - start, 3)
+			   , 'waitSeconds': round(start - submitted, 3)
+			   }
+
+
+
+def toJob(request):
+	"""
+	[Dictionary] request => ([String] file, [String] portfolio, [String] directory)
+
+	Raise BadJob if the request is not a valid job.
+	"""
+	if not isinstance(request, dict) or not 'file' in request or not 'portfolio' in request:
+		raise BadJob('a job needs "file" and "portfolio"')
+
+	portfolio, file = str(request['portfolio']), str(request['file'])
+	directory = str(request.get('directory', getDataDirectory()))
+	if not portfolio in getPortfolios():
+		raise BadJob('invalid portfolio {0}'.format(portfolio))
+	if not exists(join(directory, file)):
+		raise BadJob('file not found {0}'.format(join(directory, file)))
+
+	return (file, portfolio, directory)
+
+
+
+def makeSubmitter(workers, queueSize):
+	"""
+	[Int] workers, [Int] queueSize
+		=> [Function] submit ([Dictionary] request => [Dictionary] result)
+
+	Jobs beyond the workers and the waiting queue are refused with Busy.
+	"""
+	pool = ThreadPoolExecutor(workers, thread_name_prefix='conversion')
+	slots = threading.BoundedSemaphore(workers + queueSize)
+
+	def submit(request):
+		job = toJob(request)
+		if not slots.acquire(blocking=False):
+			raise Busy('too many jobs waiting')
+
+		try:
+			return pool.submit(runJob, *job, time.perf_counter()).result()
+		finally:
+			slots.release()
+
+
+	return submit
+
+
+
+def makeHandler(submit):
+	"""
+	[Function] submit => [Class] request handler of the service
+	"""
+	class Handler(BaseHTTPRequestHandler):
+
+		def sendJson(self, status, obj):
+			body = json.dumps(obj).encode()
+			self.send_response(status)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def do_GET(self):
+			if self.path == '/health':
+				self.sendJson(200, {'status': 'ok'})
+			else:
+				self.sendJson(404, {'error': 'not found'})
+
+		def do_POST(self):
+			if self.path != '/convert':
+				self.sendJson(404, {'error': 'not found'})
+				return
+
+			try:
+				length = int(self.headers.get('Content-Length', 0))
+				self.sendJson(200, submit(json.loads(self.rfile.read(length) or b'null')))
+			except (BadJob, json.JSONDecodeError) as e:
+				self.sendJson(400, {'error': str(e)})
+			except Busy as e:
+				self.sendJson(503, {'error': str(e)})
+			except Exception as e:
+				logger.exception('do_POST()')
+				self.sendJson(500, {'error': '{0}: {1}'.format(type(e).__name__, e)})
+
+		def log_message(self, format, *args):
+			logger.debug('service: ' + format % args)
+
+
+	return Handler
+
+
+
+def makeServer(address=None, workers=None, queueSize=None):
+	"""
+	[Tuple] address (host, port), [Int] workers, [Int] queueSize (default
+		from the config file)
+		=> [ThreadingHTTPServer] server, call serve_forever() to run it
+	"""
+	address = getServiceAddress() if address == None else address
+	submit = makeSubmitter( getServiceWorkers() if workers == None else workers
+						  , getServiceQueueSize() if queueSize == None else queueSize)
+	return ThreadingHTTPServer(address, makeHandler(submit))
+
+
+
+def serve():
+	"""
+	Run the service until interrupted.
+	"""
+	server = makeServer()
+	logger.info('serve(): listening on {0}:{1}'.format(*server.server_address))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		logger.info('serve(): stopped')
+	finally:
+		server.server_close()
+
+
+
+def submitJob(file, portfolio, address=None, timeout=600):
+	"""
+	[String] file, [String] portfolio, [Tuple] address, [Float] timeout
+		=> ([Int] status, [Dictionary] response)
+
+	Post a job to the service and wait for the result.
+	"""
+	from urllib.request import Request, urlopen
+	from urllib.error import HTTPError
+	host, port = getServiceAddress() if address == None else address
+	request = Request( 'http://{0}:{1}/convert'.format(host, port)
+					 , data=json.dumps({'file': file, 'portfolio': portfolio}).encode()
+					 , headers={'Content-Type': 'application/json'})
+	try:
+		with urlopen(request, timeout=timeout) as response:
+			return (response.status, json.loads(response.read()))
+	except HTTPError as e:
+		return (e.code, json.loads(e.read()))
+
+
+
+
+if __name__ == '__main__':
+	import argparse, sys
+	parser = argparse.ArgumentParser(description='Submit a job to the CL trustee conversion service')
+	parser.add_argument('file', type=str, help='trade file, relative to the data directory')
+	parser.add_argument('portfolio', type=str)
+
+	args = parser.parse_args()
+	status, response = submitJob(args.file, args.portfolio)
+	print(json.dumps(response, indent=2))
+	sys.exit(0 if status == 200 else 1)
@@ -0,0 +1,67 @@
+# coding=utf-8
+
+"""
+The quick check run before main.py loads anything else.
+
+main.py is started by the scheduler for every portfolio every 10 minutes,
+and most of the time there is no trade file to convert. So before importing
+the Excel readers, toolz and the rest, main.py asks exitIfNoInput() whether
+there is anything to do, and exits at once if not. This module must stay
+light: only the standard library, utility.py and registry.py.
+"""
+from tradefile_11490.utility import getDataDirectory
+from tradefile_11490.registry import getPortfolios
+import logging, os, sys
+logger = logging.getLogger(__name__)
+
+
+
+"""
+	[String] fn => [String] portfolio, None if fn is not a trade file
+"""
+getPortfolioFromTradeFile = lambda fn: \
+	next(filter(lambda p: fn in [p+'_1.xls', p+'_1.xlsx', p+'_1.csv', p+'_1.tsv'], getPortfolios()), None)
+
+
+
+def hasInput(args, directory):
+	"""
+	[List] args (command line arguments), [String] directory
+		=> [Bool] whether main.py may have something to do
+
+	Only a plain conversion (main.py <portfolio> or main.py --all, maybe with
+	--async or --profile) without a trade file in the directory has nothing
+	to do, anything else is left to main.py.
+	"""
+	if any(map(lambda a: a.startswith('-') and not a in ['--all', '--async', '--profile'], args)):
+		return True		# --watch, --backfill, --help etc.
+
+	names = list(filter(lambda a: not a.startswith('-'), args))
+	wanted = getPortfolios() if '--all' in args else names
+	if len(names) > 1 or any(map(lambda p: not p in getPortfolios(), wanted)):
+		return True		# let main.py report the error
+
+	return any(map( lambda fn: getPortfolioFromTradeFile(fn) in wanted
+				  , os.listdir(directory)))
+
+
+
+def exitIfNoInput(args=None):
+	"""
+	[List] args (default is the command line arguments) => None
+
+	Side effect: exit the program if there is no trade file to convert.
+	"""
+	args = sys.argv[1:] if args == None else args
+	try:
+		directory = getDataDirectory()
+		if hasInput(args, directory):
+			return
+
+	except Exception:
+		return		# e.g., bad config, main.py reports it
+
+	import logging.config
+	logging.config.fileConfig('logging.config', disable_existing_loggers=False)
+	logger.debug('no input file found')
+	sys.exit(0)
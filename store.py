@@ -0,0 +1,267 @@
+# coding=utf-8
+
+"""
+Keep the accumulated trades in an embedded SQLite database as well, indexed
+by portfolio, trade date, ticker and ISIN, so that a question about the
+history does not mean scanning the accumulate trade files.
+
+Every line of an accumulate trade file is stored with its exact bytes, under
+the portfolio and the day (date of the accumulate trade file) it was added
+on, together with its fields for querying. The first time a portfolio is
+stored, the accumulate trade file the day is built on is imported as a whole
+under its own date. So the accumulate trade file of any day stored can be
+exported from the database, byte for byte the same as the one written by
+copying the previous file and appending the day's trades.
+"""
+from tradefile_11490.utility import getStoreFile, reformatDate
+from os.path import dirname
+import logging, sqlite3, csv, os, locale
+logger = logging.getLogger(__name__)
+
+
+
+schema = """
+CREATE TABLE IF NOT EXISTS trades
+	( portfolio TEXT NOT NULL
+	, day TEXT NOT NULL
+	, seq INTEGER NOT NULL
+	, fund TEXT
+	, ticker TEXT
+	, isin TEXT
+	, name TEXT
+	, quantity REAL
+	, buy_sell TEXT
+	, broker TEXT
+	, trade_date TEXT
+	, settlement_date TEXT
+	, price REAL
+	, line BLOB NOT NULL
+	, PRIMARY KEY (portfolio, day, seq)
+	);
+CREATE INDEX IF NOT EXISTS trades_trade_date ON trades (portfolio, trade_date);
+CREATE INDEX IF NOT EXISTS trades_ticker ON trades (portfolio, ticker);
+CREATE INDEX IF NOT EXISTS trades_isin ON trades (portfolio, isin);
+CREATE INDEX IF NOT EXISTS trades_broker ON trades (portfolio, broker);
+"""
+
+
+
+def connect():
+	"""
+	=> [Connection] to the database, the tables are created if necessary.
+	"""
+	os.makedirs(dirname(getStoreFile()), exist_ok=True)
+	conn = sqlite3.connect(getStoreFile())
+	conn.executescript(schema)
+	return conn
+
+
+
+def toFloat(s):
+	try:
+		return float(s)
+	except ValueError:
+		return None
+
+
+
+def toDate(s):
+	"""
+	[String] s => [String] date (yyyy-mm-dd), s itself if not a known format.
+	Old accumulate trade files have dates like 1/2/2015 (month first).
+	"""
+	try:
+		return reformatDate(s, '%Y-%m-%d', '%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y')
+	except ValueError:
+		return s
+
+
+
+def toRecord(portfolio, day, seq, line, isin):
+	"""
+	[String] portfolio, [String] day, [Int] seq, [Bytes] line, [String] isin
+		=> [Tuple] a row of the trades table
+
+	The fields follow the accumulate trade file headers: FundName, (empty),
+	Ticker & Exc, Shrt Name, Amount Pennies, BuySell, FACC Long Name,
+	As of Dt, Stl Date, Price. A line that is not a trade (the header, an
+	empty line) is kept with empty fields.
+	"""
+	values = next(csv.reader([line.decode(locale.getpreferredencoding(False), 'replace')]), [])
+	if len(values) < 10 or toFloat(values[4]) == None:
+		return (portfolio, day, seq) + (None,) * 10 + (line,)
+
+	return ( portfolio, day, seq, values[0], values[2], isin, values[3]
+		   , toFloat(values[4]), values[5], values[6], toDate(values[7])
+		   , toDate(values[8]), toFloat(values[9]), line
+		   )
+
+
+
+def hasPortfolio(portfolio):
+	"""
+	[String] portfolio => [Bool] whether the portfolio has been stored
+	"""
+	with connect() as conn:
+		return conn.execute( 'SELECT 1 FROM trades WHERE portfolio = ? LIMIT 1'
+						   , (portfolio,)).fetchone() != None
+
+
+
+def storeLines(portfolio, day, lines, isins=[], append=False):
+	"""
+	[String] portfolio, [String] day (yyyy-mm-dd), [List] lines (bytes)
+	[List] isins (of the lines, in order, if known)
+	[Bool] append
+		=> [Int] number of lines stored
+
+	Side effect: replace the lines of the day with these lines, or add them
+	after the lines of the day if append is True.
+	"""
+	isins = list(isins) + [None] * (len(lines) - len(isins))
+	with connect() as conn:
+		if append:
+			start = conn.execute( 'SELECT COALESCE(MAX(seq) + 1, 0) FROM trades WHERE portfolio = ? AND day = ?'
+								, (portfolio, day)).fetchone()[0]
+		else:
+			start = 0
+			conn.execute('DELETE FROM trades WHERE portfolio = ? AND day = ?', (portfolio, day))
+
+		conn.executemany(
+			'INSERT INTO trades VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)'
+		  , map( lambda t: toRecord(portfolio, day, t[0], t[1][0], t[1][1])
+		  	   , enumerate(zip(lines, isins), start))
+		)
+
+	return len(lines)
+
+
+
+def storeAccumulateFile(portfolio, date, file, baseSize, baseDate, isins):
+	"""
+	[String] portfolio
+	[String] date (yyyy-mm-dd)
+	[String] file (accumulate trade file just written)
+	[Int] baseSize (bytes at the beginning of the file from the previous file)
+	[String] baseDate (date of the previous file)
+	[List] isins (of the positions added on the day)
+		=> [Int] number of lines stored
+
+	Side effect: store the lines added on the day. If the portfolio is not
+	in the database yet, the previous file is imported first. Otherwise only
+	the day's lines are read from the file.
+	"""
+	with open(file, 'rb') as f:
+		if not hasPortfolio(portfolio):
+			logger.info('storeAccumulateFile(): import {0} history up to {1}'.format(portfolio, baseDate))
+			storeLines(portfolio, baseDate, f.read(baseSize).splitlines(keepends=True))
+		else:
+			f.seek(baseSize)	# the history is stored already, don't read it
+
+		return storeLines(portfolio, date, f.read().splitlines(keepends=True), isins)
+
+
+
+def importAccumulateFile(portfolio, date, file):
+	"""
+	[String] portfolio, [String] date (yyyy-mm-dd), [String] file
+		=> [Int] number of lines stored
+
+	Side effect: store the whole accumulate trade file under its date, e.g.,
+	to index the history of a portfolio that is not in the database yet.
+	"""
+	with open(file, 'rb') as f:
+		return storeLines(portfolio, date, f.read().splitlines(keepends=True))
+
+
+
+def getLastDay(portfolio):
+	"""
+	[String] portfolio => [String] the latest day stored, None if the
+		portfolio is not stored
+	"""
+	with connect() as conn:
+		return conn.execute( 'SELECT MAX(day) FROM trades WHERE portfolio = ?'
+						   , (portfolio,)).fetchone()[0]
+
+
+
+def syncAccumulateFile(portfolio, date, file):
+	"""
+	[String] portfolio, [String] date (yyyy-mm-dd), [String] file
+		=> [Int] number of lines stored
+
+	Side effect: bring the stored history up to the accumulate trade file of
+	the date, e.g., after daily runs with the store disabled.
+
+	If the file starts with the stored lines (checked by the last one), only
+	the lines after them are stored under the date. Otherwise the history of
+	the portfolio is imported again from the file.
+	"""
+	with connect() as conn:
+		size = conn.execute( 'SELECT COALESCE(SUM(LENGTH(line)), 0) FROM trades WHERE portfolio = ?'
+						   , (portfolio,)).fetchone()[0]
+		last = conn.execute( 'SELECT line FROM trades WHERE portfolio = ? ORDER BY day DESC, seq DESC LIMIT 1'
+						   , (portfolio,)).fetchone()
+
+	with open(file, 'rb') as f:
+		if last != None and size >= len(last[0]):
+			f.seek(size - len(last[0]))
+			if f.read(len(last[0])) == last[0]:
+				return storeLines(portfolio, date, f.read().splitlines(keepends=True), append=True)
+
+	logger.warning('syncAccumulateFile(): {0} does not extend the stored history, import again'.format(file))
+	with connect() as conn:
+		conn.execute('DELETE FROM trades WHERE portfolio = ?', (portfolio,))
+
+	return importAccumulateFile(portfolio, date, file)
+
+
+
+def getFirstDay(portfolio):
+	"""
+	[String] portfolio => [String] the earliest day stored, None if the
+		portfolio is not stored
+	"""
+	with connect() as conn:
+		return conn.execute( 'SELECT MIN(day) FROM trades WHERE portfolio = ?'
+						   , (portfolio,)).fetchone()[0]
+
+
+
+def exportAccumulateFile(portfolio, date, outputFile):
+	"""
+	[String] portfolio, [String] date (yyyy-mm-dd), [String] outputFile
+		=> [String] outputFile
+
+	Side effect: write the accumulate trade file of the date from the
+	database, i.e., all lines stored on or before the date.
+
+	Raise ValueError if no day on or before the date is stored, before the
+	output file is touched. The file is written to a temporary file first
+	and then replaced, so a failed export never leaves it half written.
+	"""
+	firstDay = getFirstDay(portfolio)
+	if firstDay == None or firstDay > date:
+		lognRaise('exportAccumulateFile(): nothing stored for {0} on or before {1}'.format(portfolio, date))
+
+	tempFile = outputFile + '.tmp'
+	try:
+		with connect() as conn, open(tempFile, 'wb') as f:
+			for (line,) in conn.execute( 'SELECT line FROM trades WHERE portfolio = ? AND day <= ? ORDER BY day, seq'
+									   , (portfolio, date)):
+				f.write(line)
+
+		os.replace(tempFile, outputFile)
+
+	finally:
+		if os.path.exists(tempFile):
+			os.remove(tempFile)
+
+	return outputFile
+
+
+
+def lognRaise(msg):
+	logger.error(msg)
+	raise ValueError(msg)
\ No newline at end of file
@@ -3,10 +3,29 @@
 
 import unittest2
 from os.path import join
+from tempfile import TemporaryDirectory
+from unittest.mock import patch, Mock
+from datetime import datetime
+from functools import partial
+import shutil, os, socketserver, threading, csv, time
 from utils.iter import firstOf
 from tradefile_11490.trade import getDatenPositions
-from tradefile_11490.utility import getCurrentDirectory
-from tradefile_11490.main import readDatenPositions, getNearestAccumulateFile
+from tradefile_11490.utility import getCurrentDirectory, excelOrdinalToString \
+									, reformatDate, getConfig, getStoreEnabled
+from tradefile_11490.main import readDatenPositions, getNearestAccumulateFile \
+								, writeAccumulateTradeFile, getAccumulateFileName \
+								, writeTradenAccumulateFiles, runAllConversions, runConversion
+from tradefile_11490.ledger import getSegments, materializeAccumulateFile
+from tradefile_11490.pipeline import runAllConversionsAsync
+from tradefile_11490.intraday import writeIntradayAccumulateFile
+from tradefile_11490 import notifier, store, query, migrate, service, profiler, watcher \
+							, metrics, manifest
+from tradefile_11490.benchmark import generateTradeFile, timeStartup, benchmarkSize
+from tradefile_11490.startup import hasInput
+from tradefile_11490.registry import getPortfolios, getSettings, getAfsToTradingFunds
+from tradefile_11490.validation import validatePositions, ValidationError
+from tradefile_11490.trade import Position, sourceColumns
+from tradefile_11490.reader import streamLines
 
 
 
@@ -24,6 +43,536 @@ class TestAllNew(unittest2.TestCase):
 		self.verifyPosition(positions[0])
 		self.verifyPosition2(positions[5])
 
+	def testLedgerAccumulateFile(self):
+		file = join(getCurrentDirectory(), 'samples', '11490_new.xlsx')
+		date, positions = readDatenPositions(file)
+		positions = list(positions)
+
+		with TemporaryDirectory() as copyDir, TemporaryDirectory() as ledgerDir:
+			for d in [copyDir, ledgerDir]:
+				shutil.copy(join(getCurrentDirectory(), 'samples', 'Equities_13052020.csv'), d)
+
+			writeAccumulateTradeFile(copyDir, '11490', date, positions)
+			with patch('tradefile_11490.main.getLedgerEnabled', return_value=True):
+				writeAccumulateTradeFile(ledgerDir, '11490', date, positions)
+
+			self.assertEqual(2, len(getSegments(ledgerDir, '11490')))
+			with open(getAccumulateFileName(copyDir, '11490', date), 'rb') as f1 \
+				, open(getAccumulateFileName(ledgerDir, '11490', date), 'rb') as f2:
+				self.assertEqual(f1.read(), f2.read())
+
+			# next day: the view is rolled forward, unless views are kept
+			readFile = lambda f: open(f, 'rb').read()
+			nextDate = '2021-07-12'
+			writeAccumulateTradeFile(copyDir, '11490', nextDate, positions[:2])
+			with patch('tradefile_11490.main.getLedgerEnabled', return_value=True):
+				writeAccumulateTradeFile(ledgerDir, '11490', nextDate, positions[:2])
+
+			self.assertFalse(os.path.exists(getAccumulateFileName(ledgerDir, '11490', date)))
+			for d in [date, nextDate]:
+				self.assertEqual( readFile(getAccumulateFileName(copyDir, '11490', d))
+								, readFile(materializeAccumulateFile( ledgerDir, '11490', d
+																	, join(ledgerDir, 'view.csv'))))
+
+			with patch('tradefile_11490.main.getLedgerEnabled', return_value=True) \
+				, patch('tradefile_11490.main.getLedgerKeep', return_value=True):
+				writeAccumulateTradeFile(ledgerDir, '11490', '2021-07-13', [])
+			self.assertTrue(os.path.exists(getAccumulateFileName(ledgerDir, '11490', nextDate)))
+
+	def testStoreAccumulateFile(self):
+		file = join(getCurrentDirectory(), 'samples', '11490_new.xlsx')
+		date, positions = readDatenPositions(file)
+		positions = list(positions)
+
+		with TemporaryDirectory() as outputDir \
+			, patch('tradefile_11490.main.getStoreEnabled', return_value=True) \
+			, patch('tradefile_11490.store.getStoreFile', return_value=join(outputDir, 'trades.sqlite')):
+			shutil.copy(join(getCurrentDirectory(), 'samples', 'Equities_13052020.csv'), outputDir)
+			outputFile = writeAccumulateTradeFile(outputDir, '11490', date, positions)
+
+			with store.connect() as conn:
+				self.assertEqual(len(positions), conn.execute(
+					'SELECT COUNT(*) FROM trades WHERE portfolio = ? AND day = ? AND isin IS NOT NULL'
+				  , ('11490', date)).fetchone()[0])
+
+			for d, f in [ (date, outputFile)
+						, ('2020-05-13', join(getCurrentDirectory(), 'samples', 'Equities_13052020.csv'))]:
+				exported = store.exportAccumulateFile('11490', d, join(outputDir, 'export.csv'))
+				with open(f, 'rb') as f1, open(exported, 'rb') as f2:
+					self.assertEqual(f1.read(), f2.read())
+
+			# nothing stored that early, the existing file is left alone
+			shutil.copy(join(getCurrentDirectory(), 'samples', 'Equities_12052020.csv'), outputDir)
+			existing = join(outputDir, 'Equities_12052020.csv')
+			size = os.path.getsize(existing)
+			for portfolio, d in [('11490', '2020-05-12'), ('11500', date)]:
+				with self.assertRaises(ValueError):
+					store.exportAccumulateFile(portfolio, d, existing)
+				self.assertEqual(size, os.path.getsize(existing))
+			self.assertFalse(os.path.exists(existing + '.tmp'))
+
+	def testQueryTrades(self):
+		with TemporaryDirectory() as outputDir \
+			, patch('tradefile_11490.store.getStoreFile', return_value=join(outputDir, 'trades.sqlite')):
+			shutil.copy(join(getCurrentDirectory(), 'samples', 'Equities_13052020.csv'), outputDir)
+			self.assertTrue(query.indexPortfolio(outputDir, '11490'))
+
+			with open(join(outputDir, 'Equities_13052020.csv'), 'rb') as f:
+				lines = f.read().splitlines(keepends=True)
+
+			result = list(query.queryTrades('11490', fromDate='2015-01-01', toDate='2015-01-31', broker='UBS SEC'))
+			self.assertEqual(lines[0], result[0])
+			self.assertTrue(len(result) > 1)
+			isMatch = lambda values: values[6] == 'UBS SEC' and values[7].startswith('1/') \
+										and values[7].endswith('/2015')
+			self.assertEqual( list(filter(lambda line: isMatch(line.decode().split(',')), lines[1:]))
+							, result[1:])
+
+			# a newer accumulate trade file written with the store disabled
+			newLine = b'CLT-CLI HK BR (CLASS A-HK) Trust Fund,,9 HK,NEW,100,Buy,UBS SEC,2015-01-05,2015-01-07,1\r\n'
+			with open(join(outputDir, 'Equities_14052020.csv'), 'wb') as f:
+				f.write(b''.join(lines) + newLine)
+
+			self.assertTrue(query.indexPortfolio(outputDir, '11490'))
+			self.assertEqual( '2020-05-14', store.getLastDay('11490'))
+			self.assertEqual( newLine
+							, list(query.queryTrades('11490', ticker='9 HK'))[-1])
+
+	def testIntradayAccumulateFile(self):
+		file = join(getCurrentDirectory(), 'samples', '11490_new.xlsx')
+		date, positions = readDatenPositions(file)
+		positions = list(positions)
+
+		with TemporaryDirectory() as fullDir, TemporaryDirectory() as intradayDir:
+			for d in [fullDir, intradayDir]:
+				shutil.copy(join(getCurrentDirectory(), 'samples', 'Equities_13052020.csv'), d)
+
+			writeAccumulateTradeFile(fullDir, '11490', date, positions)
+			writeIntradayAccumulateFile(intradayDir, '11490', date, positions[:2])
+			writeIntradayAccumulateFile(intradayDir, '11490', date, positions)
+			writeIntradayAccumulateFile(intradayDir, '11490', date, positions)	# nothing new
+
+			with open(getAccumulateFileName(fullDir, '11490', date), 'rb') as f1 \
+				, open(getAccumulateFileName(intradayDir, '11490', date), 'rb') as f2:
+				self.assertEqual(f1.read(), f2.read())
+
+		# the day's trade keys are kept with the duplicate check turned off
+		with TemporaryDirectory() as fullDir, TemporaryDirectory() as intradayDir \
+			, patch('tradefile_11490.main.getDedupeEnabled', return_value=False) \
+			, patch('tradefile_11490.intraday.getDedupeEnabled', return_value=False) \
+			, patch('tradefile_11490.main.getIntradayEnabled', return_value=True):
+			for d in [fullDir, intradayDir]:
+				shutil.copy(join(getCurrentDirectory(), 'samples', 'Equities_13052020.csv'), d)
+
+			writeAccumulateTradeFile(fullDir, '11490', date, positions + positions[:1])
+			writeIntradayAccumulateFile(intradayDir, '11490', date, positions[:1])
+			writeIntradayAccumulateFile(intradayDir, '11490', date, positions)
+			writeIntradayAccumulateFile(intradayDir, '11490', date, positions + positions[:1])
+
+			with open(getAccumulateFileName(fullDir, '11490', date), 'rb') as f1 \
+				, open(getAccumulateFileName(intradayDir, '11490', date), 'rb') as f2:
+				self.assertEqual(f1.read(), f2.read())
+
+	def testDuplicateTradesSkipped(self):
+		file = join(getCurrentDirectory(), 'samples', '11490_new.xlsx')
+		date, positions = readDatenPositions(file)
+		positions = list(positions)
+
+		with TemporaryDirectory() as outputDir:
+			shutil.copy(join(getCurrentDirectory(), 'samples', 'Equities_13052020.csv'), outputDir)
+			outputFile = writeAccumulateTradeFile(outputDir, '11490', date, positions)
+			with open(outputFile, 'rb') as f:
+				content = f.read()
+
+			# converting the day again gives the same file
+			writeAccumulateTradeFile(outputDir, '11490', date, positions)
+			with open(outputFile, 'rb') as f:
+				self.assertEqual(content, f.read())
+
+			# the same trades on the next day are all skipped
+			nextFile = writeAccumulateTradeFile(outputDir, '11490', '2021-07-12', positions)
+			with open(nextFile, 'rb') as f:
+				self.assertEqual(content + os.linesep.encode(), f.read())
+
+	def testBackfill(self):
+		from tradefile_11490.backfill import backfill
+		with TemporaryDirectory() as d1, TemporaryDirectory() as d2:
+			for d in [d1, d2]:
+				shutil.copy(join(getCurrentDirectory(), 'samples', 'Equities_13052020.csv'), d)
+				generateTradeFile(join(d, '11490_08.xlsx'), '2021-07-08', 20, 1)
+				generateTradeFile(join(d, '11490_09.xlsx'), '2021-07-09', 20, 2)
+
+			# one by one, as the daily runs would do
+			for fn in ['11490_08.xlsx', '11490_09.xlsx']:
+				writeTradenAccumulateFiles(fn, '11490', d1)
+
+			results = backfill( [join(d2, '11490_09.xlsx'), join(d2, '11490_08.xlsx')]
+							  , '11490', d2, 1)
+			self.assertEqual(['2021-07-08', '2021-07-09'], list(map(lambda t: t[0], results)))
+			for fn in ['Equities_08072021.csv', 'Equities_09072021.csv']:
+				with open(join(d1, fn), 'rb') as f1, open(join(d2, fn), 'rb') as f2:
+					self.assertEqual(f1.read(), f2.read())
+
+			# running the backfill again adds no duplicates
+			backfill([join(d2, '11490_09.xlsx')], '11490', d2, 1)
+			with open(join(d1, 'Equities_09072021.csv'), 'rb') as f1 \
+				, open(join(d2, 'Equities_09072021.csv'), 'rb') as f2:
+				self.assertEqual(f1.read(), f2.read())
+
+	def testMigrateFile(self):
+		from openpyxl import Workbook
+		with TemporaryDirectory() as directory:
+			file = join(directory, 'Equities_01022015.xlsx')
+			wb = Workbook()
+			wb.active.append([ 'FUND', '', 'Security Code', 'Name of Security', 'Quantity (Share)'
+							 , 'Buy/Sell', 'Broker', 'Trade Date', 'Settlement Date', 'Avg. Dealing Price'])
+			wb.active.append([ 'CLT-CLI HK BR (CLASS A-HK) Trust Fund', '', '579', 'BEIJING JINGNENG'
+							 , 4000000, 'Sell', 'UBS SEC', datetime(2015, 1, 2), '1/6/2015', 3.3095])
+			wb.save(file)
+
+			result = migrate.migrateFile(file)
+			self.assertEqual('', result['errors'])
+			self.assertEqual(1, result['rows'])
+			with open(result['output']) as f:
+				self.assertEqual(['2015-01-02', '2015-01-06'], f.read().split('\n')[1].split(',')[7:9])
+
+			wb.active.append(['', '', '5', 'HSBC', 100, 'Buy', 'UBS SEC', '31/31/2015', '1/6/2015', 38.5])
+			wb.save(file)
+			os.remove(result['output'])
+			result = migrate.migrateFile(file)
+			self.assertTrue(result['errors'].startswith('row 3: Trade Date'))
+			self.assertFalse(os.path.exists(join(directory, 'Equities_01022015.csv')))
+
+	def testStartupIsLight(self):
+		with TemporaryDirectory() as directory:
+			seconds, loaded = timeStartup(directory, 1)
+			self.assertEqual([], loaded)
+
+			self.assertFalse(hasInput(['11490'], directory))
+			self.assertTrue(hasInput(['--watch'], directory))
+			shutil.copy(join(getCurrentDirectory(), 'samples', '11490_1.xlsx'), directory)
+			self.assertTrue(hasInput(['--all'], directory))
+			self.assertFalse(hasInput(['11500'], directory))
+
+	def testService(self):
+		with TemporaryDirectory() as directory:
+			shutil.copy(join(getCurrentDirectory(), 'samples', 'Equities_13052020.csv'), directory)
+			shutil.copy(join(getCurrentDirectory(), 'samples', '11490_new.xlsx'), join(directory, '11490_1.xlsx'))
+			server = service.makeServer(('127.0.0.1', 0), 1, 0)
+			t = threading.Thread(target=server.serve_forever)
+			t.start()
+			try:
+				with patch('tradefile_11490.service.getDataDirectory', return_value=directory):
+					status, response = service.submitJob('11490_1.xlsx', '11490', server.server_address)
+					self.assertEqual(200, status)
+					self.assertEqual( getAccumulateFileName(directory, '11490', '2021-07-09')
+									, response['accumulateFile'])
+					self.assertTrue(os.path.exists(response['trusteeFile']))
+
+					status, response = service.submitJob('11490_1.xlsx', '99999', server.server_address)
+					self.assertEqual(400, status)
+			finally:
+				server.shutdown()
+				server.server_close()
+				t.join()
+
+	def testRegistry(self):
+		self.assertEqual(('11490', '11500', '13006'), getPortfolios())
+		self.assertEqual( join('out', 'Equities_A-MC-P_09072021.csv')
+						, getAccumulateFileName('out', '13006', '2021-07-09'))
+		self.assertEqual('Order Record of A-HK Equity_BOC ', getSettings('11500')['trusteePrefix'])
+		self.assertEqual(frozenset(['11490-B']), getAfsToTradingFunds())
+
+	def testRunAllConversionsAsync(self):
+		with TemporaryDirectory() as directory \
+			, patch('tradefile_11490.pipeline.sendNotification') as sendNotification:
+			os.mkdir(join(directory, 'processed files'))
+			shutil.copy(join(getCurrentDirectory(), 'samples', 'Equities_13052020.csv'), directory)
+			shutil.copy( join(getCurrentDirectory(), 'samples', 'Equities_13052020.csv')
+					   , join(directory, 'Equities_A-MC-P_13052020.csv'))
+			generateTradeFile(join(directory, '11490_1.xlsx'), '2021-07-09', 20)
+			generateTradeFile(join(directory, '13006_1.xlsx'), '2021-07-09', 20)
+
+			results = runAllConversionsAsync(directory)
+			self.assertEqual({'11490': True, '13006': True}, results)
+			self.assertEqual(2, len(os.listdir(join(directory, 'processed files'))))
+			self.assertTrue(os.path.exists(join(directory, 'Equities_A-MC-P_09072021.csv')))
+			self.assertEqual(2, sendNotification.call_count)
+
+	def testCsvTradeFile(self):
+		# same report exported as csv, with the dates as text
+		def convert(directory, sample, inputFile):
+			shutil.copy(join(getCurrentDirectory(), 'samples', 'Equities_13052020.csv'), directory)
+			shutil.copy(join(getCurrentDirectory(), 'samples', sample), join(directory, inputFile))
+			return list(map( lambda f: open(f, 'rb').read()
+						   , writeTradenAccumulateFiles(inputFile, '11490', directory)))
+
+		with TemporaryDirectory() as d1, TemporaryDirectory() as d2:
+			self.assertEqual( convert(d1, '11490_new.xlsx', '11490_1.xlsx')
+							, convert(d2, '11490_new.csv', '11490_1.csv'))
+
+			# only the number columns become numbers, iso dates are accepted
+			with open(join(getCurrentDirectory(), 'samples', '11490_new.csv')) as f:
+				lines = f.read().splitlines()
+			lines[3] = lines[3].replace('MU US', '0700').replace('08/07/2021', '2021-07-08')
+			with open(join(d2, '11490_2.csv'), 'w') as f:
+				f.write('\n'.join(lines))
+
+			date, positions = readDatenPositions(join(d2, '11490_2.csv'))
+			p = next(positions)
+			self.assertEqual('0700', p['Ticker & Exc'])
+			self.assertEqual('2021-07-08', p['As of Dt'])
+			self.assertEqual(4161.0, p['Amount Pennies'])
+
+	def testRunAllConversions(self):
+		with TemporaryDirectory() as d1, TemporaryDirectory() as d2 \
+			, patch('tradefile_11490.main.sendNotification') as notify:
+			for d in [d1, d2]:
+				shutil.copy(join(getCurrentDirectory(), 'samples', 'Equities_13052020.csv'), d)
+				shutil.copy( join(getCurrentDirectory(), 'samples', '11490_new.xlsx')
+						   , join(d, '11490_1.xlsx'))
+
+			os.mkdir(join(d2, 'processed files'))
+			for fn in ['11500_1.xlsx', '11500_2.xlsx']:	# more than one file, fails
+				shutil.copy(join(getCurrentDirectory(), 'samples', '11500_1.xlsx'), join(d2, fn))
+
+			writeTradenAccumulateFiles('11490_1.xlsx', '11490', d1)
+			self.assertEqual({'11490': True, '11500': False}, runAllConversions(d2))
+			self.assertEqual( ['Successfully performed CL trustee 11490 trade conversion'
+							  , 'Error occurred in performing CL trustee 11500 trade conversion']
+							, sorted(map(lambda c: c[0][0], notify.call_args_list), reverse=True))
+
+			self.assertEqual(1, len(os.listdir(join(d2, 'processed files'))))
+			self.assertFalse(os.path.exists(join(d2, '11490_1.xlsx')))
+			self.assertTrue(os.path.exists(join(d2, '11500_1.xlsx')))
+			for fn in ['Equities_09072021.csv', 'Order Record of A-HK Equity 210709.csv']:
+				with open(join(d1, fn), 'rb') as f1, open(join(d2, fn), 'rb') as f2:
+					self.assertEqual(f1.read(), f2.read())
+
+	def testStableFiles(self):
+		sample = join(getCurrentDirectory(), 'samples', '11490_new.xlsx')
+		clock, timeouts = [0.0], []
+
+		def wait(timeout):
+			clock[0] = clock[0] + timeout
+			timeouts.append(timeout)
+			if len(timeouts) in actions:
+				actions[len(timeouts)]()
+			if len(timeouts) > 20:
+				raise AssertionError('no file settled')
+
+		def write(content, mode='wb'):
+			with open(join(directory, '11490_1.xlsx'), mode) as f:
+				f.write(content)
+
+		with TemporaryDirectory() as directory, patch('tradefile_11490.watcher.time') as t:
+			t.monotonic = lambda: clock[0]
+			with open(sample, 'rb') as f:
+				content = f.read()
+
+			# a half written xlsx, still growing, then stopped but not a
+			# complete zip archive, then complete
+			write(content[:100])
+			actions = { 3: lambda: write(content[100:200], 'ab')
+					  , 6: lambda: write(content)
+					  , 10: lambda: shutil.copy(join(getCurrentDirectory(), 'samples', '11490_1.xlsx')
+					  						   , join(directory, '11490_1.xlsx'))
+					  }
+			files = watcher.stableFiles( directory, lambda fn: fn.endswith('.xlsx')
+									   , 2, 5, wait)
+			self.assertEqual('11490_1.xlsx', next(files))
+			self.assertEqual(14, clock[0])	# settled 2 seconds after complete
+
+			# not yielded again until it changes
+			self.assertEqual('11490_1.xlsx', next(files))
+			self.assertEqual([2]*7 + [5]*3 + [2], timeouts)
+
+		class Stop(Exception):
+			pass
+
+		with TemporaryDirectory() as directory, patch('tradefile_11490.watcher.time') as t \
+			, patch('tradefile_11490.watcher.pollWaiter', wait):
+			t.monotonic = lambda: clock[0]
+			shutil.copy(sample, join(directory, '11490_1.xlsx'))
+			shutil.copy(sample, join(directory, 'other.xlsx'))
+			timeouts.clear()
+			actions = {}
+			convert = Mock(side_effect=Stop)
+			with self.assertRaises(Stop):
+				watcher.watch( directory, lambda fn: '11490' if fn.startswith('11490') else None
+							 , convert, 2, 5, 'poll')
+			convert.assert_called_once_with('11490_1.xlsx', '11490')
+
+		with patch('tradefile_11490.watcher.sys.platform', 'win32'):
+			self.assertEqual(None, watcher.getInotifyWaiter(getCurrentDirectory()))
+
+	def testMetrics(self):
+		with TemporaryDirectory() as directory \
+			, patch('tradefile_11490.metrics.getMetricsEnabled', return_value=True) \
+			, patch('tradefile_11490.metrics.getMetricsDirectory', return_value=directory):
+			metrics.startRun('11490')
+			with metrics.stage('move'):
+				pass
+			self.assertEqual([0, 1, 2], list(metrics.timedIterator('read', range(3))))
+			metrics.add('read', 'bytesRead', 100)
+			run = metrics.endRun(True)
+
+			self.assertEqual(3, run['stages']['read']['rows'])
+			self.assertEqual(100, run['stages']['read']['bytesRead'])
+			self.assertEqual(None, run['stages']['read']['peakMemory'])	# not tracing
+			with open(join(directory, 'tradefile_11490.prom')) as f:
+				text = f.read()
+			self.assertTrue('tradefile_stage_rows{portfolio="11490",stage="read"} 3\n' in text)
+			self.assertTrue('tradefile_stage_bytes_read{portfolio="11490",stage="read"} 100\n' in text)
+			self.assertTrue('tradefile_last_run_success{portfolio="11490"} 1\n' in text)
+			self.assertFalse('tradefile_stage_peak_memory_bytes{' in text)
+
+			# traced while profiling, each stage has its own peak, and the
+			# profile still has the peak of the whole run
+			with patch('tradefile_11490.profiler.writeProfile') as writeProfile:
+				with profiler.profiled('11490', True):
+					metrics.startRun('11490')
+					with metrics.stage('transform'):
+						big = bytearray(10000000)
+						del big
+						with metrics.stage('read'):
+							small = bytearray(1000)
+							del small
+					with metrics.stage('write trustee'):
+						pass
+					run = metrics.endRun(False)
+
+				self.assertTrue(writeProfile.call_args[0][3] >= 10000000)
+
+			self.assertTrue(run['stages']['transform']['peakMemory'] >= 10000000)
+			self.assertTrue(run['stages']['read']['peakMemory'] < 10000000)
+			self.assertTrue(run['stages']['write trustee']['peakMemory'] < 10000000)
+			self.assertEqual(None, run['stages']['move']['peakMemory'])
+			with open(join(directory, 'tradefile_11490.prom')) as f:
+				text = f.read()
+			self.assertTrue('tradefile_stage_peak_memory_bytes{portfolio="11490",stage="transform"}' in text)
+			self.assertTrue('tradefile_last_run_success{portfolio="11490"} 0\n' in text)
+
+	def testProfiled(self):
+		with TemporaryDirectory() as directory, TemporaryDirectory() as profiles \
+			, patch('tradefile_11490.profiler.getProfileDirectory', lambda: profiles):
+			shutil.copy(join(getCurrentDirectory(), 'samples', 'Equities_13052020.csv'), directory)
+			shutil.copy( join(getCurrentDirectory(), 'samples', '11490_new.xlsx')
+					   , join(directory, '11490_1.xlsx'))
+			with profiler.profiled('11490', True):
+				writeTradenAccumulateFiles('11490_1.xlsx', '11490', directory)
+
+			files = sorted(os.listdir(profiles))
+			self.assertEqual(2, len(files))
+			with open(join(profiles, files[1])) as f:
+				report = f.read()
+			self.assertTrue('writeTradenAccumulateFiles' in report)
+			self.assertTrue('peak traced memory' in report)
+
+			# older profiles are deleted
+			for stem in ['11490_20210101_000000', '11490_20210102_000000']:
+				open(join(profiles, stem + '.txt'), 'w').close()
+			self.assertEqual( ['11490_20210101_000000.txt']
+							, profiler.rotateProfiles(profiles, 2))
+
+	def testValidatePositions(self):
+		date, positions = readDatenPositions(join(getCurrentDirectory(), 'samples', '11490_new.xlsx'))
+		positions = list(positions)
+		layout = positions[0].layout
+		badLines = [ list(positions[0].line), list(positions[1].line)]
+		badLines[0][layout['Buy/Sell']] = 'X'
+		badLines[0][layout['Firm Account Long Name']] = ''
+		badLines[1][layout['Settlement Total in Settlemen']] = 100.0
+
+		with TemporaryDirectory() as outputDir:
+			self.assertEqual(6, len(validatePositions(outputDir, '11490', date, positions)))
+			with self.assertRaises(ValidationError) as context:
+				validatePositions( outputDir, '11490', date
+								 , positions + list(map(partial(Position, layout), badLines)))
+
+			self.assertEqual( [ (7, 'Firm Account Long Name'), (7, 'Buy/Sell')
+							  , (8, 'Settlement Total in Settlemen')]
+							, list(map(lambda e: (e[0], e[3]), context.exception.errors)))
+			self.assertTrue(os.path.exists(join(outputDir, 'validation', '11490_20210709.csv')))
+
+	def testProjectedPositions(self):
+		date, positions = readDatenPositions(join(getCurrentDirectory(), 'samples', '11490_new.xlsx'))
+		positions = list(positions)
+
+		# an extra column, not kept, and the columns in another order
+		lines = [ ['China Life Franklin ', ''], ['11490_Fundcode (THRS #22) ON 09/07/21', '']
+				, sourceColumns[:1] + list(reversed(sourceColumns[1:])) + ['Extra', '', 'Ignored']
+				] \
+			  + list(map( lambda p: list(p.line[:1]) + list(reversed(p.line[1:])) + ['x', '', 'y']
+						, positions))
+		date2, positions2 = getDatenPositions(iter(lines))
+		positions2 = list(positions2)
+		self.assertEqual(date, date2)
+		self.assertEqual(len(sourceColumns), len(positions2[0].line))
+		self.verifyPosition(positions2[0])
+		self.verifyPosition2(positions2[5])
+
+		with self.assertRaises(ValueError) as context:
+			getDatenPositions(iter(map( lambda line: list(filter(lambda x: x != 'Yield', line))
+									  , lines[:3])))
+		self.assertTrue('Yield' in str(context.exception))
+
+		# the reader keeps only the source columns
+		lines3 = list(streamLines( join(getCurrentDirectory(), 'samples', '11490_new.xlsx')
+								 , columns=sourceColumns))
+		header = firstOf(lambda line: len(line) > 0 and line[0] == 'Trader Name', lines3)
+		self.assertEqual(sourceColumns, header)
+		self.assertEqual( list(map(lambda p: list(p.line), positions))
+						, lines3[lines3.index(header)+1:lines3.index(header)+7])
+
+		with TemporaryDirectory() as outputDir:
+			file = join(outputDir, 'trade.csv')
+			with open(file, 'w', newline='') as f:
+				csv.writer(f).writerows(map( lambda line: list(filter(lambda x: x != 'Yield', line))
+										   , lines[:3]))
+			with self.assertRaises(ValueError) as context:
+				list(streamLines(file, columns=sourceColumns))
+			self.assertTrue('Yield' in str(context.exception))
+
+	def testGetNearestAccumulateFile(self):
+		with TemporaryDirectory() as outputDir:
+			for fn in [ 'Equities_12052020.csv', 'Equities_13052020.csv'
+					  , 'Equities_BOC_14052020.csv', 'Equities_BOC_18052020.csv']:
+				shutil.copy(join(getCurrentDirectory(), 'samples', fn), outputDir)
+
+			self.assertEqual( join(outputDir, 'Equities_13052020.csv')
+							, getNearestAccumulateFile(outputDir, '11490', '2020-05-15'))
+			self.assertEqual( join(outputDir, 'Equities_BOC_14052020.csv')
+							, getNearestAccumulateFile(outputDir, '11500', '2020-05-18'))
+
+			# a file added later is found
+			with TemporaryDirectory() as outputDir2:
+				shutil.copy(join(outputDir, 'Equities_12052020.csv'), outputDir2)
+				self.assertEqual( join(outputDir2, 'Equities_12052020.csv')
+								, getNearestAccumulateFile(outputDir2, '11490', '2020-05-15'))
+				shutil.copy(join(outputDir, 'Equities_13052020.csv'), outputDir2)
+				self.assertEqual( join(outputDir2, 'Equities_13052020.csv')
+								, getNearestAccumulateFile(outputDir2, '11490', '2020-05-15'))
+
+			# daily runs do not rebuild it, though they change the directory
+			with TemporaryDirectory() as outputDir2 \
+				, patch('tradefile_11490.main.sendNotification') \
+				, patch('tradefile_11490.manifest.buildManifest', wraps=manifest.buildManifest) as build:
+				shutil.copy(join(outputDir, 'Equities_13052020.csv'), outputDir2)
+				os.mkdir(join(outputDir2, 'processed files'))
+				for n, d in enumerate(['2021-07-07', '2021-07-08', '2021-07-09']):
+					generateTradeFile(join(outputDir2, '11490_1.xlsx'), d, 10, n)
+					self.assertTrue(runConversion('11490_1.xlsx', '11490', outputDir2))
+
+				self.assertEqual(1, build.call_count)	# no manifest yet on the first run
+
+			# out of sync with the directory, manifest rebuilt
+			shutil.copy( join(outputDir, 'Equities_13052020.csv')
+					   , join(outputDir, 'Equities_14052020.csv'))
+			os.remove(join(outputDir, 'Equities_13052020.csv'))
+			self.assertEqual( join(outputDir, 'Equities_14052020.csv')
+							, getNearestAccumulateFile(outputDir, '11490', '2020-05-15'))
+
 	# def testGetDatenPositions2(self):
 	# 	file = join(getCurrentDirectory(), 'samples', '11500_1.xlsx')
 	# 	date, positions = readDatenPositions(file)
@@ -43,6 +592,115 @@ class TestAllNew(unittest2.TestCase):
 	# 					, getNearestAccumulateFile(outputDir, '11500', '2020-05-18'))
 	# # End of testGetNearestAccumulateFile
 
+	def testDateConversions(self):
+		self.assertEqual( ['2021-07-08', '2021-07-12', '2021-07-08']
+						, list(map(excelOrdinalToString, [44385.0, 44389.0, 44385.0])))
+		self.assertEqual( ['2020-05-13', '2020-05-13', '2020-05-31']
+						, list(map( lambda s: reformatDate(s, '%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y')
+								  , ['05/13/2020', '13/05/2020', '31/05/2020'])))
+		with self.assertRaises(ValueError):
+			reformatDate('2020-13-05', '%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y')
+
+	def testCachedDatenPositions(self):
+		file = join(getCurrentDirectory(), 'samples', '11490_new.xlsx')
+		with TemporaryDirectory() as cacheDir \
+			, patch('tradefile_11490.main.getCacheEnabled', return_value=True) \
+			, patch('tradefile_11490.cache.getCacheDirectory', return_value=cacheDir):
+			date, positions = readDatenPositions(file)
+			self.assertEqual(6, len(list(positions)))
+			self.assertEqual(1, len(os.listdir(cacheDir)))
+
+			with patch('tradefile_11490.main.parseDatenPositions') as parse:
+				date, positions = readDatenPositions(file)
+				positions = list(positions)
+				parse.assert_not_called()
+
+			self.assertEqual('2021-07-09', date)
+			self.assertEqual(6, len(positions))
+			self.verifyPosition(positions[0])
+			self.verifyPosition2(positions[5])
+
+	def testGenerateTradeFile(self):
+		with TemporaryDirectory() as d:
+			date, positions = readDatenPositions(generateTradeFile(join(d, '11490_1.xlsx'), '2021-07-09', 10))
+			positions = list(positions)
+			self.assertEqual('2021-07-09', date)
+			self.assertEqual(10, len(positions))
+			self.assertEqual(['11490-B', '11490-D', '11500', '13006'], list(map(lambda p: p['Fund'], positions[0:4])))
+			self.assertEqual('2021-07-09', positions[0]['As of Dt'])
+			self.assertEqual('2021-07-11', positions[0]['Stl Date'])
+
+	def testBenchmarkSize(self):
+		config = getConfig()
+		saved = config['store']['enabled'], config['cache']['enabled']
+		with TemporaryDirectory() as d \
+			, patch('tradefile_11490.store.getStoreFile', return_value=join(d, 'trades.sqlite')) \
+			, patch('tradefile_11490.cache.getCacheDirectory', return_value=join(d, 'cache')):
+			config['store']['enabled'] = config['cache']['enabled'] = 'true'
+			try:
+				os.mkdir(join(d, 'work'))
+				results = benchmarkSize(join(d, 'work'), 10, 3, 2)
+				self.assertEqual( ['parse', 'transform', 'write trustee', 'write accumulate', 'nearest lookup']
+								, list(map(lambda r: r['stage'], results)))
+
+				# the features are off while timing, back on afterwards
+				self.assertFalse(os.path.exists(join(d, 'trades.sqlite')))
+				self.assertFalse(os.path.exists(join(d, 'cache')))
+				self.assertTrue(getStoreEnabled())
+			finally:
+				config['store']['enabled'], config['cache']['enabled'] = saved
+
+	def testNotifier(self):
+		received, connections = [], []
+		server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), getSmtpHandler(received, connections))
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+
+		with TemporaryDirectory() as spoolDir:
+			with patch.multiple( 'tradefile_11490.notifier'
+							   , getMailServer=lambda: '127.0.0.1:{0}'.format(server.server_address[1])
+							   , getNotificationSpool=lambda: spoolDir
+							   , getNotificationBackoff=lambda: 0):
+				notifier.notify('11490 done')
+				notifier.notify('11500 done')
+				self.assertTrue(notifier.flush(10))
+				notifier.closeConnection()
+				server.shutdown()
+				server.server_close()
+
+				# server down, message goes to the spool
+				notifier.notify('13006 done')
+				self.assertTrue(notifier.flush(10))
+				self.assertEqual(1, len(notifier.getSpooledFiles()))
+
+		self.assertEqual(2, len(received))
+		self.assertTrue('Subject: 11500 done' in received[1])
+		self.assertEqual(1, len(connections))	# connection reused
+
+	def testNotifierRelayDown(self):
+		# a relay that accepts connections but never answers
+		server = socketserver.TCPServer(('127.0.0.1', 0), socketserver.BaseRequestHandler)
+		with TemporaryDirectory() as spoolDir:
+			with patch.multiple( 'tradefile_11490.notifier'
+							   , getMailServer=lambda: '127.0.0.1:{0}'.format(server.server_address[1])
+							   , getNotificationSpool=lambda: spoolDir
+							   , getMailTimeout=lambda: 0.2
+							   , getNotificationRetries=lambda: 2
+							   , getNotificationBackoff=lambda: 0.3):
+				notifier.notify('11490 done')
+				start = time.monotonic()
+				notifier._flushAtExit()
+				self.assertTrue(time.monotonic() - start < 1)	# not all the retries
+				self.assertEqual(1, len(notifier.getSpooledFiles()))
+
+				# a spooled message already sent by another process
+				self.assertTrue(notifier.flush(10))
+				with patch('tradefile_11490.notifier.getConnection') as getConnection:
+					self.assertTrue(notifier.deliver( notifier.toMessage('11500 done')
+													, join(spoolDir, 'gone.eml')))
+					self.assertEqual(1, getConnection.return_value.send_message.call_count)
+
+		server.server_close()
+
 	def verifyPosition(self, p):
 		self.assertEqual('11490-D', p['Fund'])
 		self.assertEqual('MU US', p['Ticker & Exc'])
@@ -65,4 +723,34 @@ class TestAllNew(unittest2.TestCase):
 		self.assertEqual(4467, p['Amount Pennies'])
 		self.assertAlmostEqual(76.8836, p['Price'])
 		self.assertAlmostEqual(343303.27, p['Settle Amount'])
-		self.assertEqual('Trading', p['L1 Tag Nm'])
\ No newline at end of file
+		self.assertEqual('Trading', p['L1 Tag Nm'])
+
+
+
+def getSmtpHandler(received, connections):
+	"""
+	A local stand-in SMTP server, just enough for smtplib to send messages.
+	"""
+	class SmtpHandler(socketserver.StreamRequestHandler):
+		def handle(self):
+			connections.append(self.client_address)
+			reply = lambda s: self.wfile.write((s + '\r\n').encode())
+			reply('220 localhost')
+			for line in self.rfile:
+				command = line.decode().strip().upper()
+				if command.startswith('DATA'):
+					reply('354 go ahead')
+					data = []
+					for line in self.rfile:
+						if line.strip() == b'.':
+							break
+						data.append(line.decode())
+					received.append(''.join(data))
+					reply('250 ok')
+				elif command.startswith('QUIT'):
+					reply('221 bye')
+					return
+				else:
+					reply('250 ok')
+
+	return SmtpHandler
\ No newline at end of file
@@ -4,13 +4,13 @@
 Read a Bloomberg AIM trade file, get its date and all the positions (trades).
 
 """
-from clamc_datafeed.feeder import mergeDictionary
 from utils.iter import firstOf, pop
-from utils.utility import fromExcelOrdinal
+from tradefile_11490.utility import excelOrdinalToString, reformatDate
+from tradefile_11490.registry import getFundNames, getAfsToTradingFunds, getPortfolioFromFund
 from toolz.functoolz import compose
 from functools import partial
 from itertools import takewhile
-from datetime import datetime
+from operator import itemgetter
 import logging
 logger = logging.getLogger(__name__)
 
@@ -27,7 +27,7 @@ def getDatenPositions(lines):
 	logger.debug('getDatenPositions(): start')
 
 	return ( getDateFromLines(lines)
-		   , map(updatePosition, getPositionsFromLines(lines))
+		   , getPositionsFromLines(lines)
 		   )
 
 
@@ -41,8 +41,7 @@ def getDateFromLines(lines):
 	pop(lines)	# skip the first line
 
 	return compose(
-		lambda s: datetime.strftime( datetime.strptime(s, '%d/%m/%y')
-								   , '%Y-%m-%d')
+		lambda s: reformatDate(s, '%Y-%m-%d', '%d/%m/%y')
 	  , lambda line: line[0].split()[-1]
 	  , pop
 	)(lines)
@@ -52,6 +51,9 @@ def getDateFromLines(lines):
 def getPositionsFromLines(lines):
 	"""
 	[Iterator] lines => [Iterator] positions
+
+	Only the source columns are taken from each line (see getProjection()),
+	a missing one fails here, at the header line.
 	"""
 	getHeaderLine = lambda lines: \
 		firstOf(lambda line: len(line) > 0 and line[0] == 'Trader Name', lines)
@@ -63,12 +65,9 @@ def getPositionsFromLines(lines):
 	)
 
 
-	toPosition = lambda headers, line: \
-		dict(zip(headers, line))
-
-
 	return compose(
-		lambda t: map(partial(toPosition, getHeaderFromLine(t[0])), t[1])
+		lambda t: map(partial(Position, t[0][0]), map(t[0][1], t[1]))
+	  , lambda t: (getProjection(getHeaderFromLine(t[0])), t[1])
 	  , lambda t: lognRaise('getPositionsFromLines(): failed to get header line') \
 	  				if t[0] == None else t
 	  , lambda lines: (getHeaderLine(lines), lines)
@@ -76,42 +75,165 @@ def getPositionsFromLines(lines):
 
 
 
+"""
+	The columns of the trade file read by the output files, either through
+	derivedFields or directly (Yield).
+"""
+sourceColumns = \
+	[ 'Trader Name', 'Ticker and Exchange Code', 'ISIN Number', 'Short Name'
+	, 'Buy/Sell', 'Yield', 'As of Date', 'Settlement Date', 'Amount (Pennies)'
+	, 'Trade price', 'Transaction Cost 1 Amount', 'Transaction Cost 2 Amount'
+	, 'Transaction Cost 3 Amount', 'Transaction Cost 4 Amount'
+	, 'Transaction Cost 5 Amount', 'Currency', 'Firm Account Long Name'
+	, 'Accrued Interest', 'Settlement Total in Settlemen', 'Level 1 Tag Name'
+	]
+
+
+
+"""
+	The source columns holding numbers
+"""
+numberColumns = \
+	[ 'Yield', 'Amount (Pennies)', 'Trade price', 'Transaction Cost 1 Amount'
+	, 'Transaction Cost 2 Amount', 'Transaction Cost 3 Amount'
+	, 'Transaction Cost 4 Amount', 'Transaction Cost 5 Amount'
+	, 'Accrued Interest', 'Settlement Total in Settlemen'
+	]
+
+
+
+def getProjection(headers):
+	"""
+	[List] headers => ( [Dictionary] layout (source column => index in a
+							projected line)
+					  , [Function] ([List] line => [Tuple] projected line)
+					  )
+
+	Worked out once from the header line: a projected line holds only the
+	cells of the source columns, picked by their indexes in the trade file.
+	Lines already projected by the reader (see streamLines()) are kept as
+	they are, only made tuples.
+	Raise ValueError if a source column is missing from the headers.
+	"""
+	columnIndex = dict(map(reversed, enumerate(headers)))
+	missing = list(filter(lambda c: not c in columnIndex, sourceColumns))
+	if len(missing) > 0:
+		lognRaise('getProjection(): missing columns in trade file: {0}'.format(', '.join(missing)))
+
+	indexes = list(map(columnIndex.get, sourceColumns))
+	getCells, width = (tuple, len(indexes)) \
+						if indexes == list(range(len(indexes))) else \
+						(itemgetter(*indexes), max(indexes) + 1)
+
+	# a short line (e.g., a blank line of a csv file) is padded with ''
+	project = lambda line: getCells(line) if len(line) >= width else \
+				tuple(map(lambda i: line[i] if i < len(line) else '', indexes))
+
+	return (dict(map(reversed, enumerate(sourceColumns))), project)
+
+
+
+"""
+	[Float or String] value (Excel ordinal, or date string from a THRP report
+		in text) => [String] date (yyyy-mm-dd)
+"""
+toTradeDateString = lambda value: \
+	excelOrdinalToString(value) if isinstance(value, float) else \
+	reformatDate(value, '%Y-%m-%d', '%Y-%m-%d', '%d/%m/%Y', '%d/%m/%y')
+
+
+
 toStringIfFloat = lambda x: \
 	str(int(x)) if isinstance(x, float) else x
 
 
 
+class Position:
+	"""
+	A position (trade) from the trade file.
+
+	It keeps the cells of the source columns of the line, together with a
+	layout (header => index of the cell) shared by all positions of the same
+	file, so no dictionary is built per line. A value is looked up by key: the
+	fields used by the output files (see derivedFields) are computed when
+	asked for, any other key is read from the cell with that header.
+	"""
+	__slots__ = ('layout', 'line')
+
+	def __init__(self, layout, line):
+		self.layout = layout
+		self.line = line
+
+	def __getitem__(self, key):
+		f = derivedFields.get(key)
+		return f(self) if f != None else self.line[self.layout[key]]
+
+	def __contains__(self, key):
+		return key in derivedFields or key in self.layout
+
+	def get(self, key, default=None):
+		return self[key] if key in self else default
+
+	def __getstate__(self):
+		return (self.layout, self.line)
+
+	def __setstate__(self, state):
+		self.layout, self.line = state
+
+	def __repr__(self):
+		return 'Position({0})'.format(dict(map(lambda k: (k, self[k]), derivedFields)))
+
+
+
+"""
+	[Position] p, [String] header => [Object] value in the column of the header
+"""
+getColumn = lambda p, header: p.line[p.layout[header]]
+
+
+
+"""
+	[Position] p => [String] fund name in the accumulate trade file
+"""
+getFundName = lambda p: \
+	getFundNames().get(getPortfolioFromFund(p['Fund'])) \
+	or lognRaise('getFundName(): invalid fund name {0}'.format(p['Fund']))
+
+
+
 """
-	[Dictionary] p => [Dictionary] p
+	[String] key => [Function] ([Position] p => [Object] value)
 
-	Change two date fields (As of Dt, Stl Date) into a string format (yyyy-mm-dd)
+	The fields used by the trustee trade file and the accumulate trade file,
+	with the two date fields (As of Dt, Stl Date) in yyyy-mm-dd format.
 """
-updatePosition = lambda p: \
-	mergeDictionary( p
-				   , { 'Fund': toStringIfFloat(p['Trader Name'])
-				     , 'Ticker & Exc': p['Ticker and Exchange Code']
-				     , 'ISIN': p['ISIN Number']
-				     , 'Shrt Name': p['Short Name']
-				     , 'Crcy': p['Currency']
-				     , 'B/S': p['Buy/Sell']
-				     , 'Amount Pennies': p['Amount (Pennies)']
-				     , 'Price': p['Trade price']
-				     , 'Settle Amount': p['Settlement Total in Settlemen']
-				     , 'Bkr Comm': p['Transaction Cost 1 Amount']
-				     , 'Stamp Duty': p['Transaction Cost 2 Amount']
-				     , 'Exch Fee': p['Transaction Cost 3 Amount']
-				     , 'Trans. Levy': p['Transaction Cost 4 Amount']
-				     , 'Misc Fee': p['Transaction Cost 5 Amount']
-				   	 , 'As of Dt': datetime.strftime( fromExcelOrdinal(p['As of Date'])
-											 		, '%Y-%m-%d')
-				   	 , 'Stl Date': datetime.strftime( fromExcelOrdinal(p['Settlement Date'])
-											 		, '%Y-%m-%d')
-				   	 , 'Accr Int': p['Accrued Interest']
-				   	 , 'FACC Long Name': p['Firm Account Long Name']
-				   	 , 'L1 Tag Nm': 'Trading' if p['Level 1 Tag Name'] == 'AFS' and p['Trader Name'] == '11490-B' \
-				   	 				else p['Level 1 Tag Name']
-				   	 }
-				   )
+derivedFields = \
+	{ 'Fund': lambda p: toStringIfFloat(getColumn(p, 'Trader Name'))
+	, 'Ticker & Exc': lambda p: getColumn(p, 'Ticker and Exchange Code')
+	, 'ISIN': lambda p: getColumn(p, 'ISIN Number')
+	, 'Shrt Name': lambda p: getColumn(p, 'Short Name')
+	, 'Crcy': lambda p: getColumn(p, 'Currency')
+	, 'B/S': lambda p: getColumn(p, 'Buy/Sell')
+	, 'Amount Pennies': lambda p: getColumn(p, 'Amount (Pennies)')
+	, 'Price': lambda p: getColumn(p, 'Trade price')
+	, 'Settle Amount': lambda p: getColumn(p, 'Settlement Total in Settlemen')
+	, 'Bkr Comm': lambda p: getColumn(p, 'Transaction Cost 1 Amount')
+	, 'Stamp Duty': lambda p: getColumn(p, 'Transaction Cost 2 Amount')
+	, 'Exch Fee': lambda p: getColumn(p, 'Transaction Cost 3 Amount')
+	, 'Trans. Levy': lambda p: getColumn(p, 'Transaction Cost 4 Amount')
+	, 'Misc Fee': lambda p: getColumn(p, 'Transaction Cost 5 Amount')
+	, 'As of Dt': lambda p: toTradeDateString(getColumn(p, 'As of Date'))
+	, 'Stl Date': lambda p: toTradeDateString(getColumn(p, 'Settlement Date'))
+	, 'Accr Int': lambda p: getColumn(p, 'Accrued Interest')
+	, 'FACC Long Name': lambda p: getColumn(p, 'Firm Account Long Name')
+	, 'L1 Tag Nm': lambda p: 'Trading' if getColumn(p, 'Level 1 Tag Name') == 'AFS' \
+									and getColumn(p, 'Trader Name') in getAfsToTradingFunds() \
+									else getColumn(p, 'Level 1 Tag Name')
+	, 'Broker Long Name': lambda p: getColumn(p, 'Firm Account Long Name')
+	, 'FundName': getFundName
+	, '': lambda p: ''
+	, 'BuySell': lambda p: 'Buy' if getColumn(p, 'Buy/Sell') == 'B' else 'Sell'
+	}
 
 
 
@@ -122,4 +244,4 @@ def lognContinue(msg, x):
 
 def lognRaise(msg):
 	logger.error(msg)
-	raise ValueError
+	raise ValueError(msg)
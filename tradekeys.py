@@ -0,0 +1,194 @@
+# coding=utf-8
+
+"""
+Keep the keys of all trades in a portfolio's accumulate history, so that a
+trade already in the history is not added again, e.g., a trade re-reported
+in a later THRP report, or a trade file converted again under another date.
+
+A trade key is a 64 bit hash of the trade's row in the accumulate trade file
+plus its occurrence (the second identical row of a day has a different key
+from the first). The keys of a portfolio are stored in
+<outputDir>/tradekeys/<portfolio>.keys, 12 bytes per trade: the key and the
+day (yyyymmdd) the trade was added on. They are loaded into a dictionary, so
+checking a trade is a lookup, and the accumulate trade file is read only once,
+to build the keys the first time.
+
+A trade of a day is a duplicate if its key was added on an earlier day.
+Converting a day again replaces the keys of that day. The keys added on a
+day are also those of the trades already in the day's accumulate trade file,
+so intraday mode (see intraday.py) appends only the trades not among them.
+"""
+from tradefile_11490.utility import reformatDate
+from collections import Counter
+from itertools import chain
+from os.path import join, exists
+import logging, hashlib, struct, os
+logger = logging.getLogger(__name__)
+
+
+
+recordFormat = struct.Struct('<QI')	# key, day
+
+
+
+getKeyFile = lambda outputDir, portfolio: \
+	join(outputDir, 'tradekeys', portfolio + '.keys')
+
+
+
+"""
+	[String] date (yyyy-mm-dd) => [Int] day (yyyymmdd)
+"""
+toDay = lambda date: int(reformatDate(date, '%Y%m%d', '%Y-%m-%d'))
+
+
+
+"""
+	[String] row, [Int] occurrence => [Int] key
+"""
+toKey = lambda row, occurrence: int.from_bytes(
+	hashlib.blake2b('{0}|{1}'.format(row, occurrence).encode(), digest_size=8).digest()
+  , 'little')
+
+
+
+def getRowKeys(rows):
+	"""
+	[Iterable] rows => [Iterator] keys
+	"""
+	occurrences = Counter()
+	for row in rows:
+		occurrences[row] = occurrences[row] + 1
+		yield toKey(row, occurrences[row])
+
+
+
+def loadRecords(keyFile):
+	"""
+	[String] keyFile => [Iterator] (key, day)
+	"""
+	with open(keyFile, 'rb') as f:
+		return recordFormat.iter_unpack(f.read())
+
+
+
+def saveRecords(keyFile, records, append):
+	"""
+	[String] keyFile, [Iterable] (key, day), [Bool] append => [String] keyFile
+	"""
+	os.makedirs(os.path.dirname(keyFile), exist_ok=True)
+	with open(keyFile, 'ab' if append else 'wb') as f:
+		f.write(b''.join(map(lambda r: recordFormat.pack(*r), records)))
+
+	return keyFile
+
+
+
+def seedKeys(outputDir, portfolio, file, date):
+	"""
+	[String] outputDir, [String] portfolio, [String] file (accumulate trade
+		file), [String] date (of the file)
+		=> [String] keyFile
+
+	Side effect: build the keys of the portfolio from an accumulate trade
+	file, all trades in it are taken as added on its date.
+	"""
+	logger.info('seedKeys(): {0} from {1}'.format(portfolio, file))
+	with open(file) as f:
+		rows = map( lambda line: line.rstrip('\n')
+				  , filter(lambda line: line.strip() != '', f))
+		next(rows, None)	# the header
+		return saveRecords( getKeyFile(outputDir, portfolio)
+						  , map(lambda key: (key, toDay(date)), getRowKeys(rows))
+						  , False)
+
+
+
+def loadKeys(outputDir, portfolio, getSeedFile):
+	"""
+	[String] outputDir
+	[String] portfolio
+	[Function] getSeedFile (=> (file, date), the accumulate trade file to
+		build the keys from if they do not exist)
+		=> [List] (key, day)
+	"""
+	keyFile = getKeyFile(outputDir, portfolio)
+	if not exists(keyFile):
+		seedKeys(outputDir, portfolio, *getSeedFile())
+
+	return list(loadRecords(keyFile))
+
+
+
+def hasDayKeys(outputDir, portfolio, date):
+	"""
+	[String] outputDir, [String] portfolio, [String] date (yyyy-mm-dd)
+		=> [Bool] whether keys were added on the date
+	"""
+	keyFile, day = getKeyFile(outputDir, portfolio), toDay(date)
+	return exists(keyFile) and any(map(lambda r: r[1] == day, loadRecords(keyFile)))
+
+
+
+def checkedPositions( outputDir, portfolio, date, positions, toRow, getSeedFile
+					, append=False, skipDuplicates=True):
+	"""
+	[String] outputDir
+	[String] portfolio
+	[String] date (yyyy-mm-dd)
+	[Iterable] positions
+	[Function] toRow (position => row of the accumulate trade file)
+	[Function] getSeedFile (see loadKeys())
+	[Bool] append (the positions are all trades of the day so far, those
+		added on the day before are already in the day's accumulate trade
+		file and are left out, the rest are appended to it)
+	[Bool] skipDuplicates (False means only the keys are kept, a trade added
+		on an earlier day is not skipped)
+		=> ( [Iterator] positions that are not duplicates
+		   , [Function] commit (=> [List] duplicate rows)
+		   )
+
+	Call commit() after the positions are written, to save their keys and
+	report the duplicates skipped.
+	"""
+	day = toDay(date)
+	records = loadKeys(outputDir, portfolio, getSeedFile)
+	rerun = not append and any(map(lambda r: r[1] == day, records))
+	earlier = set(map(lambda r: r[0], filter(lambda r: r[1] < day, records)))
+	added = set(map(lambda r: r[0], filter(lambda r: r[1] == day, records))) \
+				if append else set()
+
+	newKeys, duplicates = [], []
+	occurrences = Counter()
+
+	def check():
+		for position in positions:
+			row = toRow(position)
+			occurrences[row] = occurrences[row] + 1
+			key = toKey(row, occurrences[row])
+			if key in added:
+				continue
+			elif skipDuplicates and key in earlier:
+				duplicates.append(row)
+			else:
+				newKeys.append(key)
+				yield position
+
+
+	def commit():
+		if rerun:
+			saveRecords( getKeyFile(outputDir, portfolio)
+					   , chain( filter(lambda r: r[1] != day, records)
+					   		  , map(lambda key: (key, day), newKeys))
+					   , False)
+		else:
+			saveRecords( getKeyFile(outputDir, portfolio)
+					   , map(lambda key: (key, day), newKeys), True)
+
+		for row in duplicates:
+			logger.warning('checkedPositions(): duplicate trade skipped for {0} on {1}: {2}'.format(portfolio, date, row))
+
+		return duplicates
+
+
+	return (check(), commit)
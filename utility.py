@@ -6,7 +6,9 @@
 # 2. Put functions shared by multiple modules.
 # 
 
-import os, configparser
+from functools import lru_cache
+from datetime import datetime
+import os, configparser, threading, queue
 import logging
 logger = logging.getLogger(__name__)
 
@@ -34,36 +36,303 @@ def _load_config(config_file='tradefile_11490.config'):
 
 
 
-# initialized only once when this module is first imported by others
-if not 'config' in globals():
-	config = _load_config()
+# loaded only once, when a setting is first needed
+config = None
 
 
 
-def getDataDirectory():
+def getConfig():
 	global config
-	return config['directory']['data']
+	if config == None:
+		config = _load_config()
+
+	return config
+
+
+
+def getDataDirectory():
+	return getConfig()['directory']['data']
 
 
 
 def getMailSender():
-	global config
-	return config['email']['sender']
+	return getConfig()['email']['sender']
 
 
 
 def getMailRecipients():
-	global config
-	return config['email']['recipents']
+	return getConfig()['email']['recipents']
 
 
 
 def getMailServer():
-	global config
-	return config['email']['server']
+	return getConfig()['email']['server']
 
 
 
 def getMailTimeout():
-	global config
-	return float(config['email']['timeout'])
\ No newline at end of file
+	return float(getConfig()['email']['timeout'])
+
+
+def getNotificationRetries():
+	return int(getConfig()['notification']['retries'])
+
+
+
+def getNotificationBackoff():
+	return float(getConfig()['notification']['backoff'])
+
+
+
+def getNotificationIdle():
+	return float(getConfig()['notification']['idle'])
+
+
+
+def getNotificationSpool():
+	return os.path.join(getCurrentDirectory(), getConfig()['notification']['spool'])
+
+
+
+def getMetricsEnabled():
+	return getConfig()['metrics'].getboolean('enabled')
+
+
+
+def getMetricsDirectory():
+	return os.path.join(getCurrentDirectory(), getConfig()['metrics']['directory'])
+
+
+
+def getCacheEnabled():
+	return getConfig()['cache'].getboolean('enabled')
+
+
+
+def getCacheDirectory():
+	return os.path.join(getCurrentDirectory(), getConfig()['cache']['directory'])
+
+
+
+def getCacheMaxSize():
+	"""
+	=> [Int] maximum size of the cache in bytes
+	"""
+	return int(float(getConfig()['cache']['maxsize']) * 1024 * 1024)
+
+
+
+def getCacheMaxAge():
+	"""
+	=> [Float] maximum age of a cache entry in seconds
+	"""
+	return float(getConfig()['cache']['maxage']) * 24 * 3600
+
+
+
+def getStoreEnabled():
+	return getConfig()['store'].getboolean('enabled')
+
+
+
+def getStoreFile():
+	return os.path.join(getCurrentDirectory(), getConfig()['store']['file'])
+
+
+
+def getIntradayEnabled():
+	return getConfig()['intraday'].getboolean('enabled')
+
+
+
+def getDedupeEnabled():
+	return getConfig()['dedupe'].getboolean('enabled')
+
+
+
+def getLedgerEnabled():
+	return getConfig()['ledger'].getboolean('enabled')
+
+
+
+def getLedgerKeep():
+	return getConfig()['ledger'].getboolean('keep')
+
+
+
+
+def getValidationEnabled():
+	return getConfig()['validation'].getboolean('enabled')
+
+
+
+def getValidationTolerance():
+	return float(getConfig()['validation']['tolerance'])
+
+
+
+def getProfileEnabled():
+	return getConfig()['profile'].getboolean('enabled')
+
+
+
+def getProfileDirectory():
+	return os.path.join(getCurrentDirectory(), getConfig()['profile']['directory'])
+
+
+
+def getProfileKeep():
+	return int(getConfig()['profile']['keep'])
+
+
+
+def getProfileTop():
+	return int(getConfig()['profile']['top'])
+
+
+
+def getWatchMode():
+	return getConfig()['watch']['mode']
+
+
+
+def getWatchSettleTime():
+	return float(getConfig()['watch']['settle'])
+
+
+
+def getWatchInterval():
+	return float(getConfig()['watch']['interval'])
+
+
+
+def getServiceAddress():
+	"""
+	=> ([String] host, [Int] port) of the conversion service
+	"""
+	return (getConfig()['service']['host'], int(getConfig()['service']['port']))
+
+
+
+def getServiceWorkers():
+	return int(getConfig()['service']['workers'])
+
+
+
+def getServiceQueueSize():
+	return int(getConfig()['service']['queue'])
+
+
+
+def fanOut(iterable, *consumers, bufferSize=1000):
+	"""
+	[Iterable] iterable
+	[Function] consumers ([Iterator] => [Object] result)
+	[Int] bufferSize
+		=> [Tuple] results of the consumers
+
+	Feed every item of the iterable to all the consumers in a single pass.
+	The first consumer runs in the calling thread, each of the others in its
+	own thread, fed through a bounded queue. So the memory used is bounded by
+	the buffer size, unlike itertools.tee, which keeps every item that one
+	consumer is ahead of the others.
+
+	If the iterable or any consumer fails, the other consumers see their
+	iterator fail as well, and the first exception is raised.
+	"""
+	end, abort = object(), object()
+	queues = [queue.Queue(bufferSize) for _ in consumers[1:]]
+	results = [None] * len(consumers)
+	errors = [None] * len(consumers)
+
+
+	def drain(q):
+		while True:
+			item = q.get()
+			if item is end:
+				return
+			elif item is abort:
+				raise ValueError('fanOut(): aborted')
+			else:
+				yield item
+
+
+	def run(i, q):
+		try:
+			results[i] = consumers[i](drain(q))
+		except BaseException as e:
+			errors[i] = e
+
+
+	threads = [ threading.Thread(target=run, args=(i+1, q), daemon=True) \
+				for i, q in enumerate(queues)]
+
+
+	def put(i, item):
+		# don't block on a consumer that has already stopped
+		while threads[i].is_alive():
+			try:
+				queues[i].put(item, timeout=0.1)
+				return
+			except queue.Full:
+				pass
+
+
+	def tap(items):
+		for item in items:
+			for i in range(len(queues)):
+				put(i, item)
+			yield item
+
+
+	for t in threads:
+		t.start()
+
+	marker = abort
+	try:
+		results[0] = consumers[0](tap(iter(iterable)))
+		marker = end
+	finally:
+		for i in range(len(queues)):
+			put(i, marker)
+		for t in threads:
+			t.join()
+
+	for e in errors:
+		if e != None:
+			raise e
+
+	return tuple(results)
+
+
+
+"""
+	Date conversions, cached. A trade file or a batch of accumulate trade files
+	has only a handful of distinct dates, so the same conversion is asked for
+	over and over again.
+"""
+@lru_cache(maxsize=4096)
+def excelOrdinalToString(ordinal, fmt='%Y-%m-%d'):
+	"""
+	[Float] ordinal (Excel date), [String] fmt => [String] date
+	"""
+	from utils.utility import fromExcelOrdinal	# only when a date is converted
+	return datetime.strftime(fromExcelOrdinal(ordinal), fmt)
+
+
+
+@lru_cache(maxsize=4096)
+def reformatDate(s, toFormat, *fromFormats):
+	"""
+	[String] s, [String] toFormat, [String] fromFormats => [String] date
+
+	Parse the date string with the first of the formats that works, then
+	format it. Raise ValueError if none of the formats works.
+	"""
+	for fromFormat in fromFormats:
+		try:
+			return datetime.strftime(datetime.strptime(s, fromFormat), toFormat)
+		except ValueError:
+			pass
+
+	raise ValueError('reformatDate(): invalid date {0}'.format(s))
\ No newline at end of file
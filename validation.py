@@ -0,0 +1,204 @@
+# coding=utf-8
+
+"""
+Validate the positions of a trade file before anything is written, so that a
+bad row fails the conversion at once with a clear report, instead of a
+KeyError half way through or a wrong line in the CL trustee trade file.
+
+The checks are compiled once for each header layout (see compileSchema()):
+the column index of every check is looked up when the schema is compiled,
+so a row is checked by reading its cells directly. The headers always hold
+the source columns, a trade file missing one of them fails on reading (see
+getProjection() in trade.py).
+
+For each row:
+
+1. Trader Name, Ticker and Exchange Code, Currency and Firm Account Long
+	Name are not empty;
+2. Buy/Sell is B or S;
+3. Amount, Trade price and Settlement Total are numbers, the transaction
+	costs and Accrued Interest are numbers or empty;
+4. As of Date and Settlement Date are dates;
+5. the amounts add up: amount x price + costs + accrued interest equals the
+	settlement total for a buy, amount x price - costs + accrued interest for
+	a sell, within the tolerance in the config file.
+
+All rows of the batch are checked and all errors are reported together: in
+the log and in a csv report, validation/<portfolio>_<yyyymmdd>.csv in the
+output directory. Then ValidationError is raised.
+"""
+from tradefile_11490.trade import toTradeDateString, getColumn
+from tradefile_11490.utility import getValidationTolerance
+from functools import lru_cache
+from itertools import chain
+from os.path import join
+import logging, csv, os
+logger = logging.getLogger(__name__)
+
+
+
+class ValidationError(ValueError):
+	"""
+	Raised when positions fail validation, errors is a list of
+	(row, fund, ticker, column, message).
+	"""
+	def __init__(self, errors):
+		super(ValidationError, self).__init__('{0} validation errors'.format(len(errors)))
+		self.errors = errors
+
+
+
+costColumns = [ 'Transaction Cost 1 Amount', 'Transaction Cost 2 Amount'
+			  , 'Transaction Cost 3 Amount', 'Transaction Cost 4 Amount'
+			  , 'Transaction Cost 5 Amount']
+
+textColumns = [ 'Trader Name', 'Ticker and Exchange Code', 'Currency'
+			  , 'Firm Account Long Name']
+
+numberColumns = ['Amount (Pennies)', 'Trade price', 'Settlement Total in Settlemen']
+
+optionalNumberColumns = costColumns + ['Accrued Interest']
+
+dateColumns = ['As of Date', 'Settlement Date']
+
+reportHeaders = ['row', 'fund', 'ticker', 'column', 'error']
+
+
+
+isNumber = lambda x: isinstance(x, float) and not isinstance(x, bool)
+
+
+
+def isDate(x):
+	try:
+		toTradeDateString(x)
+		return True
+	except (ValueError, TypeError):
+		return False
+
+
+
+"""
+	[Object] x (number or empty) => [Float] x
+"""
+toNumber = lambda x: 0.0 if x == '' else x
+
+
+
+@lru_cache(maxsize=16)
+def compileSchema(headers, tolerance):
+	"""
+	[Tuple] headers, [Float] tolerance
+		=> [Function] ([List] line => [List] (column, message))
+	"""
+	index = dict(map(reversed, enumerate(headers)))
+
+	# [String] column, [Function] isValid, [String] message => check
+	toCheck = lambda column, isValid, message: \
+		lambda line: [] if isValid(line[index[column]]) else \
+					[(column, '{0} {1}'.format(message, repr(line[index[column]])))]
+
+	checks = \
+		list(map( lambda c: toCheck(c, lambda x: x != '', 'empty')
+				, textColumns)) \
+	  + [toCheck('Buy/Sell', lambda x: x in ('B', 'S'), 'invalid Buy/Sell code')] \
+	  + list(map( lambda c: toCheck(c, isNumber, 'not a number')
+				, numberColumns)) \
+	  + list(map( lambda c: toCheck(c, lambda x: x == '' or isNumber(x), 'not a number')
+				, optionalNumberColumns)) \
+	  + list(map( lambda c: toCheck(c, isDate, 'not a date')
+				, dateColumns))
+
+	costIndexes = list(map(index.get, optionalNumberColumns[:-1]))
+	amount, price, settle, accrued, buySell = map( index.get
+												 , numberColumns + ['Accrued Interest', 'Buy/Sell'])
+
+	def checkTotal(line):
+		gross = line[amount] * line[price]
+		costs = sum(map(lambda i: toNumber(line[i]), costIndexes))
+		expected = gross + (costs if line[buySell] == 'B' else -costs) + toNumber(line[accrued])
+		return [] if abs(expected - line[settle]) <= max(0.01, abs(gross) * tolerance) else \
+				[( 'Settlement Total in Settlemen'
+				 , '{0} does not match amount x price and costs ({1:.2f})'.format(line[settle], expected))]
+
+
+	def check(line):
+		errors = list(chain.from_iterable(map(lambda f: f(line), checks)))
+		return errors if len(errors) > 0 else checkTotal(line)
+
+
+	return check
+
+
+
+"""
+	[Dictionary] layout (header => column index) => [Tuple] headers
+"""
+toHeaders = lambda layout: tuple(sorted(layout, key=layout.get))
+
+
+
+def getErrors(positions, tolerance):
+	"""
+	[List] positions, [Float] tolerance
+		=> [List] (row, fund, ticker, column, message)
+
+	Row is the position's number in the batch, starting from 1. Positions of
+	the same file share one layout, so its schema is looked up once.
+	"""
+	schemas = {}	# id(layout) => schema
+
+	def getSchema(layout):
+		if not id(layout) in schemas:
+			schemas[id(layout)] = compileSchema(toHeaders(layout), tolerance)
+		return schemas[id(layout)]
+
+
+	def getRowErrors(n, p):
+		return map( lambda e: (n, getColumn(p, 'Trader Name'), getColumn(p, 'Ticker and Exchange Code')) + e
+				  , getSchema(p.layout)(p.line))
+
+
+	return list(chain.from_iterable(map( lambda t: getRowErrors(*t)
+									   , enumerate(positions, 1))))
+
+
+
+def writeReport(outputDir, portfolio, date, errors):
+	"""
+	[String] outputDir, [String] portfolio, [String] date (yyyy-mm-dd)
+	[List] errors
+		=> [String] report file
+	"""
+	directory = join(outputDir, 'validation')
+	os.makedirs(directory, exist_ok=True)
+	file = join(directory, '{0}_{1}.csv'.format(portfolio, date.replace('-', '')))
+	with open(file, 'w', newline='') as f:
+		writer = csv.writer(f)
+		writer.writerow(reportHeaders)
+		writer.writerows(errors)
+
+	return file
+
+
+
+def validatePositions(outputDir, portfolio, date, positions):
+	"""
+	[String] outputDir, [String] portfolio, [String] date (yyyy-mm-dd)
+	[Iterable] positions
+		=> [List] positions
+
+	Raise ValidationError if any position is invalid, after writing the
+	report of all errors.
+	"""
+	positions = list(positions)
+	errors = getErrors(positions, getValidationTolerance())
+	if len(errors) == 0:
+		return positions
+
+	for e in errors:
+		logger.error('validatePositions(): row {0} ({1} {2}): {3}: {4}'.format(*e))
+
+	file = writeReport(outputDir, portfolio, date, errors)
+	logger.error('validatePositions(): {0} errors, see {1}'.format(len(errors), file))
+	raise ValidationError(errors)
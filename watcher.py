@@ -0,0 +1,187 @@
+# coding=utf-8
+
+"""
+Watch the input directory and convert a trade file within seconds after it
+arrives, instead of scanning the directory every 10 minutes.
+
+Changes to the directory are picked up by inotify where available (Linux,
+local file system). Otherwise, e.g., on a network share, the directory is
+polled. Either way a trade file is only handed over for conversion after its
+size and modification time have stayed the same for a while (the settle
+time), and, for a xlsx file, after it is a complete zip archive. So a half
+written file is never parsed.
+"""
+from os.path import join
+import logging, os, sys, time, select, struct, zipfile
+logger = logging.getLogger(__name__)
+
+
+
+# inotify event masks, see <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+
+
+def getInotifyWaiter(directory):
+	"""
+	[String] directory => [Function] wait, None if inotify is not available
+
+	wait([Float] timeout) blocks until something changes in the directory or
+	the timeout (seconds) expires. All pending events are consumed in one go,
+	so a burst of writes to a file counts as one change.
+	"""
+	if not sys.platform.startswith('linux'):
+		logger.debug('getInotifyWaiter(): inotify not available on {0}'.format(sys.platform))
+		return None
+
+	try:
+		import ctypes, ctypes.util
+		libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		fd = libc.inotify_init1(os.O_NONBLOCK)
+		if fd < 0:
+			return None
+
+		if libc.inotify_add_watch( fd, os.fsencode(directory)
+								 , IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+			os.close(fd)
+			return None
+
+	except (OSError, AttributeError, TypeError):
+		logger.debug('getInotifyWaiter(): inotify not available')
+		return None
+
+
+	def wait(timeout):
+		readable, _, _ = select.select([fd], [], [], timeout)
+		if len(readable) > 0:
+			try:
+				while len(os.read(fd, 64 * (struct.calcsize('iIII') + 256))) > 0:
+					pass
+			except BlockingIOError:
+				pass
+
+	return wait
+
+
+
+"""
+	[Float] timeout => None
+
+	The polling fallback, just sleep.
+"""
+pollWaiter = time.sleep
+
+
+
+def getFileState(file):
+	"""
+	[String] file => ([Int] size, [Int] modification time), None if the file
+		is gone.
+	"""
+	try:
+		stat = os.stat(file)
+		return (stat.st_size, stat.st_mtime_ns)
+	except FileNotFoundError:
+		return None
+
+
+
+def isComplete(file):
+	"""
+	[String] file => [Bool] whether the file looks completely written.
+
+	A xlsx file is a zip archive, whose central directory is written last.
+	Other files just need to be readable.
+	"""
+	try:
+		if file.endswith('.xlsx'):
+			return zipfile.is_zipfile(file)
+
+		with open(file, 'rb'):
+			return True
+
+	except OSError:
+		return False
+
+
+
+def stableFiles(directory, isCandidate, settleTime, pollInterval, wait):
+	"""
+	[String] directory
+	[Function] isCandidate ([String] file name => [Bool])
+	[Float] settleTime (seconds a file must stay unchanged)
+	[Float] pollInterval (seconds between scans when nothing is pending)
+	[Function] wait ([Float] timeout => None)
+		=> [Iterator] file names
+
+	Yield a candidate file once it has settled. A file is yielded again only
+	if it changes afterwards, e.g., a conversion failed and the file is
+	replaced.
+	"""
+	pending = {}	# file name => (state, time when the state was first seen)
+	done = {}		# file name => state when it was yielded
+
+	while True:
+		now = time.monotonic()
+		current = dict(filter( lambda t: t[1] != None
+							 , map( lambda fn: (fn, getFileState(join(directory, fn)))
+							 	  , filter(isCandidate, os.listdir(directory)))))
+
+		for fn, state in current.items():
+			if done.get(fn) == state:
+				continue
+
+			if not fn in pending or pending[fn][0] != state:
+				pending[fn] = (state, now)
+
+			elif now - pending[fn][1] >= settleTime and isComplete(join(directory, fn)):
+				del pending[fn]
+				done[fn] = state
+				yield fn
+
+		pending = dict(filter(lambda t: t[0] in current, pending.items()))
+		done = dict(filter(lambda t: t[0] in current, done.items()))
+
+		wait(min(settleTime, pollInterval) if len(pending) > 0 else pollInterval)
+
+
+
+def watch(directory, getPortfolio, convert, settleTime, pollInterval, mode='auto'):
+	"""
+	[String] directory
+	[Function] getPortfolio ([String] file name => [String] portfolio, None
+		if the file is not a trade file)
+	[Function] convert ([String] file name, [String] portfolio => [Bool])
+	[Float] settleTime
+	[Float] pollInterval
+	[String] mode ('auto', 'inotify' or 'poll')
+
+	Run forever, convert trade files as they arrive in the directory.
+
+	In 'auto' mode inotify is used if available, with the poll interval as an
+	upper bound of waiting, so that changes not reported by inotify (e.g.,
+	made by another machine on a network share) are still picked up.
+	"""
+	wait = getInotifyWaiter(directory) if mode in ('auto', 'inotify') else None
+	if wait == None:
+		if mode == 'inotify':
+			lognRaise('watch(): inotify not available for {0}'.format(directory))
+
+		wait = pollWaiter
+
+	logger.info('watch(): {0}, {1}'.format( directory
+										  , 'poll' if wait == pollWaiter else 'inotify'))
+
+	for fn in stableFiles( directory, lambda fn: getPortfolio(fn) != None
+						 , settleTime, pollInterval, wait):
+		logger.info('watch(): convert {0}'.format(fn))
+		convert(fn, getPortfolio(fn))
+
+
+
+def lognRaise(msg):
+	logger.error(msg)
+	raise ValueError